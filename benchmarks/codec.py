@@ -0,0 +1,73 @@
+"""
+benchmarks/codec.py - Compares the JSON codecs on RTM traffic.
+
+Run from a checkout with::
+
+	PYTHONPATH=src python benchmarks/codec.py [recorded.jsonl]
+
+``recorded.jsonl`` holds RTM frames as received, one per line.  Without one,
+a generated mix of typical frames is used.
+"""
+
+from __future__ import absolute_import
+from argparse import ArgumentParser, FileType
+import random
+import timeit
+from slackrealtime.codec import CODECS
+
+
+def sample_frames(count=1000):
+	"""
+	Generates a mix of frames similar to a busy team's traffic.
+	"""
+	random.seed(0)
+	frames = []
+	for i in range(count):
+		ts = '%.6f' % (1.5e9 + i)
+		kind = random.random()
+		if kind < .6:
+			frames.append({
+				'type': 'message', 'channel': 'C%05d' % random.randrange(100),
+				'user': 'U%05d' % random.randrange(1000), 'ts': ts,
+				'text': 'deploy <@U%05d> finished in %d seconds :tada:' % (random.randrange(1000), random.randrange(999)),
+				'team': 'T00001', 'source_team': 'T00001',
+				'blocks': [{'type': 'rich_text', 'block_id': 'b%d' % i, 'elements': [
+					{'type': 'rich_text_section', 'elements': [{'type': 'text', 'text': 'deploy finished'}]}]}],
+			})
+		elif kind < .8:
+			frames.append({'type': 'user_typing', 'channel': 'C%05d' % random.randrange(100), 'user': 'U%05d' % random.randrange(1000)})
+		elif kind < .95:
+			frames.append({'type': 'presence_change', 'user': 'U%05d' % random.randrange(1000), 'presence': random.choice(['active', 'away'])})
+		else:
+			frames.append({'type': 'reaction_added', 'user': 'U%05d' % random.randrange(1000), 'reaction': 'thumbsup',
+				'item': {'type': 'message', 'channel': 'C00001', 'ts': ts}, 'event_ts': ts, 'ts': ts})
+	return frames
+
+
+def main():
+	parser = ArgumentParser()
+	parser.add_argument('recorded', nargs='?', type=FileType('rb'),
+		help='RTM frames to decode, one per line [default: generated frames]')
+	parser.add_argument('-r', '--repeat', type=int, default=5,
+		help='Number of times to run each codec, keeping the best [default: %(default)s]')
+	options = parser.parse_args()
+
+	if options.recorded is None:
+		reference = CODECS[-1]()
+		raw = [reference.dumps(f) for f in sample_frames()]
+	else:
+		raw = [line.strip() for line in options.recorded if line.strip()]
+
+	total = sum(len(r) for r in raw)
+	print('%d frames, %d bytes' % (len(raw), total))
+	for codec_class in CODECS:
+		codec = codec_class()
+		frames = [codec.loads(r) for r in raw]
+		loads = min(timeit.repeat(lambda: [codec.loads(r) for r in raw], number=1, repeat=options.repeat))
+		dumps = min(timeit.repeat(lambda: [codec.dumps(f) for f in frames], number=1, repeat=options.repeat))
+		print('%-9s loads %6.2f us/frame %7.1f MB/s   dumps %6.2f us/frame' % (
+			codec.name, loads / len(raw) * 1e6, total / loads / 1e6, dumps / len(raw) * 1e6))
+
+
+if __name__ == '__main__':
+	main()
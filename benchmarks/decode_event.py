@@ -0,0 +1,37 @@
+"""
+benchmarks/decode_event.py - Measures the cost of decoding RTM events.
+
+Run from a checkout with::
+
+	PYTHONPATH=src python benchmarks/decode_event.py
+
+To compare against an older revision, check it out somewhere else (eg: with
+``git worktree add``) and point PYTHONPATH at its ``src`` directory instead.
+"""
+
+from __future__ import absolute_import
+from argparse import ArgumentParser
+import timeit
+from slackrealtime.event import decode_event
+
+FRAMES = [
+	{'type': 'user_typing', 'channel': 'C1', 'user': 'U1'},
+	{'type': 'presence_change', 'user': 'U1', 'presence': 'away'},
+	{'type': 'message', 'channel': 'C1', 'user': 'U1', 'text': 'hi', 'ts': '1500000000.000100'},
+	{'type': 'reaction_added', 'user': 'U1', 'reaction': 'x', 'event_ts': '1500000000.000200', 'ts': '1500000000.000100'},
+]
+
+
+def main():
+	parser = ArgumentParser()
+	parser.add_argument('-n', '--number', type=int, default=100000,
+		help='Events to decode per frame type [default: %(default)s]')
+	options = parser.parse_args()
+
+	for frame in FRAMES:
+		t = min(timeit.repeat(lambda: decode_event(frame), number=options.number, repeat=3))
+		print('%-16s %6.2f us/event' % (frame['type'], t / options.number * 1e6))
+
+
+if __name__ == '__main__':
+	main()
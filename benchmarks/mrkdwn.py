@@ -0,0 +1,80 @@
+"""
+benchmarks/mrkdwn.py - Measures translating Slack mrkdwn, against the chain
+of regular expressions format_logs used before slackrealtime.mrkdwn.
+
+Run from a checkout with::
+
+	PYTHONPATH=src python benchmarks/mrkdwn.py
+
+Messages are generated from a fixed seed: some with a little markup
+(mentions, links, bold, italic, code and emoji), and some plain text.
+"""
+
+from __future__ import absolute_import
+from argparse import ArgumentParser
+import random
+import re
+import timeit
+from slackrealtime.mrkdwn import HtmlTranslator, MarkdownTranslator
+
+# format_logs.slack_to_markdown(), before it used slackrealtime.mrkdwn.
+USERNAME_RE = re.compile(r'\<@(U[A-Z0-9]+)\|([a-zA-Z0-9]+)\>')
+BOLD_RE = re.compile(r'(\s)\*([^*\n]+?)\*')
+ITALIC_RE = re.compile(r'(\s)_([^_\n]+?)_')
+PRETTY_HYPERLINK_RE = re.compile(r'\<(http[^>|\n]+?)(\|([^>\n]+?))?\>')
+
+
+def regex_chain(i):
+	o = BOLD_RE.sub(lambda m: ('%s**%s**' % (m.group(1), m.group(2))), i)
+	o = ITALIC_RE.sub(lambda m: ('%s*%s*' % (m.group(1), m.group(2))), o)
+	o = USERNAME_RE.sub(lambda m: ('**@%s**' % (m.group(2),)), o)
+	o = PRETTY_HYPERLINK_RE.sub(lambda m: ' %s ' % (('[%s](%s)' % (m.group(3), m.group(1))) if m.group(2) else m.group(1)), o)
+	return o
+
+
+WORDS = ['the', 'deploy', 'failed', 'again', 'on', 'prod', 'please', 'check',
+	'logs', 'ok', 'thanks', 'looking', 'into', 'it', 'now']
+
+
+def make_messages(number, rng):
+	marks = [
+		lambda: '*urgent*',
+		lambda: '_maybe_',
+		lambda: '<@U%05d|user%d>' % (rng.randrange(99999), rng.randrange(99)),
+		lambda: '<https://example.com/build/%d|build>' % rng.randrange(9999),
+		lambda: '`make test`',
+		lambda: ':+1:',
+	]
+
+	marked_up = []
+	for i in range(number):
+		parts = [rng.choice(WORDS) for _ in range(rng.randrange(4, 30))]
+		for _ in range(rng.randrange(0, 3)):
+			parts.insert(rng.randrange(len(parts) + 1), rng.choice(marks)())
+		marked_up.append(' '.join(parts))
+
+	plain = [' '.join(rng.choice(WORDS) for _ in range(15)) for i in range(number)]
+	return [('marked up', marked_up), ('plain', plain)]
+
+
+def main():
+	parser = ArgumentParser()
+	parser.add_argument('-n', '--number', type=int, default=10000,
+		help='Messages of each kind to translate [default: %(default)s]')
+	options = parser.parse_args()
+
+	translators = [
+		('regex chain', regex_chain),
+		('to_markdown', MarkdownTranslator().translate),
+		('to_html', HtmlTranslator().translate),
+	]
+
+	for name, messages in make_messages(options.number, random.Random(0)):
+		size = sum(len(m) for m in messages)
+		for label, translate in translators:
+			t = min(timeit.repeat(lambda: [translate(m) for m in messages], number=1, repeat=5))
+			print('%-10s %-12s %6.2f MB/s  %5.2f us/msg' % (name, label, size / t / 1e6, t / len(messages) * 1e6))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,63 @@
+"""
+benchmarks/update.py - Measures the cost of passing events to the session
+metadata, on traffic which is mostly messages.
+
+Run from a checkout with::
+
+	PYTHONPATH=src python benchmarks/update.py
+
+Updates are applied straight away rather than on the reactor, so that the
+time taken to apply them is counted too.  Older revisions, which applied
+them in the reactor's thread pool, are measured the same way, so
+PYTHONPATH may point at another checkout to compare them.
+"""
+
+from __future__ import absolute_import
+from argparse import ArgumentParser
+import timeit
+from slackrealtime.event import decode_event
+from slackrealtime.session import SessionMetadata
+from twisted.internet import reactor
+
+
+class InlineSessionMetadata(SessionMetadata):
+	def _schedule_flush(self, delay):
+		self.flush()
+
+	def _cancel_flush(self, handle):
+		pass
+
+
+def _call_inline(func, *args, **kwargs):
+	func(*args, **kwargs)
+
+
+def main():
+	parser = ArgumentParser()
+	parser.add_argument('-n', '--number', type=int, default=20000,
+		help='Batches of 20 events to pass in [default: %(default)s]')
+	options = parser.parse_args()
+	reactor.callInThread = _call_inline
+
+	data = dict(
+		url='wss://example.invalid/', self={}, team={u'id': u'T1', u'prefs': {}},
+		users=[{u'id': u'U%d' % i, u'name': u'u%d' % i} for i in range(1000)],
+		channels=[{u'id': u'C1', u'name': u'general'}], groups=[], ims=[], bots=[])
+	meta = InlineSessionMetadata(data, None, 'xoxb-benchmark')
+
+	# 90% messages, as on a typical team.
+	events = [decode_event({u'type': u'message', u'channel': u'C1', u'user': u'U1', u'text': u'hi', u'ts': u'1.0'})] * 18 + [
+		decode_event({u'type': u'user_typing', u'channel': u'C1', u'user': u'U1'}),
+		decode_event({u'type': u'presence_change', u'user': u'U1', u'presence': u'away'}),
+	]
+
+	def run():
+		for event in events:
+			meta.update(event)
+
+	t = min(timeit.repeat(run, number=options.number, repeat=3))
+	print('%.3f us/event' % (t / options.number / len(events) * 1e6))
+
+
+if __name__ == '__main__':
+	main()
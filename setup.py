@@ -27,6 +27,9 @@ setup(
         'zope.interface',
         'PyOpenSSL',
     ],
+    extras_require={
+        'asyncio': ['aiohttp'],
+    },
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Framework :: Twisted',
@@ -17,24 +17,60 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from __future__ import absolute_import
-from autobahn.twisted.websocket import WebSocketClientFactory, connectWS
 import warnings
 
-from .protocol import RtmProtocol
 from .session import request_session
 
-def connect(token, protocol=RtmProtocol, factory=WebSocketClientFactory, factory_kwargs=None, api_url=None, debug=False):
+
+def __getattr__(name):
+	# autobahn only supports one networking library per process, so its Twisted
+	# support is only loaded on demand.  This leaves slackrealtime.aio usable.
+	if name == 'RtmProtocol':
+		from .protocol import RtmProtocol
+		return RtmProtocol
+
+	raise AttributeError(name)
+
+
+def connect(token, protocol=None, factory=None, factory_kwargs=None, api_url=None, debug=False, codec=None, lean=False, cache=None, compact=False):
 	"""
 	Creates a new connection to the Slack Real-Time API.
 
+	``protocol`` defaults to ``RtmProtocol``, and ``factory`` to autobahn's
+	``WebSocketClientFactory``.
+
+	``codec`` selects the JSON library used for the connection and API calls,
+	either by name (eg: ``'orjson'``) or as a ``JsonCodec`` instance.  By
+	default, the fastest one installed is used.
+
+	If ``lean`` is set, the session is started with ``rtm.connect`` rather than
+	``rtm.start``, so that large teams can connect sooner.  Users and
+	conversations are then loaded in the background, a page at a time.  Until
+	they are, the session's find_*() methods may raise KeyError.
+
+	``cache`` is the path of a file to keep a snapshot of the metadata in.  If
+	it already has one, the session starts from that, and only refreshes what
+	has changed.
+
+	If ``compact`` is set, only commonly used fields of users and channels are
+	kept in memory (see ``slackrealtime.store``).
+
 	Returns (connection) which represents this connection to the API server.
 
 	"""
+	from autobahn.twisted.websocket import WebSocketClientFactory, connectWS
+
+	if protocol is None:
+		from .protocol import RtmProtocol as protocol
+	if factory is None:
+		factory = WebSocketClientFactory
 	if factory_kwargs is None:
 		factory_kwargs = dict()
 
-	metadata = request_session(token, api_url)
+	metadata = request_session(token, api_url, codec, lean, cache, compact)
 	wsfactory = factory(metadata.url, **factory_kwargs)
+	# For factories which reuse the session, like ReconnectingWebSocketClientFactory.
+	wsfactory.meta = metadata
 	if debug:
 		warnings.warn('debug=True has been deprecated in autobahn 0.14.0')
 
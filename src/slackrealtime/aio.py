@@ -0,0 +1,196 @@
+"""
+slackrealtime/aio.py - asyncio client for Slack RTM
+Copyright 2020 Michael Farrell <http://micolous.id.au>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import absolute_import
+import asyncio
+from autobahn.asyncio.websocket import WebSocketClientFactory, WebSocketClientProtocol
+from autobahn.websocket.util import parse_url
+import logging
+from .aioapi import AioSlackApi
+from .cache import MetadataCache
+from .rtm import BaseRtmProtocol
+from .session import SessionMetadata
+
+logger = logging.getLogger(__name__)
+
+
+class AioSessionMetadata(SessionMetadata):
+	"""
+	SessionMetadata which applies updates on the asyncio event loop, and makes
+	API calls with AioSlackApi.
+	"""
+	def _schedule_flush(self, delay):
+		return asyncio.get_event_loop().call_later(delay, self.flush)
+
+	def _cancel_flush(self, handle):
+		handle.cancel()
+
+	def _run_in_background(self, func):
+		return asyncio.get_event_loop().run_in_executor(None, func)
+
+	def _log_error(self, msg):
+		logger.exception(msg)
+
+	def _nonblocking_api(self):
+		if isinstance(self.api, AioSlackApi):
+			return self.api
+
+		if self.txapi is None:
+			self.txapi = AioSlackApi(self.api.url, codec=self.api.codec, timeout=self.api.timeout)
+		return self.txapi
+
+	def _fetch_resource(self, group, field, **params):
+		"""
+		Requests a single resource with ``group.info``, without blocking.
+		Returns a Future which resolves to the resource.
+		"""
+		async def fetch():
+			response = await getattr(self._nonblocking_api(), group).info(token=self.token, **params)
+			return response[field]
+		return asyncio.ensure_future(fetch())
+
+	async def find_im_by_user_name(self, name, auto_create=True):
+		"""
+		Finds the ID of the IM with a particular user by name, with the option
+		to automatically create a new channel if it doesn't exist.
+
+		Unlike SessionMetadata.find_im_by_user_name, this is a coroutine, as
+		creating the channel calls ``im.open`` without blocking the event loop.
+		"""
+		uid = self.find_user_by_name(name)[0]
+		try:
+			return self.find_im_by_user_id(uid)
+		except KeyError:
+			# IM does not exist, create it?
+			if auto_create:
+				response = await self._nonblocking_api().im.open(token=self.token, user=uid)
+				return response[u'channel'][u'id']
+			else:
+				raise
+
+	async def fill(self):
+		"""
+		Loads all remaining users and conversations in a lean session, a page at
+		a time, without blocking the event loop.  AioRtmProtocol does this in the
+		background once connected.
+		"""
+		while True:
+			kind = self.next_incomplete()
+			if kind is None:
+				return
+			generation = self._generation
+			self._apply_page(kind, await self._request_page(self._nonblocking_api(), kind), generation)
+
+
+class AioRtmProtocol(BaseRtmProtocol, WebSocketClientProtocol):
+	"""
+	Slack RTM protocol for asyncio.  This has the same interface as
+	``RtmProtocol``, except that API calls return Futures rather than
+	Deferreds.
+	"""
+	def _makeApi(self, meta):
+		return meta._nonblocking_api()
+
+	def _then(self, future, callback, errback=None):
+		async def then():
+			try:
+				result = callback(await future)
+				if asyncio.isfuture(result):
+					# Chained to another call.
+					result = await result
+				return result
+			except Exception as e:
+				if errback is None:
+					raise
+				return errback(e)
+		return asyncio.ensure_future(then())
+
+	def _now(self):
+		return asyncio.get_event_loop().time()
+
+	def _callLater(self, delay, func, *args):
+		return asyncio.get_event_loop().call_later(delay, func, *args)
+
+	def _makeWaiter(self):
+		return asyncio.get_event_loop().create_future()
+
+	def _resolve(self, future, result):
+		if not future.done():
+			future.set_result(result)
+
+	def _reject(self, future, error):
+		if not future.done():
+			future.set_exception(error)
+
+	def _logError(self, msg):
+		logger.exception(msg)
+
+	def onSlackEvent(self, event):
+		logger.info('Default onSlackEvent() handler called.')
+
+
+async def request_session(token, url=None, codec=None, lean=False, cache=None, compact=False):
+	"""
+	Requests a WebSocket session for the Real-Time Messaging API, without
+	blocking the event loop.
+
+	If ``lean`` is set, the session is started with ``rtm.connect``, and users
+	and conversations are loaded in the background once connected.
+
+	``cache`` is a MetadataCache (or a path to one) to start from, as for
+	``slackrealtime.session.request_session``.  So is ``compact``.
+
+	Returns an AioSessionMetadata object containing the information retrieved
+	from the API call.
+	"""
+	if url is None:
+		api = AioSlackApi(codec=codec)
+	else:
+		api = AioSlackApi(url, codec=codec)
+
+	if cache is not None and not isinstance(cache, MetadataCache):
+		cache = MetadataCache(cache, api.codec)
+
+	if lean or cache is not None:
+		response = await api.rtm.connect(token=token)
+	else:
+		response = await api.rtm.start(token=token)
+
+	# Reading the snapshot blocks.
+	loop = asyncio.get_event_loop()
+	return await loop.run_in_executor(None, AioSessionMetadata, response, api, token, lean, cache, compact)
+
+
+async def connect(token, protocol=AioRtmProtocol, factory=WebSocketClientFactory, factory_kwargs=None, api_url=None, codec=None, loop=None, lean=False, cache=None, compact=False):
+	"""
+	Creates a new connection to the Slack Real-Time API using asyncio.
+
+	Returns (transport, protocol) for this connection to the API server.
+
+	"""
+	if factory_kwargs is None:
+		factory_kwargs = dict()
+	if loop is None:
+		loop = asyncio.get_event_loop()
+
+	metadata = await request_session(token, api_url, codec, lean, cache, compact)
+	wsfactory = factory(metadata.url, loop=loop, **factory_kwargs)
+	wsfactory.protocol = lambda *a,**k: protocol(*a,**k)._seedMetadata(metadata)
+
+	is_secure, host, port = parse_url(metadata.url)[:3]
+	return await loop.create_connection(wsfactory, host, port, ssl=is_secure)
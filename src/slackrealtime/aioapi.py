@@ -0,0 +1,119 @@
+"""
+slackrealtime/aioapi.py - Non-blocking implementation of the Slack API for asyncio.
+Copyright 2020 Michael Farrell <http://micolous.id.au>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import absolute_import
+import aiohttp
+import asyncio
+from urllib.parse import urlencode, urljoin
+from .api import SLACK_API_URL, SlackApi, SlackMethod, SlackMethodGroup, SlackRateLimited
+from .codec import get_codec
+
+
+class AioSlackMethod(SlackMethod):
+	"""
+	A Slack API method which is called without blocking the asyncio event loop.
+	Calls return a Future which resolves to the response, or raises a
+	``SlackError``.
+
+	Rate limited calls are retried as for ``SlackMethod``, but without
+	blocking.
+
+	``session`` is a function which returns the ``aiohttp.ClientSession`` to
+	make requests with (see ``AioSlackApi.session``).
+	"""
+	def __call__(self, **kwargs):
+		body = urlencode(self._encode_params(kwargs))
+		return asyncio.ensure_future(self._request(body))
+
+	async def _request(self, body):
+		options = dict(
+			data=body,
+			headers={'Content-Type': 'application/x-www-form-urlencoded'},
+		)
+		if self.timeout is not None:
+			options['timeout'] = self.timeout
+
+		retries = 0
+		while True:
+			async with self.session().post(urljoin(self.url, self.method), **options) as response:
+				content = await response.read()
+				retry_after = response.headers.get('Retry-After')
+
+			try:
+				return self._decode_response(content, retry_after)
+			except SlackRateLimited as e:
+				if retries >= self.max_retries:
+					raise
+				retries += 1
+				await asyncio.sleep(e.retry_after)
+
+	def __str__(self):
+		return '<AioSlackMethod: %s at %s>' % (self.method, self.url)
+
+
+class AioSlackMethodGroup(SlackMethodGroup):
+	method_class = AioSlackMethod
+
+	def __str__(self):
+		return '<AioSlackMethodGroup: %s at %s>' % (self.group, self.url)
+
+
+class AioSlackApi(SlackApi):
+	"""
+	AioSlackApi is a version of ``SlackApi`` for use with asyncio::
+
+		slack = AioSlackApi()
+		response = await slack.chat.postMessage(token=token, channel=channel, text=text)
+
+	Requests are made with ``aiohttp``.  Connections to the API server are kept
+	alive, with up to ``pool_size`` of them open at once, and ``timeout`` (in
+	seconds) limits how long to wait for the server.  An existing
+	``aiohttp.ClientSession`` may be passed in as ``session`` to share its pool
+	with other clients.
+	"""
+	group_class = AioSlackMethodGroup
+
+	def __init__(self, url=SLACK_API_URL, codec=None, session=None, pool_size=10, timeout=None):
+		if not url.endswith('/'):
+			url += '/'
+		self.url = url
+		self.codec = get_codec(codec)
+		self.timeout = None if timeout is None else aiohttp.ClientTimeout(total=timeout)
+		self.pool_size = pool_size
+		self._session = session
+
+	def session(self):
+		"""
+		Returns the ``aiohttp.ClientSession`` used for calls, creating it on first
+		use, as it needs to be created in the event loop.
+		"""
+		if self._session is None:
+			self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit_per_host=self.pool_size))
+		return self._session
+
+	async def close(self):
+		"""
+		Closes any connections held open to the API server.
+		"""
+		if self._session is not None:
+			await self._session.close()
+
+	def __getattr__(self, group):
+		# Methods get the session through session(), so that it isn't created
+		# until the first call.
+		return self.group_class(self.url, group, self.codec, self.session, self.timeout)
@@ -17,11 +17,15 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from __future__ import absolute_import
+import asyncio
 from datetime import datetime
-import json
 from pytz import utc
 import requests
+from requests.adapters import HTTPAdapter
+import sys
+from time import sleep
 from urllib.parse import urljoin
+from .codec import get_codec
 
 
 SLACK_API_URL = 'https://slack.com/api/'
@@ -35,6 +39,25 @@ def totimestamp(dt, epoch=datetime(1970, 1, 1, tzinfo=utc)):
 	return (dt - epoch).total_seconds()
 
 
+def _in_event_loop():
+	"""
+	Returns True if called from the thread of a running Twisted reactor or
+	asyncio event loop, which mustn't be blocked.
+	"""
+	try:
+		asyncio.get_running_loop()
+		return True
+	except RuntimeError:
+		pass
+
+	# Only check the reactor if something else has already imported it.
+	reactor = sys.modules.get('twisted.internet.reactor')
+	if reactor is None or not reactor.running:
+		return False
+	from twisted.python.threadable import isInIOThread
+	return isInIOThread()
+
+
 class SlackError(Exception):
 	"""
 	Thrown by ``SlackMethod`` calls in response to an error returned by the Slack API.
@@ -42,19 +65,40 @@ class SlackError(Exception):
 	pass
 
 
+class SlackRateLimited(SlackError):
+	"""
+	Thrown by ``SlackMethod`` calls which were still rate limited after
+	retrying.  ``retry_after`` is the number of seconds Slack asked us to wait.
+	"""
+	def __init__(self, error, retry_after):
+		super(SlackRateLimited, self).__init__(error)
+		self.retry_after = retry_after
+
+
 class SlackMethod(object):
-	def __init__(self, url, group, method):
+	# Number of times to retry a rate limited call, waiting as long as the
+	# server asks each time.
+	max_retries = 3
+
+	# Seconds to wait before retrying, if the server doesn't say.
+	default_retry_after = 1.
+
+	def __init__(self, url, group, method, codec=None, session=None, timeout=None):
 		self.url = url
 		self.method = group + '.' + method
+		self.codec = get_codec(codec)
+		# Without a session, every call makes a new connection.
+		self.session = requests if session is None else session
+		self.timeout = timeout
 
-	def __call__(self, **kwargs):
+	def _encode_params(self, kwargs):
 		# Prune any None parameters -- these should be defaults
 		params = {}
 		for k, v in kwargs.items():
 			if v is not None:
 				if isinstance(v, list) or isinstance(v, dict):
 					# Complex datatypes, JSON encode it
-					params[k] = json.dumps(v)
+					params[k] = self.codec.dumps(v)
 				elif isinstance(v, datetime):
 					# Datetime, convert to UNIX time
 					params[k] = str(totimestamp(v))
@@ -62,38 +106,59 @@ class SlackMethod(object):
 					# Simple datatypes
 					params[k] = v
 
-		response = requests.post(urljoin(self.url, self.method), data=params)
+		return params
 
-		if callable(response.json):
-			# Newer versions of requests use this API
-			response = response.json()
-		else:
-			# Older versions implement this as a property.
-			response = response.json
+	def _decode_response(self, body, retry_after=None):
+		response = self.codec.loads(body)
 
 		assert response['ok'] in (True, False), 'ok must be True or False'
 		if not response['ok']:
+			if response['error'] == 'ratelimited':
+				try:
+					retry_after = float(retry_after)
+				except (TypeError, ValueError):
+					retry_after = self.default_retry_after
+				raise SlackRateLimited(response['error'], retry_after)
 			raise SlackError(response['error'])
 
 		# Trim this attribute as it is no longer required
 		del response['ok']
 		return response
 
+	def __call__(self, **kwargs):
+		params = self._encode_params(kwargs)
+		retries = 0
+		while True:
+			response = self.session.post(urljoin(self.url, self.method), data=params, timeout=self.timeout)
+			try:
+				return self._decode_response(response.content, response.headers.get('Retry-After'))
+			except SlackRateLimited as e:
+				# Sleeping would hold up the event loop, so leave it to the caller.
+				if retries >= self.max_retries or _in_event_loop():
+					raise
+				retries += 1
+				sleep(e.retry_after)
+
 	def __str__(self):
 		return '<SlackMethod: %s at %s>' % (self.method, self.url)
 
 
 class SlackMethodGroup(object):
-	def __init__(self, url, group):
+	method_class = SlackMethod
+
+	def __init__(self, url, group, codec=None, session=None, timeout=None):
 		self.url = url
 		self.group = group
+		self.codec = get_codec(codec)
+		self.session = session
+		self.timeout = timeout
 
 	def __getattr__(self, method):
 		if self.group == 'user' and method == 'admin':
 			# 'xoxs' keys can access some extra undocumented methods.
-			return SlackMethodGroup(self.url, self.group + '.' + method)
+			return self.__class__(self.url, self.group + '.' + method, self.codec, self.session, self.timeout)
 
-		return SlackMethod(self.url, self.group, method)
+		return self.method_class(self.url, self.group, method, self.codec, self.session, self.timeout)
 
 	def __str__(self):
 		return '<SlackMethodGroup: %s at %s>' % (self.group, self.url)
@@ -116,14 +181,48 @@ class SlackApi(object):
 	When the official Slack HTTPS URI is used (the default), ``requests`` provides a
 	certificate and connection validation facility.
 
+	JSON is handled by ``codec`` (see ``slackrealtime.codec.get_codec``), which
+	defaults to the fastest JSON library installed.
+
+	Calls share a ``requests.Session``, so that connections to the API server
+	are kept alive and reused.  Up to ``pool_size`` connections are kept, and
+	``timeout`` (in seconds) limits how long to wait for the server.  Set
+	``keep_alive`` to False to close connections after every call.  An existing
+	``session`` may be passed in to share its pool with other clients.
+
+	Calls which are rate limited are retried up to ``SlackMethod.max_retries``
+	times, waiting as long as the ``Retry-After`` header asks, before
+	``SlackRateLimited`` is thrown.  Calls made from the reactor (or an asyncio
+	event loop) aren't retried, as that would block it; use ``TxSlackApi`` (or
+	``AioSlackApi``) there instead.
+
 	Reference for the Slack API is provided at: https://api.slack.com/
 	"""
-	def __init__(self, url=SLACK_API_URL):
+	group_class = SlackMethodGroup
+
+	def __init__(self, url=SLACK_API_URL, codec=None, session=None, pool_size=10, timeout=None, keep_alive=True):
 		if not url.endswith('/'):
 			url += '/'
 		self.url = url
+		self.codec = get_codec(codec)
+		self.timeout = timeout
+
+		if session is None:
+			session = requests.Session()
+			adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+			session.mount('https://', adapter)
+			session.mount('http://', adapter)
+			if not keep_alive:
+				session.headers['Connection'] = 'close'
+		self.session = session
+
+	def close(self):
+		"""
+		Closes any connections held open to the API server.
+		"""
+		self.session.close()
 	
 	def __getattr__(self, group):
 		# Gets a method descriptor
-		return SlackMethodGroup(self.url, group)
+		return self.group_class(self.url, group, self.codec, self.session, self.timeout)
 
@@ -0,0 +1,108 @@
+"""
+slackrealtime/cache.py - Local snapshots of session metadata.
+Copyright 2020 Michael Farrell <http://micolous.id.au>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import absolute_import
+import os
+from tempfile import NamedTemporaryFile
+from .codec import get_codec
+
+try:
+	import msgpack
+except ImportError:
+	msgpack = None
+
+# Bumped whenever the layout of a snapshot changes.
+CACHE_VERSION = 1
+
+# Snapshot files start with this, followed by a byte for the format used.
+CACHE_MAGIC = b'SRTM'
+FORMAT_MSGPACK = b'm'
+FORMAT_JSON = b'j'
+
+
+class MetadataCache(object):
+	"""
+	Keeps a snapshot of a team's SessionMetadata in a local file, so that a
+	later session can start from it rather than downloading everything again.
+
+	Snapshots are written with ``msgpack`` if it is installed, and otherwise
+	with ``codec``.  Either format can be read back, as long as the library
+	that wrote it is still available.
+
+	Files are replaced atomically, so a crash while saving leaves the previous
+	snapshot intact.
+	"""
+	def __init__(self, path, codec=None):
+		self.path = path
+		self.codec = get_codec(codec)
+
+	def load(self):
+		"""
+		Reads the snapshot.
+
+		Returns None if there is no snapshot, or it can't be read.
+		"""
+		try:
+			with open(self.path, 'rb') as f:
+				data = f.read()
+		except IOError:
+			return None
+
+		if not data.startswith(CACHE_MAGIC):
+			return None
+
+		fmt, data = data[len(CACHE_MAGIC):len(CACHE_MAGIC) + 1], data[len(CACHE_MAGIC) + 1:]
+		try:
+			if fmt == FORMAT_MSGPACK and msgpack is not None:
+				snapshot = msgpack.unpackb(data, raw=False)
+			elif fmt == FORMAT_JSON:
+				snapshot = self.codec.loads(data)
+			else:
+				return None
+		except ValueError:
+			return None
+
+		if snapshot.get(u'version') != CACHE_VERSION:
+			return None
+		return snapshot
+
+	def save(self, snapshot):
+		"""
+		Writes a snapshot, replacing any existing one.  This blocks, so should be
+		run outside of the event loop.
+		"""
+		snapshot = dict(snapshot, version=CACHE_VERSION)
+		if msgpack is not None:
+			data = FORMAT_MSGPACK + msgpack.packb(snapshot, use_bin_type=True)
+		else:
+			data = FORMAT_JSON + self.codec.dumps(snapshot)
+
+		directory = os.path.dirname(os.path.abspath(self.path))
+		f = NamedTemporaryFile(dir=directory, prefix='.tmp', delete=False)
+		try:
+			with f:
+				f.write(CACHE_MAGIC + data)
+				f.flush()
+				os.fsync(f.fileno())
+			os.replace(f.name, self.path)
+		except:
+			os.unlink(f.name)
+			raise
+
+	def __str__(self):
+		return '<MetadataCache: %s>' % self.path
@@ -0,0 +1,126 @@
+"""
+slackrealtime/codec.py - JSON encoding and decoding for Slack RTM and API.
+Copyright 2020 Michael Farrell <http://micolous.id.au>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import absolute_import
+import json
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+try:
+	import ujson
+except ImportError:
+	ujson = None
+
+try:
+	import simdjson
+except ImportError:
+	simdjson = None
+
+
+class JsonCodec(object):
+	"""
+	Encodes and decodes JSON using Python's built-in ``json`` module.
+
+	``loads`` accepts ``str`` or UTF-8 encoded ``bytes``, and ``dumps`` always
+	returns UTF-8 encoded ``bytes``, ready to be sent on the wire.
+	"""
+	name = 'json'
+
+	def loads(self, data):
+		return json.loads(data)
+
+	def dumps(self, obj):
+		return json.dumps(obj).encode('utf-8')
+
+	def __str__(self):
+		return '<%s: %s>' % (self.__class__.__name__, self.name)
+
+
+class OrjsonCodec(JsonCodec):
+	"""
+	Encodes and decodes JSON using ``orjson``, which produces ``bytes``
+	directly.
+	"""
+	name = 'orjson'
+
+	def loads(self, data):
+		return orjson.loads(data)
+
+	def dumps(self, obj):
+		return orjson.dumps(obj)
+
+
+class UjsonCodec(JsonCodec):
+	"""
+	Encodes and decodes JSON using ``ujson``.
+	"""
+	name = 'ujson'
+
+	def loads(self, data):
+		return ujson.loads(data)
+
+	def dumps(self, obj):
+		return ujson.dumps(obj, escape_forward_slashes=False).encode('utf-8')
+
+
+class SimdjsonCodec(JsonCodec):
+	"""
+	Decodes JSON using ``pysimdjson``.  It has no encoder of its own, so
+	encoding is done with the built-in ``json`` module.
+	"""
+	name = 'simdjson'
+
+	def loads(self, data):
+		return simdjson.loads(data)
+
+
+# Available codecs, in order of preference.
+CODECS = []
+if orjson is not None:
+	CODECS.append(OrjsonCodec)
+if ujson is not None:
+	CODECS.append(UjsonCodec)
+if simdjson is not None:
+	CODECS.append(SimdjsonCodec)
+CODECS.append(JsonCodec)
+
+
+def get_codec(codec=None):
+	"""
+	Gets a JSON codec.
+
+	``codec`` may be an existing codec instance (which is returned as-is), the
+	name of a codec (eg: ``'orjson'``), or None to pick the fastest one that is
+	installed.
+
+	Raises KeyError if the named codec is not installed.
+	"""
+	if codec is None:
+		return CODECS[0]()
+
+	if isinstance(codec, JsonCodec):
+		return codec
+
+	for c in CODECS:
+		if c.name == codec:
+			return c()
+
+	raise KeyError(codec)
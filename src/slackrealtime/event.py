@@ -18,25 +18,55 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from datetime import datetime
 from pytz import utc
+from time import time
+
+
+def _parse_ts(ts):
+	return datetime.fromtimestamp(float(ts), utc)
 
 
 class BaseEvent(object):
-	def __init__(self, body):
+	"""
+	Base class for all events received from Slack.
+
+	Fields of the event body are available as attributes.  Timestamps are
+	only converted to ``datetime`` objects when first accessed, as most events
+	are never inspected that closely.
+
+	"""
+	__slots__ = ('_b', '_received', '_ts')
+
+	def __init__(self, body, received=None):
 		self._b = body
+		# Receive time, used if the message has no timestamp of its own.
+		self._received = time() if received is None else received
+		self._ts = None
 
+	@property
+	def has_ts(self):
 		# Not all events have a timestamp.
-		if 'ts' in self._b:
-			# Time value is present in the message, parse it.
-			self.has_ts = True
-			self.ts = datetime.fromtimestamp(float(self._b['ts']), utc)
-			self.raw_ts = self._b['ts']
-		else:
-			# Time value is missing in the message, infer it based on receive time.
-			self.has_ts = False
-			self.ts = datetime.now(utc)
-			self.raw_ts = None
+		return 'ts' in self._b
+
+	@property
+	def raw_ts(self):
+		return self._b.get('ts')
+
+	@property
+	def ts(self):
+		if self._ts is None:
+			if 'ts' in self._b:
+				# Time value is present in the message, parse it.
+				self._ts = _parse_ts(self._b['ts'])
+			else:
+				# Time value is missing in the message, infer it based on receive time.
+				self._ts = datetime.fromtimestamp(self._received, utc)
+		return self._ts
 
 	def __getattr__(self, attr):
+		if attr == '_b':
+			# Not yet initialised, don't recurse.
+			raise AttributeError(attr)
+
 		attr = str(attr)
 		if attr in self._b:
 			return self._b[attr]
@@ -44,22 +74,26 @@ class BaseEvent(object):
 			raise AttributeError(attr)
 
 	def copy(self):
-		return decode_event(self._b)
+		return decode_event(self._b, self._received)
 
 	def __str__(self):
 		return '<BaseEvent: @%r %r>' % (self.ts, self._b)
 
 
 class Unknown(BaseEvent):
+	__slots__ = ()
+
 	def __str__(self):
 		return '<Unknown: @%r %r>' % (self.ts, self._b)
 
 
 class Hello(BaseEvent):
-	pass
+	__slots__ = ()
 
 
 class Message(BaseEvent):
+	__slots__ = ()
+
 	def __getattr__(self, attr):
 		try:
 			return super(Message, self).__getattr__(attr)
@@ -93,56 +127,77 @@ class Message(BaseEvent):
 
 
 class BaseHistoryChanged(BaseEvent):
-	def __init__(self, body):
-		super(BaseHistoryChanged, self).__init__(body)
-		self.latest = datetime.fromtimestamp(float(self._b['latest']), utc)
-		self.event_ts = datetime.fromtimestamp(float(self._b['event_ts']), utc)
+	__slots__ = ('_latest', '_event_ts')
+
+	def __init__(self, body, received=None):
+		super(BaseHistoryChanged, self).__init__(body, received)
+		self._latest = self._event_ts = None
+
+	@property
+	def latest(self):
+		if self._latest is None:
+			self._latest = _parse_ts(self._b['latest'])
+		return self._latest
+
+	@property
+	def event_ts(self):
+		if self._event_ts is None:
+			self._event_ts = _parse_ts(self._b['event_ts'])
+		return self._event_ts
 
 
 class BaseReactionEvent(BaseEvent):
-	def __init__(self, body):
-		super(BaseReactionEvent, self).__init__(body)
-		self.event_ts = datetime.fromtimestamp(float(self._b['event_ts']), utc)
-
-
-class Ack(BaseEvent): pass
-class ChannelArchive(BaseEvent): pass
-class ChannelCreated(BaseEvent): pass
-class ChannelDeleted(BaseEvent): pass
-class ChannelHistoryChanged(BaseHistoryChanged): pass
-class ChannelJoined(BaseEvent): pass
-class ChannelLeft(BaseEvent): pass
-class ChannelMarked(BaseEvent): pass
-class ChannelRename(BaseEvent): pass
-class ChannelUnarchive(BaseEvent): pass
-
-class ImClose(BaseEvent): pass
-class ImCreated(BaseEvent): pass
-class ImHistoryChanged(BaseHistoryChanged): pass
-class ImMarked(BaseEvent): pass
-class ImOpen(BaseEvent): pass
-
-class GroupJoined(BaseEvent): pass
-class GroupLeft(BaseEvent): pass
-class GroupOpen(BaseEvent): pass
-class GroupClose(BaseEvent): pass
-class GroupArchive(BaseEvent): pass
-class GroupUnarchive(BaseEvent): pass
-class GroupRename(BaseEvent): pass
-class GroupMarked(BaseEvent): pass
-class GroupHistoryChanged(BaseHistoryChanged): pass
-
-class BotAdded(BaseEvent): pass
-class BotChanged(BaseEvent): pass
-
-class ReactionAdded(BaseReactionEvent): pass
-class ReactionRemoved(BaseReactionEvent): pass
-
-class PresenceChange(BaseEvent): pass
-class UserChange(BaseEvent): pass
-class UserTyping(BaseEvent): pass
-class TeamPrefChange(BaseEvent): pass
-class TeamJoin(BaseEvent): pass
+	__slots__ = ('_event_ts',)
+
+	def __init__(self, body, received=None):
+		super(BaseReactionEvent, self).__init__(body, received)
+		self._event_ts = None
+
+	@property
+	def event_ts(self):
+		if self._event_ts is None:
+			self._event_ts = _parse_ts(self._b['event_ts'])
+		return self._event_ts
+
+
+class Ack(BaseEvent): __slots__ = ()
+class ChannelArchive(BaseEvent): __slots__ = ()
+class ChannelCreated(BaseEvent): __slots__ = ()
+class ChannelDeleted(BaseEvent): __slots__ = ()
+class ChannelHistoryChanged(BaseHistoryChanged): __slots__ = ()
+class ChannelJoined(BaseEvent): __slots__ = ()
+class ChannelLeft(BaseEvent): __slots__ = ()
+class ChannelMarked(BaseEvent): __slots__ = ()
+class ChannelRename(BaseEvent): __slots__ = ()
+class ChannelUnarchive(BaseEvent): __slots__ = ()
+
+class ImClose(BaseEvent): __slots__ = ()
+class ImCreated(BaseEvent): __slots__ = ()
+class ImHistoryChanged(BaseHistoryChanged): __slots__ = ()
+class ImMarked(BaseEvent): __slots__ = ()
+class ImOpen(BaseEvent): __slots__ = ()
+
+class GroupJoined(BaseEvent): __slots__ = ()
+class GroupLeft(BaseEvent): __slots__ = ()
+class GroupOpen(BaseEvent): __slots__ = ()
+class GroupClose(BaseEvent): __slots__ = ()
+class GroupArchive(BaseEvent): __slots__ = ()
+class GroupUnarchive(BaseEvent): __slots__ = ()
+class GroupRename(BaseEvent): __slots__ = ()
+class GroupMarked(BaseEvent): __slots__ = ()
+class GroupHistoryChanged(BaseHistoryChanged): __slots__ = ()
+
+class BotAdded(BaseEvent): __slots__ = ()
+class BotChanged(BaseEvent): __slots__ = ()
+
+class ReactionAdded(BaseReactionEvent): __slots__ = ()
+class ReactionRemoved(BaseReactionEvent): __slots__ = ()
+
+class PresenceChange(BaseEvent): __slots__ = ()
+class UserChange(BaseEvent): __slots__ = ()
+class UserTyping(BaseEvent): __slots__ = ()
+class TeamPrefChange(BaseEvent): __slots__ = ()
+class TeamJoin(BaseEvent): __slots__ = ()
 
 
 EVENT_HANDLERS = {
@@ -188,14 +243,23 @@ EVENT_HANDLERS = {
 }
 
 
-def decode_event(event):
-	event = event.copy()
+def decode_event(event, received=None, copy=True):
+	"""
+	Decodes a message from Slack into an event object.
+
+	By default, the message is copied first so that later changes to it by the
+	caller are not seen by the event.  If the message was freshly parsed and
+	will not be used again, pass ``copy=False`` to skip this.
+
+	"""
+	if copy:
+		event = event.copy()
 	if 'type' not in event:
 		# This is an acknowledgement of a previous command.
-		return Ack(event)
+		return Ack(event, received)
 	elif event['type'] in EVENT_HANDLERS:
 		t = event['type']
-		return EVENT_HANDLERS[t](event)
+		return EVENT_HANDLERS[t](event, received)
 	else:
-		return Unknown(event)
+		return Unknown(event, received)
 
@@ -17,8 +17,10 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from __future__ import absolute_import
-from autobahn.twisted.websocket import WebSocketClientFactory
+from autobahn.twisted.websocket import WebSocketClientFactory, connectWS
 from twisted.internet import reactor
+from twisted.internet.protocol import ReconnectingClientFactory
+from twisted.python import log
 
 
 class DyingWebSocketClientFactory(WebSocketClientFactory):
@@ -30,8 +32,8 @@ class DyingWebSocketClientFactory(WebSocketClientFactory):
 	allowing it to be restarted.
 
 	The "better" way is to handle the disconnect and then initiate a new RTM
-	session on a connection loss, but it also means rewriting lots of the
-	metadata.
+	session on a connection loss.  ReconnectingWebSocketClientFactory does
+	this.
 
 	Without this alternate factory, when the connection to the Slack RTM service
 	is lost, the reactor will keep running, effectively making your bot "hang".
@@ -54,3 +56,83 @@ class DyingWebSocketClientFactory(WebSocketClientFactory):
 		print('Connection failed:', reason)
 		reactor.stop()
 
+
+class _SessionReconnector(object):
+	"""
+	Stands in for a connector in ReconnectingClientFactory.retry(), so that
+	a fresh WebSocket URL is requested before each reconnection attempt.
+	"""
+	def __init__(self, factory):
+		self.factory = factory
+
+	def connect(self):
+		self.factory._reconnect()
+
+	def stopConnecting(self):
+		pass
+
+
+class ReconnectingWebSocketClientFactory(ReconnectingClientFactory, WebSocketClientFactory):
+	"""
+	Implements a wrapper on autobahn's WebSocketClientFactory which reconnects
+	to the Slack RTM service when the connection is lost or fails, with a
+	jittered exponential backoff between attempts.
+
+	The existing SessionMetadata is kept, and a new WebSocket URL is requested
+	with ``rtm.connect`` rather than starting a whole new session.  This means
+	that the team's users and channels aren't downloaded again.
+
+	This can be used with the following code::
+
+		conn = connect(
+			slack_api_token,
+			protocol=MySlackbotProtocol,
+			factory=ReconnectingWebSocketClientFactory
+		)
+
+	The backoff may be tuned with the ``initialDelay``, ``maxDelay``,
+	``factor``, ``jitter`` and ``maxRetries`` attributes described in Twisted's
+	``ReconnectingClientFactory``.
+
+	"""
+	initialDelay = 1.
+	maxDelay = 300.
+
+	# Session metadata to reuse, set by connect().
+	meta = None
+
+	def clientConnectionLost(self, connector, reason):
+		log.msg('Connection lost:', reason)
+		self._retry(connector)
+
+	def clientConnectionFailed(self, connector, reason):
+		log.msg('Connection failed:', reason)
+		self._retry(connector)
+
+	def _retry(self, connector):
+		if self.continueTrying:
+			self.connector = connector
+			self.retry(_SessionReconnector(self))
+
+	def _reconnect(self):
+		d = self.meta._nonblocking_api().rtm.connect(token=self.meta.token)
+		d.addCallback(self._sessionRefreshed)
+		d.addErrback(self._sessionRefreshFailed)
+
+	def _sessionRefreshed(self, response):
+		if not self.continueTrying:
+			# stopTrying() was called while waiting for the new session.
+			return
+		self.meta.reconcile(response)
+		self.setSessionParameters(
+			url=self.meta.url,
+			origin=self.origin,
+			protocols=self.protocols,
+			useragent=self.useragent,
+			headers=self.headers,
+			proxy=self.proxy)
+		self.connector = connectWS(self)
+
+	def _sessionRefreshFailed(self, failure):
+		log.msg('Could not get a new RTM session:', failure.value)
+		self.retry(_SessionReconnector(self))
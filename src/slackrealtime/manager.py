@@ -0,0 +1,209 @@
+"""
+slackrealtime/manager.py - Manages connections to many Slack teams at once.
+Copyright 2020 Michael Farrell <http://micolous.id.au>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import absolute_import
+from autobahn.twisted.websocket import connectWS
+import os
+from twisted.internet import threads
+from twisted.internet.defer import DeferredList, DeferredSemaphore
+from twisted.internet.protocol import ReconnectingClientFactory
+from twisted.python import log
+from .api import SLACK_API_URL, SlackApi
+from .cache import MetadataCache
+from .codec import get_codec
+from .factory import ReconnectingWebSocketClientFactory
+from .protocol import RtmProtocol
+from .session import SessionMetadata
+from .txapi import TxSlackApi
+
+
+class ManagedRtmProtocol(RtmProtocol):
+	"""
+	RtmProtocol used by ConnectionManager, which passes events on to the
+	manager along with the ID of the team they came from.
+	"""
+	def _seedManager(self, manager, meta):
+		self.manager = manager
+		self.team_id = meta.team[u'id']
+		self.stats = manager.stats[self.team_id]
+		return self._seedMetadata(meta)
+
+	def onConnect(self, response):
+		self.stats[u'connected'] = True
+		self.stats[u'connects'] += 1
+		super(ManagedRtmProtocol, self).onConnect(response)
+
+	def onClose(self, wasClean, code, reason):
+		self.stats[u'connected'] = False
+		super(ManagedRtmProtocol, self).onClose(wasClean, code, reason)
+
+	def onMessage(self, msg, binary):
+		self.stats[u'events'] += 1
+		super(ManagedRtmProtocol, self).onMessage(msg, binary)
+
+	def onCommandAcked(self, msg_id, latency):
+		self.stats[u'ack_latency'] = self.ack_latency_avg
+		self.stats[u'ping_rtt'] = self.ping_rtt
+
+	def onSlackEvent(self, event):
+		self.manager.onSlackEvent(self.team_id, event)
+
+	def onMetadataChanged(self, events):
+		self.manager.onMetadataChanged(self.team_id, events)
+
+
+class ConnectionManager(object):
+	"""
+	Manages RTM connections to many Slack teams from one process.
+
+	All connections share one codec and one pool of HTTP connections to the
+	Slack API, and sessions are started without blocking the reactor, with up
+	to ``max_concurrent`` ``rtm.start`` calls in progress at once.
+
+	If ``lean`` is set, sessions are started with ``rtm.connect`` instead, and
+	each team's users and conversations are loaded once it has connected.
+
+	If ``cache_dir`` is set, a snapshot of each team's metadata is kept there,
+	and sessions are started lean from it.  If ``compact`` is set, only
+	commonly used fields of users and channels are kept in memory.
+
+	Connections are made with ``factory``, which by default reconnects (with
+	a new ``rtm.connect`` URL) whenever a connection is lost, including when
+	it is dropped for not answering pings.
+
+	Subclass this and implement onSlackEvent() to handle events::
+
+		class MyManager(ConnectionManager):
+			def onSlackEvent(self, team_id, event):
+				...
+
+		manager = MyManager()
+		manager.add_all(tokens)
+		reactor.run()
+
+	The metadata for each team is in ``teams``, and counters for each team's
+	connection are in ``stats``.  Both are keyed by team ID.
+	"""
+	def __init__(self, protocol=ManagedRtmProtocol, factory=ReconnectingWebSocketClientFactory, factory_kwargs=None, api_url=SLACK_API_URL, codec=None, max_concurrent=10, pool_size=10, timeout=None, lean=False, cache_dir=None, compact=False):
+		if factory_kwargs is None:
+			factory_kwargs = dict()
+
+		self.protocol = protocol
+		self.factory = factory
+		self.factory_kwargs = factory_kwargs
+		self.codec = get_codec(codec)
+		self.lean = lean
+		self.cache_dir = cache_dir
+		self.compact = compact
+
+		# Shared between every team.
+		self.api = SlackApi(api_url, codec=self.codec, pool_size=pool_size, timeout=timeout)
+		self.txapi = TxSlackApi(api_url, codec=self.codec, pool_size=pool_size, timeout=timeout)
+		self._semaphore = DeferredSemaphore(max_concurrent)
+
+		# SessionMetadata for each team.
+		self.teams = {}
+
+		# Counters for each team's connection.
+		self.stats = {}
+
+		# Connectors for each team's connection.
+		self.connections = {}
+
+		# WebSocket factories for each team's connection.
+		self._factories = {}
+
+	def add(self, token):
+		"""
+		Starts a session for the team that ``token`` belongs to, and connects to
+		it.
+
+		Returns a Deferred which fires with the team ID once the session has
+		started.
+		"""
+		return self._semaphore.run(self._start_session, token)
+
+	def add_all(self, tokens):
+		"""
+		Starts sessions for many tokens at once, and connects to them.
+
+		Returns a DeferredList which fires with the result of add() for each
+		token.
+		"""
+		return DeferredList([self.add(token) for token in tokens], consumeErrors=True)
+
+	def _start_session(self, token):
+		if self.lean or self.cache_dir is not None:
+			d = self.txapi.rtm.connect(token=token)
+		else:
+			d = self.txapi.rtm.start(token=token)
+		d.addCallback(self._load_session, token)
+		d.addCallback(self._connect, token)
+		return d
+
+	def _load_session(self, response, token):
+		if self.cache_dir is None:
+			return SessionMetadata(response, self.api, token, self.lean, compact=self.compact)
+
+		# Reading the snapshot blocks, so do it in a thread.
+		cache = MetadataCache(os.path.join(self.cache_dir, response[u'team'][u'id'] + '.cache'), self.codec)
+		return threads.deferToThread(SessionMetadata, response, self.api, token, True, cache, self.compact)
+
+	def _connect(self, meta, token):
+		meta.txapi = self.txapi
+
+		team_id = meta.team[u'id']
+		self.teams[team_id] = meta
+		self.stats[team_id] = {
+			u'connected': False,
+			u'connects': 0,
+			u'events': 0,
+			u'ack_latency': None,
+			u'ping_rtt': None,
+		}
+
+		wsfactory = self.factory(meta.url, **self.factory_kwargs)
+		wsfactory.meta = meta
+		wsfactory.protocol = lambda *a,**k: self.protocol(*a,**k)._seedManager(self, meta)
+		self._factories[team_id] = wsfactory
+		self.connections[team_id] = connectWS(wsfactory)
+		return team_id
+
+	def remove(self, team_id):
+		"""
+		Disconnects from a team, and forgets about it.
+		"""
+		connection = self.connections.pop(team_id)
+		wsfactory = self._factories.pop(team_id)
+		if isinstance(wsfactory, ReconnectingClientFactory):
+			wsfactory.stopTrying()
+			# It may have reconnected since.
+			connection = wsfactory.connector or connection
+		connection.disconnect()
+		del self.teams[team_id]
+		del self.stats[team_id]
+
+	def onSlackEvent(self, team_id, event):
+		log.msg('Default ConnectionManager.onSlackEvent() handler called.')
+
+	def onMetadataChanged(self, team_id, events):
+		"""
+		Called after a batch of events has been applied to a team's metadata,
+		with the list of events that were applied.
+		"""
+		pass
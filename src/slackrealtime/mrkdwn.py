@@ -0,0 +1,245 @@
+"""
+slackrealtime/mrkdwn.py - Translates Slack's message markup to Markdown and HTML.
+Copyright 2020 Michael Farrell <http://micolous.id.au>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import absolute_import
+import re
+
+# Matches every piece of Slack markup in one pass.  Slack escapes &, < and >
+# in message text, so literal angle brackets never appear in it.
+TOKEN_RE = re.compile(r'''
+	# Fail quickly anywhere that markup can't start.
+	(?=[`<*_~:&\n"])
+	(?:
+	```\n?(?P<pre>.*?)\n?```
+	| `(?P<code>[^`\n]+)`
+	| <(?P<angle>[^<>\n]+)>
+	| ^&gt;[ ]?(?P<quote>[^\n]*)
+	| (?<![\w*])\*(?P<bold>[^*\s](?:[^*\n]*[^*\s])?)\*(?!\w)
+	| (?<![\w_])_(?P<italic>[^_\s](?:[^_\n]*[^_\s])?)_(?!\w)
+	| (?<![\w~])~(?P<strike>[^~\s](?:[^~\n]*[^~\s])?)~(?!\w)
+	| (?<![\w:]):(?P<emoji>[a-z0-9_+'-]+):(?![\w:])
+	| (?P<entity>&(?:amp|lt|gt);)
+	| (?P<newline>\n)
+	| (?P<quot>")
+	)
+''', re.S | re.M | re.X)
+
+ENTITIES = {
+	'&amp;': '&',
+	'&lt;': '<',
+	'&gt;': '>',
+}
+
+ENTITY_RE = re.compile(r'&(?:amp|lt|gt);')
+
+# Links with any other scheme (eg: javascript:) are written out as text.
+SAFE_LINK_RE = re.compile(r'(?:https?|mailto):', re.I)
+
+# Names for the special mentions, as shown by Slack.
+SPECIAL_MENTIONS = {
+	'here': '@here',
+	'channel': '@channel',
+	'everyone': '@everyone',
+}
+
+
+def escape(text):
+	"""
+	Escapes &, < and > as Slack does.
+	"""
+	return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def unescape(text):
+	"""
+	Undoes Slack's escaping of &, < and >.
+	"""
+	if '&' not in text:
+		return text
+	return ENTITY_RE.sub(lambda m: ENTITIES[m.group(0)], text)
+
+
+class Translator(object):
+	"""
+	Translates Slack mrkdwn in a single pass over the text.
+
+	Subclasses say how each piece of markup is written out.  Everything passed
+	to them is still escaped as Slack escapes it.  The contents of code spans
+	and blocks are never translated, only unescaped as the output format
+	requires.
+
+	``users`` and ``channels`` optionally map IDs to names, for mentions which
+	don't include a name.
+	"""
+	def __init__(self, users=None, channels=None):
+		self.users = users or {}
+		self.channels = channels or {}
+
+	def translate(self, text):
+		return TOKEN_RE.sub(self._replace, text)
+
+	def _replace(self, m):
+		kind = m.lastgroup
+		return getattr(self, kind)(m.group(kind))
+
+	def angle(self, body):
+		target, _, label = body.partition('|')
+		if target.startswith('@'):
+			return self.user(target[1:], label or escape(self.users.get(target[1:], target[1:])))
+		elif target.startswith('#'):
+			return self.channel(target[1:], label or escape(self.channels.get(target[1:], target[1:])))
+		elif target.startswith('!'):
+			command = target[1:].split('^', 1)[0]
+			if command in SPECIAL_MENTIONS:
+				return self.mention(SPECIAL_MENTIONS[command])
+			elif command == 'date':
+				# Fallback text for dates, which are formatted by the client.
+				return self.text(label)
+			return self.mention(label or '@' + command)
+		elif not SAFE_LINK_RE.match(target):
+			return self.text(label or target)
+		return self.link(target, label)
+
+	def text(self, text):
+		"""
+		Writes out plain text which isn't part of any markup, such as the
+		fallback text of a date.  Text between tokens is copied as it is,
+		without calling this.
+		"""
+		return text
+
+
+class MarkdownTranslator(Translator):
+	"""
+	Translates Slack mrkdwn to Markdown.  Slack's escaping of &, < and > is
+	kept, as Markdown understands it, except in code, where Markdown would
+	show it as it is.
+	"""
+	def entity(self, text):
+		return text
+
+	quot = newline = entity
+
+	def pre(self, body):
+		return '\n```\n%s\n```' % unescape(body)
+
+	def code(self, body):
+		body = unescape(body)
+		if '`' in body:
+			return '`` %s ``' % body
+		return '`%s`' % body
+
+	def quote(self, body):
+		return '> %s' % self.translate(body)
+
+	def bold(self, body):
+		return '**%s**' % self.translate(body)
+
+	def italic(self, body):
+		return '*%s*' % self.translate(body)
+
+	def strike(self, body):
+		return '~~%s~~' % self.translate(body)
+
+	def emoji(self, name):
+		return ':%s:' % name
+
+	def user(self, uid, name):
+		return '**@%s**' % name
+
+	def channel(self, cid, name):
+		return '**#%s**' % name
+
+	def mention(self, name):
+		return '**%s**' % name
+
+	def link(self, url, label):
+		return '[%s](%s)' % (self.translate(label) if label else url, url)
+
+
+class HtmlTranslator(Translator):
+	"""
+	Translates Slack mrkdwn to HTML.  Slack's own escaping of &, < and > is
+	kept, so the output is safe to embed in a page.
+	"""
+	def text(self, text):
+		return text.replace('"', '&quot;')
+
+	def entity(self, text):
+		return text
+
+	def quot(self, text):
+		return '&quot;'
+
+	def newline(self, text):
+		return '<br>\n'
+
+	def pre(self, body):
+		return '<pre>%s</pre>' % self.text(body)
+
+	def code(self, body):
+		return '<code>%s</code>' % self.text(body)
+
+	def quote(self, body):
+		return '<blockquote>%s</blockquote>' % self.translate(body)
+
+	def bold(self, body):
+		return '<strong>%s</strong>' % self.translate(body)
+
+	def italic(self, body):
+		return '<em>%s</em>' % self.translate(body)
+
+	def strike(self, body):
+		return '<del>%s</del>' % self.translate(body)
+
+	def emoji(self, name):
+		return '<span class="emoji">:%s:</span>' % name
+
+	def user(self, uid, name):
+		return '<span class="user" data-id="%s">@%s</span>' % (self.text(uid), self.text(name))
+
+	def channel(self, cid, name):
+		return '<span class="channel" data-id="%s">#%s</span>' % (self.text(cid), self.text(name))
+
+	def mention(self, name):
+		return '<span class="mention">%s</span>' % self.text(name)
+
+	def link(self, url, label):
+		# Only http, https and mailto links get this far.
+		url = self.text(url)
+		return '<a href="%s">%s</a>' % (url, self.translate(label) if label else url)
+
+
+def to_markdown(text, users=None, channels=None):
+	"""
+	Translates Slack mrkdwn to Markdown.  Messages without any text (``None``
+	or empty) give an empty string.
+	"""
+	if not text:
+		return ''
+	return MarkdownTranslator(users, channels).translate(text)
+
+
+def to_html(text, users=None, channels=None):
+	"""
+	Translates Slack mrkdwn to HTML.  Messages without any text (``None`` or
+	empty) give an empty string.
+	"""
+	if not text:
+		return ''
+	return HtmlTranslator(users, channels).translate(text)
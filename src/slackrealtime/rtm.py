@@ -0,0 +1,507 @@
+"""
+slackrealtime/rtm.py - Slack RTM protocol, independent of the networking library
+Copyright 2014-2020 Michael Farrell <http://micolous.id.au>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from __future__ import absolute_import
+from collections import OrderedDict
+import re
+from .api import SlackError
+from .event import decode_event
+from .sendqueue import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, SendQueue
+
+MAX_MESSAGE_ID = 2**31
+
+# Matches a message whose first key is its type, as Slack sends them.
+EVENT_TYPE_RE = re.compile(br'^\s*\{\s*"type"\s*:\s*"([a-z0-9_]+)"')
+EVENT_TYPE_STR_RE = re.compile(r'^\s*\{\s*"type"\s*:\s*"([a-z0-9_]+)"')
+
+
+def peek_event_type(msg):
+	"""
+	Finds the type of a raw RTM message without fully decoding it.
+
+	Returns None if the type can't be found cheaply, in which case the message
+	needs to be decoded to find out.
+	"""
+	if isinstance(msg, bytes):
+		m = EVENT_TYPE_RE.match(msg)
+		return m.group(1).decode('ascii') if m else None
+
+	m = EVENT_TYPE_STR_RE.match(msg)
+	return m.group(1) if m else None
+
+
+class AckTimeout(SlackError):
+	"""
+	Raised when Slack doesn't acknowledge a command within ``ack_timeout``
+	seconds.
+	"""
+	pass
+
+
+class _PendingCommand(object):
+	"""
+	A command which has been sent, and is waiting to be acknowledged.
+	"""
+	__slots__ = ('waiter', 'sent', 'timer')
+
+	def __init__(self, waiter):
+		self.waiter = waiter
+		self.sent = None
+		self.timer = None
+
+
+class BaseRtmProtocol(object):
+	"""
+	Implements the parts of the Slack RTM protocol which don't depend on the
+	networking library in use.
+
+	This is mixed in to a WebSocket client protocol class, which also needs to
+	implement _makeApi(), _then(), _now(), _callLater(), _makeWaiter(),
+	_resolve(), _reject() and _logError().  See RtmProtocol (for Twisted) and
+	AioRtmProtocol (for asyncio).
+
+	The server is only pinged once nothing has been received from it for
+	``ping_interval`` seconds.  While it is quiet, it is pinged every
+	``pong_timeout`` seconds, and after ``max_missed_pongs`` pings in a row go
+	unanswered, onHeartbeatTimeout() drops the connection.
+
+	Commands are paced to stay within Slack's rate limits (see SendQueue):
+	``send_rate`` commands per second overall, and ``channel_rate`` per second
+	to any one channel, with bursts of up to ``send_burst`` and
+	``channel_burst``.
+	"""
+	# Event types passed to onSlackEvent(), or None for all events.  Events
+	# with handlers in SessionMetadata.update_handlers are always decoded,
+	# as are acknowledgements of commands.
+	subscriptions = None
+
+	# Seconds without hearing from the server before pinging it.
+	ping_interval = 15.
+
+	# Seconds to wait for a pong, before pinging again.
+	pong_timeout = 5.
+
+	# Number of unanswered pings after which the connection is dead.
+	max_missed_pongs = 2
+
+	send_rate = 10.
+	send_burst = 10
+	channel_rate = 1.
+	channel_burst = 1
+
+	# Seconds to wait for a command to be acknowledged, if sendCommand() was
+	# asked to wait for it.
+	ack_timeout = 10.
+
+	# Maximum number of sent commands to track until they are acknowledged.
+	max_pending_acks = 1000
+
+	# Seconds to wait before trying again to load a lean session's metadata,
+	# after an error.
+	fill_retry_delay = 30.
+
+	# Lanes that commands are sent in, by type.  Anything else is
+	# PRIORITY_NORMAL.
+	command_priorities = {
+		u'ping': PRIORITY_HIGH,
+		u'typing': PRIORITY_LOW,
+	}
+
+	def _seedMetadata(self, meta):
+		self.meta = meta
+		self.meta.protocol = self
+		self.codec = meta.api.codec
+		# Non-blocking API client, for use from the event loop.
+		self.api = self._makeApi(meta)
+		self.next_message_id = 1
+		self.command_queue = SendQueue(self._now(), self.send_rate, self.send_burst,
+			self.channel_rate, self.channel_burst)
+		self._command_call = None
+
+		# Commands waiting for acknowledgement, by message ID, oldest first.
+		self.pending_acks = OrderedDict()
+
+		# Round-trip time of the last acknowledged command, and a moving
+		# average of it, in seconds.
+		self.ack_latency = None
+		self.ack_latency_avg = None
+
+		# Round-trip time of the last ping, in seconds.
+		self.ping_rtt = None
+		self.missed_pongs = 0
+		self._ping_id = None
+		self._last_received = None
+		self._heartbeat_call = None
+		self._fill_call = None
+		if self.subscriptions is not None:
+			self.subscriptions = set(self.subscriptions)
+		return self
+
+	def subscribe(self, *types):
+		"""
+		Declares event types (eg: ``'message'``) that this connection wants
+		delivered to onSlackEvent().
+
+		Once anything has been subscribed to, events of any other type will be
+		dropped before they are decoded, unless the session metadata needs them.
+		"""
+		if self.subscriptions is None:
+			self.subscriptions = set()
+		self.subscriptions.update(types)
+
+	def _isWanted(self, event_type):
+		return (self.subscriptions is None or
+			event_type in self.subscriptions or
+			event_type in self.meta.update_handlers or
+			event_type == u'pong')
+
+	def _heartbeat(self):
+		self._heartbeat_call = None
+		now = self._now()
+		self.command_queue.expire(now)
+
+		if self._ping_id is not None:
+			# Nothing has been heard since the last ping.
+			self._ping_id = None
+			self.missed_pongs += 1
+			if self.missed_pongs >= self.max_missed_pongs:
+				self.onHeartbeatTimeout()
+				return
+
+		quiet = now - self._last_received
+		if quiet < self.ping_interval:
+			# Traffic is flowing, so there's no need to ping yet.
+			delay = self.ping_interval - quiet
+		else:
+			self._ping_id = self.sendCommand(type='ping')
+			delay = self.pong_timeout
+
+		self._heartbeat_call = self._callLater(delay, self._heartbeat)
+
+	def onHeartbeatTimeout(self):
+		"""
+		Called when the server has stopped answering pings.  By default, this
+		drops the connection, so that a reconnecting factory can start a new
+		one.
+		"""
+		self.dropConnection(abort=True)
+
+	def onConnect(self, response):
+		self._last_received = self._now()
+		self._heartbeat_call = self._callLater(self.ping_interval, self._heartbeat)
+		if not self.meta.filling and self.meta.next_incomplete() is not None:
+			# Lean session: page in the rest of the metadata in the background.
+			self.meta.filling = True
+			self._fillMetadata()
+
+	def _fillMetadata(self, response=None, kind=None, generation=None):
+		self._fill_call = None
+		if response is not None:
+			self.meta._apply_page(kind, response, generation)
+
+		kind = self.meta.next_incomplete()
+		if kind is None:
+			self.meta.filling = False
+			return
+
+		generation = self.meta._generation
+		d = self.meta._request_page(self.api, kind)
+		self._then(d, lambda response: self._fillMetadata(response, kind, generation), self._fillFailed)
+
+	def _fillFailed(self, error):
+		try:
+			raise error
+		except Exception:
+			self._logError('Error loading metadata.')
+
+		# Carry on from the same page later.
+		self._fill_call = self._callLater(self.fill_retry_delay, self._fillMetadata)
+
+	def onClose(self, wasClean, code, reason):
+		if self._heartbeat_call is not None:
+			self._heartbeat_call.cancel()
+			self._heartbeat_call = None
+		if self._command_call is not None:
+			self._command_call.cancel()
+			self._command_call = None
+		if self._fill_call is not None:
+			# The next connection will carry on loading the metadata.
+			self._fill_call.cancel()
+			self._fill_call = None
+			self.meta.filling = False
+		# Nowhere to send these any more.
+		self.command_queue.clear()
+		while self.pending_acks:
+			self._failCommand(self.pending_acks.popitem(last=False)[1], SlackError('Connection closed'))
+
+	def onMessage(self, msg, binary):
+		# Anything from the server shows the connection is alive.
+		self._last_received = self._now()
+		self.missed_pongs = 0
+		self._ping_id = None
+
+		# What to do on getting messages.
+		if self.subscriptions is not None:
+			# Drop anything nobody is interested in before decoding it.
+			event_type = peek_event_type(msg)
+			if event_type is not None and not self._isWanted(event_type):
+				return
+
+		msg = self.codec.loads(msg)
+		if u'type' in msg and not self._isWanted(msg[u'type']):
+			return
+
+		# This is a freshly parsed message, so there's no need to copy it.
+		msg = decode_event(msg, copy=False)
+
+		if u'reply_to' in msg._b:
+			self._commandAcked(msg)
+
+		# Attempt to update metadata
+		try:
+			self.meta.update(msg)
+		except:
+			self._logError('Error updating metadata.')
+
+		if (self.subscriptions is not None and u'type' in msg._b and
+				msg._b[u'type'] not in self.subscriptions):
+			# Only decoded to update the metadata.
+			return
+
+		# Fire off event
+		try:
+			self.onSlackEvent(msg)
+		except:
+			self._logError('Error calling onSlackEvent().')
+
+	def onMetadataChanged(self, events):
+		"""
+		Called after a batch of events has been applied to the session
+		metadata, with the list of events that were applied.
+		"""
+		pass
+
+	def onCommandAcked(self, msg_id, latency):
+		"""
+		Called when Slack acknowledges a command, with the number of seconds
+		between sending it and the acknowledgement arriving.
+		"""
+		pass
+
+	def sendCommand(self, ack=False, **msg):
+		"""
+		Sends a raw command to the Slack server, generating a message ID automatically.
+
+		The command is queued if sending it now would exceed Slack's rate
+		limits, but the message ID is returned straight away.
+
+		If ``ack`` is set, this instead returns a Deferred (or asyncio Future)
+		which fires with the ``Ack`` event once Slack has acknowledged the
+		command.  It fails with a ``SlackError`` if Slack returns an error, or
+		``AckTimeout`` if there's no acknowledgement within ``ack_timeout``
+		seconds.
+		"""
+		assert 'type' in msg, 'Message type is required.'
+
+		msg_id = msg['id'] = self.next_message_id
+		self.next_message_id += 1
+
+		if self.next_message_id >= MAX_MESSAGE_ID:
+			self.next_message_id = 1
+
+		pending = _PendingCommand(self._makeWaiter() if ack else None)
+		old = self.pending_acks.pop(msg_id, None)
+		if old is not None:
+			# Message IDs have wrapped around, so this can never be matched up.
+			self._failCommand(old, AckTimeout(msg_id))
+		self.pending_acks[msg_id] = pending
+		if len(self.pending_acks) > self.max_pending_acks:
+			old_id, old = self.pending_acks.popitem(last=False)
+			self._failCommand(old, AckTimeout(old_id))
+
+		priority = self.command_priorities.get(msg['type'], PRIORITY_NORMAL)
+		self.command_queue.put(priority, msg.get('channel'), (msg_id, self.codec.dumps(msg)))
+		if self._command_call is not None:
+			# This command might be able to go before whatever is waiting.
+			self._command_call.cancel()
+		self._sendQueued()
+		return msg_id if pending.waiter is None else pending.waiter
+
+	def _sendQueued(self):
+		self._command_call = None
+		while True:
+			command, delay = self.command_queue.pop(self._now())
+			if command is None:
+				break
+
+			msg_id, data = command
+			self.sendMessage(data)
+
+			pending = self.pending_acks.get(msg_id)
+			if pending is not None:
+				pending.sent = self._now()
+				if pending.waiter is not None:
+					pending.timer = self._callLater(self.ack_timeout, self._ackTimedOut, msg_id)
+
+		if delay is not None:
+			self._command_call = self._callLater(delay, self._sendQueued)
+
+
+	def _commandAcked(self, event):
+		msg_id = event._b[u'reply_to']
+		pending = self.pending_acks.pop(msg_id, None)
+		if pending is None:
+			return
+
+		if pending.sent is not None:
+			latency = self._now() - pending.sent
+			if event._b.get(u'type') == u'pong':
+				self.ping_rtt = latency
+			self.ack_latency = latency
+			if self.ack_latency_avg is None:
+				self.ack_latency_avg = latency
+			else:
+				self.ack_latency_avg += (latency - self.ack_latency_avg) * .1
+			try:
+				self.onCommandAcked(msg_id, latency)
+			except:
+				self._logError('Error calling onCommandAcked().')
+
+		if pending.timer is not None:
+			pending.timer.cancel()
+		if pending.waiter is not None:
+			if event._b.get(u'ok', True):
+				self._resolve(pending.waiter, event)
+			else:
+				error = event._b.get(u'error') or {}
+				self._reject(pending.waiter, SlackError(error.get(u'msg', error) if isinstance(error, dict) else error))
+
+	def _ackTimedOut(self, msg_id):
+		pending = self.pending_acks.pop(msg_id, None)
+		if pending is not None:
+			pending.timer = None
+			self._failCommand(pending, AckTimeout(msg_id))
+
+	def _failCommand(self, pending, error):
+		if pending.timer is not None:
+			pending.timer.cancel()
+			pending.timer = None
+		if pending.waiter is not None:
+			self._reject(pending.waiter, error)
+
+	def sendChatMessage(self, text, id=None, user=None, group=None, channel=None, parse='none', link_names=True, unfurl_links=True, unfurl_media=False, send_with_api=False, icon_emoji=None, icon_url=None, username=None, attachments=None, thread_ts=None, reply_broadcast=False, ack=False):
+		"""
+		Sends a chat message to a given id, user, group or channel.
+
+		If the API token is not a bot token (xoxb), ``send_with_api`` may be set
+		to True.  This will send messages using ``chat.postMessage`` in the Slack
+		API, instead of using the WebSockets channel.
+
+		This makes the message sending process a little bit slower, however
+		permits writing of messages containing hyperlinks, like what can be done
+		with Incoming and Outgoing Webhooks integrations.
+
+		Bots are not permitted by Slack to use ``chat.postMessage`` so this will
+		result in an error.
+
+		API calls never block the event loop: if ``send_with_api`` is set, or a new
+		IM needs to be opened to message ``user``, this returns a Deferred (or
+		asyncio Future) which fires with the result.  Otherwise, it returns the message ID.
+
+		If ``ack`` is set, messages sent over the WebSocket return a Deferred (or
+		asyncio Future) which fires with the ``Ack`` event, as for sendCommand().
+
+		Note: channel names must **not** be preceeded with ``#``.
+		"""
+		options = dict(
+			parse=parse,
+			link_names=link_names,
+			unfurl_links=unfurl_links,
+			unfurl_media=unfurl_media,
+			send_with_api=send_with_api,
+			icon_emoji=icon_emoji,
+			icon_url=icon_url,
+			username=username,
+			attachments=attachments,
+			thread_ts=thread_ts,
+			reply_broadcast=reply_broadcast,
+			ack=ack,
+		)
+
+		if id is not None:
+			assert user is None, 'id and user cannot both be set.'
+			assert group is None, 'id and group cannot both be set.'
+			assert channel is None, 'id and channel cannot both be set.'
+		elif user is not None:
+			assert group is None, 'user and group cannot both be set.'
+			assert channel is None, 'user and channel cannot both be set.'
+
+			# Private message to user, get the IM name
+			uid = self.meta.find_user_by_name(user)[0]
+			try:
+				id = self.meta.find_im_by_user_id(uid)[0]
+			except KeyError:
+				# IM does not exist, create it.
+				d = self.api.im.open(token=self.meta.token, user=uid)
+				return self._then(d, lambda response: self._sendChatMessage(response[u'channel'][u'id'], text, **options))
+		elif group is not None:
+			assert channel is None, 'group and channel cannot both be set.'
+
+			# Message to private group, get the group name.
+			id = self.meta.find_group_by_name(group)[0]
+		elif channel is not None:
+			# Message sent to a channel
+			id = self.meta.find_channel_by_name(channel)[0]
+		else:
+			raise Exception('Should not reach here.')
+
+		return self._sendChatMessage(id, text, **options)
+
+	def _sendChatMessage(self, id, text, parse, link_names, unfurl_links, unfurl_media, send_with_api, icon_emoji, icon_url, username, attachments, thread_ts, reply_broadcast, ack):
+		if send_with_api:
+			return self.api.chat.postMessage(
+				token=self.meta.token,
+				channel=id,
+				text=text,
+				parse=parse,
+				link_names=link_names,
+				unfurl_links=unfurl_links,
+				unfurl_media=unfurl_media,
+				icon_url=icon_url,
+				icon_emoji=icon_emoji,
+				username=username,
+				attachments=attachments,
+				thread_ts=thread_ts,
+				reply_broadcast=reply_broadcast,
+			)
+		else:
+			assert icon_url is None, 'icon_url can only be set if send_with_api is True'
+			assert icon_emoji is None, 'icon_emoji can only be set if send_with_api is True'
+			assert username is None, 'username can only be set if send_with_api is True'
+
+			return self.sendCommand(
+				ack=ack,
+				type='message',
+				channel=id,
+				text=text,
+				parse=parse,
+				link_names=link_names,
+				unfurl_links=unfurl_links,
+				unfurl_media=unfurl_media,
+				thread_ts=thread_ts,
+				reply_broadcast=reply_broadcast,
+			)
@@ -0,0 +1,153 @@
+"""
+slackrealtime/sendqueue.py - Paces commands sent to Slack's RTM API.
+Copyright 2020 Michael Farrell <http://micolous.id.au>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import absolute_import
+from collections import OrderedDict, deque
+
+# Lanes that commands are queued in.  Lower lanes are always sent first.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class TokenBucket(object):
+	"""
+	Allows up to ``burst`` actions at once, refilling at ``rate`` actions per
+	second.
+	"""
+	__slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+	def __init__(self, rate, burst, now):
+		self.rate = rate
+		self.burst = burst
+		self.tokens = burst
+		self.updated = now
+
+	def _refill(self, now):
+		if now > self.updated:
+			self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+			self.updated = now
+
+	def delay(self, now):
+		"""
+		Returns the number of seconds until an action is allowed, or 0 if one is
+		allowed now.
+		"""
+		self._refill(now)
+		if self.tokens >= 1:
+			return 0.
+		return (1 - self.tokens) / self.rate
+
+	def take(self, now):
+		self._refill(now)
+		self.tokens -= 1
+
+	def full(self, now):
+		self._refill(now)
+		return self.tokens >= self.burst
+
+
+class SendQueue(object):
+	"""
+	Queues commands, and releases them no faster than Slack allows.
+
+	Commands are sent from the highest priority lane first.  Within a lane,
+	commands for the same channel are sent in order, at up to
+	``channel_rate`` per second each, and channels take turns so that a busy
+	channel doesn't hold up the others.  All commands share a cap of
+	``rate`` per second.
+
+	This only keeps time; it is driven by the protocol, which calls pop()
+	whenever it might be able to send something.
+	"""
+	def __init__(self, now, rate=10., burst=10, channel_rate=1., channel_burst=1):
+		self.channel_rate = channel_rate
+		self.channel_burst = channel_burst
+		self.bucket = TokenBucket(rate, burst, now)
+
+		# For each lane, the queued commands for each channel.
+		self.lanes = (OrderedDict(), OrderedDict(), OrderedDict())
+		self.channel_buckets = {}
+		self.queued = 0
+
+	def __len__(self):
+		return self.queued
+
+	def put(self, priority, channel, command):
+		"""
+		Queues a command.  ``channel`` is None for commands which don't count
+		against any channel's limit, like pings.
+		"""
+		lane = self.lanes[priority]
+		try:
+			lane[channel].append(command)
+		except KeyError:
+			lane[channel] = deque([command])
+		self.queued += 1
+
+	def pop(self, now):
+		"""
+		Takes the next command which may be sent now.
+
+		Returns (command, None), or (None, delay) if nothing may be sent for
+		delay seconds, or (None, None) if the queue is empty.
+		"""
+		if not self.queued:
+			return None, None
+
+		delay = self.bucket.delay(now)
+		if delay:
+			return None, delay
+
+		for lane in self.lanes:
+			for channel, commands in lane.items():
+				if channel is not None:
+					bucket = self.channel_buckets.get(channel)
+					if bucket is None:
+						bucket = self.channel_buckets[channel] = TokenBucket(self.channel_rate, self.channel_burst, now)
+					wait = bucket.delay(now)
+					if wait:
+						delay = wait if delay == 0 else min(delay, wait)
+						continue
+					bucket.take(now)
+
+				self.bucket.take(now)
+				command = commands.popleft()
+				if commands:
+					# Let other channels have a turn.
+					lane.move_to_end(channel)
+				else:
+					del lane[channel]
+				self.queued -= 1
+				return command, None
+
+		return None, delay
+
+	def expire(self, now):
+		"""
+		Forgets about channels which have been idle long enough that their
+		limit has reset.
+		"""
+		for channel in [c for c, b in self.channel_buckets.items() if b.full(now)]:
+			if not any(channel in lane for lane in self.lanes):
+				del self.channel_buckets[channel]
+
+	def clear(self):
+		for lane in self.lanes:
+			lane.clear()
+		self.queued = 0
@@ -17,10 +17,15 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from __future__ import absolute_import
+from collections import deque
+from copy import deepcopy
 from .api import SlackApi
+from .cache import MetadataCache
 from .event import *
+from .store import CHANNEL_FIELDS, USER_FIELDS, CompactStore
 import requests
-from twisted.internet import reactor
+from threading import RLock
+from time import time
 
 
 def transform_metadata(blob):
@@ -36,60 +41,412 @@ def transform_metadata(blob):
 	return o
 
 
+def index_metadata(resources, key):
+	"""
+	Builds a case-insensitive secondary index of a metadata dict, mapping the
+	upper-cased value of ``key`` to the resource's ID.
+
+	Where more than one resource shares a value, the first one wins, which
+	matches the behaviour of a linear search.
+
+	"""
+	o = {}
+	for i, e in resources.items():
+		if key in e:
+			o.setdefault(e[key].upper(), i)
+	return o
+
+
+def _is_stale(resource, fresh, known=False):
+	"""
+	Returns True if ``fresh`` is a newer copy of ``resource``, going by the
+	``updated`` timestamp Slack puts on users and conversations.
+
+	If ``known`` is set, ``resource`` is from before the page was requested
+	(eg: from a previous connection), so it is also replaced if the timestamps
+	are the same but any of the fields in ``fresh`` have changed.  Otherwise,
+	it may have been updated by an event since, so is left alone.
+	"""
+	if resource is None:
+		return True
+
+	updated, fresh_updated = resource.get(u'updated', 0), fresh.get(u'updated', 0)
+	if updated != fresh_updated or not known:
+		return fresh_updated > updated
+
+	# Compact records don't keep every field, so only compare those they do.
+	fields = getattr(resource, 'field_set', None)
+	return any(resource.get(k) != v for k, v in fresh.items() if fields is None or k in fields)
+
+
+def _copy_objects(body):
+	"""
+	Copies an event body, along with any objects (such as a channel or user)
+	in it.
+	"""
+	return dict((k, dict(v) if isinstance(v, dict) else v) for k, v in body.items())
+
+
+def _user_key(event):
+	if u'users' in event._b:
+		return tuple(event._b[u'users'])
+
+	user = event._b.get(u'user')
+	if isinstance(user, dict):
+		return user.get(u'id')
+	return user
+
+
 class SessionMetadata(object):
-	def __init__(self, data, api, token):
+	# Maximum number of updates to hold before applying them immediately.
+	max_pending = 1000
+
+	# Seconds to wait for more updates before applying them.  Bursts of
+	# updates received in this time are coalesced (see coalesce_keys).
+	update_delay = 0.
+
+	# Number of users or conversations to request at a time, for lean sessions.
+	page_size = 200
+
+	# Conversation types to request, for lean sessions.
+	conversation_types = u'public_channel,private_channel,mpim,im'
+
+	# Minimum seconds between snapshots of the metadata to the cache.
+	save_interval = 300.
+
+	# Snapshots saved less than this many seconds ago are used as they are,
+	# rather than loading the metadata again.
+	max_cache_age = 300.
+
+	# Fields kept for users, and for channels, groups and IMs, in a compact
+	# session.
+	user_fields = USER_FIELDS
+	channel_fields = CHANNEL_FIELDS
+
+	def __init__(self, data, api, token, lean=False, cache=None, compact=False):
 		self.api = api
 		self.token = token
+		self.compact = compact
+
+		# MetadataCache that snapshots are loaded from and saved to.
+		self.cache = cache
+		self._saving = False
+		self._last_saved = time()
+
+		fresh = False
+		if cache is not None:
+			# The metadata is loaded (or refreshed) in the background, as for a
+			# lean session, and saved once that's done.
+			lean = True
+			cached = cache.load()
+			if cached is not None and cached[u'team'][u'id'] == data['team']['id']:
+				data = dict(cached, **data)
+				data['team'] = dict(cached[u'team'], **data['team'])
+				fresh = time() - cached.get(u'saved', 0) < self.max_cache_age
+
+		# Lean sessions start out without users and conversations, and page them
+		# in later, either in the background once connected, or with fill().
+		self.lean = lean
+		self.complete = set() if lean and not fresh else set([u'users', u'conversations'])
+		self.filling = False
+		self._cursors = {}
+
+		# IDs of the users and conversations which were known when the metadata
+		# started being loaded again, and which of them have been seen since.
+		# Bumped each time loading starts again, so that pages requested before
+		# then are dropped.
+		self._known = {}
+		self._seen = {}
+		self._generation = 0
+
+		# Non-blocking API client (TxSlackApi), shared by protocols using this
+		# session.  Set by RtmProtocol.
+		self.txapi = None
+
+		# Held while the metadata is changed, or read from another thread.
+		self.lock = RLock()
+
+		# Updates waiting to be applied, in the order they were received.
+		self._pending = deque()
+		self._flush_call = None
+
+		# The protocol using this session, which is told when the metadata has
+		# changed.  Set by RtmProtocol.
+		self.protocol = None
 
 		self.url = data['url']
 		self.me = data['self']
 		self.team = data['team']
 
 		# All users on the Slack instance.
-		self.users = transform_metadata(data['users'])
+		self.users = transform_metadata(data.get('users', []))
 
 		# All public channels on the Slack instance.
-		self.channels = transform_metadata(data['channels'])
+		self.channels = transform_metadata(data.get('channels', []))
 
 		# All private groups on the Slack instance.
-		self.groups = transform_metadata(data['groups'])
+		self.groups = transform_metadata(data.get('groups', []))
 
 		# All private messages on the Slack instance.
-		self.ims = transform_metadata(data['ims'])
+		self.ims = transform_metadata(data.get('ims', []))
 
 		# All bots on the slack instance.
-		self.bots = transform_metadata(data['bots'])
+		self.bots = transform_metadata(data.get('bots', []))
+
+		if compact:
+			# Only keep some fields of each resource.  The full resource can be
+			# fetched with (eg) self.users.fetch(uid).
+			self.users = CompactStore(self.user_fields, self.users, self._fetch_user)
+			self.channels = CompactStore(self.channel_fields, self.channels, self._fetch_conversation)
+			self.groups = CompactStore(self.channel_fields, self.groups, self._fetch_conversation)
+			self.ims = CompactStore(self.channel_fields, self.ims, self._fetch_conversation)
+
+		# Secondary indexes of the above, for constant-time lookups by name.
+		self._channels_by_name = index_metadata(self.channels, u'name')
+		self._users_by_name = index_metadata(self.users, u'name')
+		self._groups_by_name = index_metadata(self.groups, u'name')
+		self._ims_by_user = index_metadata(self.ims, u'user')
+
+		if self.users or self.channels or self.groups or self.ims:
+			if not self.complete:
+				# Started from a snapshot, which may be out of date.
+				self._refresh()
+
+	def _nonblocking_api(self):
+		"""
+		Returns the non-blocking API client shared with the protocol, creating
+		one if there isn't one yet.
+		"""
+		if self.txapi is None:
+			from .txapi import TxSlackApi
+			self.txapi = TxSlackApi(self.api.url, codec=self.api.codec, timeout=self.api.timeout)
+		return self.txapi
 
-	def _find_resource_by_key(self, resource_list, key, value):
+	def _fetch_resource(self, group, field, **params):
 		"""
-		Finds a resource by key, first case insensitive match.
+		Requests a single resource with ``group.info``, without blocking.
+		Returns a Deferred which fires with the resource.
+		"""
+		d = getattr(self._nonblocking_api(), group).info(token=self.token, **params)
+		d.addCallback(lambda response: response[field])
+		return d
+
+	def _fetch_user(self, uid):
+		return self._fetch_resource(u'users', u'user', user=uid)
+
+	def _fetch_conversation(self, cid):
+		return self._fetch_resource(u'conversations', u'channel', channel=cid)
+
+	def _find_resource_by_key(self, resource_list, index, value):
+		"""
+		Finds a resource by key using a secondary index, case insensitive.
+
+		Lean sessions may not have loaded the resource yet, in which case this
+		also raises KeyError; this never blocks to load it.
 
 		Returns tuple of (key, resource)
 
 		Raises KeyError if the given key cannot be found.
 		"""
-		original = value
-		value = str(value.upper())
-		for k, resource in resource_list.items():
-			if key in resource and resource[key].upper() == value:
-				return k, resource
+		with self.lock:
+			k = index.get(str(value.upper()))
+			if k is None:
+				raise KeyError(value)
+			return k, resource_list[k]
 
-		raise KeyError(original)
+	def _request_page(self, api, kind):
+		"""
+		Requests the next page of ``kind`` (``users`` or ``conversations``) from
+		the API.  The result is a Deferred or Future for asynchronous clients.
+		"""
+		params = dict(token=self.token, limit=self.page_size, cursor=self._cursors.get(kind))
+		if kind == u'conversations':
+			params[u'types'] = self.conversation_types
+		return getattr(api, kind).list(**params)
+
+	def _resource_lists(self, kind):
+		"""
+		Returns (resource_list, index, key) for each place that ``kind`` of
+		metadata is stored.
+		"""
+		if kind == u'users':
+			return [(self.users, self._users_by_name, u'name')]
+		return [
+			(self.channels, self._channels_by_name, u'name'),
+			(self.groups, self._groups_by_name, u'name'),
+			(self.ims, self._ims_by_user, u'user'),
+		]
+
+	def _refresh(self):
+		"""
+		Starts loading all users and conversations again, as for a lean session,
+		to catch up on changes made while disconnected.  Only those which have
+		changed are replaced, and those which are gone are removed, once every
+		page has been loaded.
+		"""
+		with self.lock:
+			self._generation += 1
+			self.complete.clear()
+			self._cursors.clear()
+			self._seen.clear()
+			for kind in (u'users', u'conversations'):
+				self._known[kind] = set()
+				for resource_list, index, key in self._resource_lists(kind):
+					self._known[kind].update(resource_list)
+
+	def _apply_page(self, kind, response, generation=None):
+		"""
+		Stores a page of users or conversations returned by _request_page().
+		Anything already known is only replaced if the page has a newer copy of
+		it, as it may have been updated by an event since.
+
+		``generation`` is the value of ``_generation`` when the page was
+		requested.  Pages requested before loading started again are dropped.
+		"""
+		with self.lock:
+			if generation is not None and generation != self._generation:
+				return
+
+			known = self._known.get(kind, ())
+			seen = self._seen.setdefault(kind, {})
+			if kind == u'users':
+				for user in response[u'members']:
+					i = user[u'id']
+					seen[i] = self.users
+					if _is_stale(self.users.get(i), user, i in known):
+						self._set_resource(self.users, self._users_by_name, u'name', i, user)
+			else:
+				for conversation in response[u'channels']:
+					i = conversation[u'id']
+					if conversation.get(u'is_im'):
+						resource_list, index, key = self.ims, self._ims_by_user, u'user'
+					elif conversation.get(u'is_private') or conversation.get(u'is_mpim'):
+						resource_list, index, key = self.groups, self._groups_by_name, u'name'
+					else:
+						resource_list, index, key = self.channels, self._channels_by_name, u'name'
+
+					seen[i] = resource_list
+					if _is_stale(resource_list.get(i), conversation, i in known):
+						self._set_resource(resource_list, index, key, i, conversation)
+
+			cursor = response.get(u'response_metadata', {}).get(u'next_cursor')
+			if cursor:
+				self._cursors[kind] = cursor
+			else:
+				self.complete.add(kind)
+				self._cursors.pop(kind, None)
+				self._remove_missing(kind)
+				if self.next_incomplete() is None:
+					# Everything is up to date, so keep a copy of it.
+					self._last_saved = 0
+					self._maybe_save()
+
+	def _remove_missing(self, kind):
+		"""
+		Once every page of ``kind`` has been loaded, removes anything which was
+		known beforehand but wasn't in any page (or was, but in another list, eg:
+		a channel which became private).  Anything added by an event in the
+		meantime is kept.
+		"""
+		known = self._known.pop(kind, ())
+		seen = self._seen.pop(kind, {})
+		for resource_list, index, key in self._resource_lists(kind):
+			for i in [i for i in resource_list if i in known and seen.get(i) is not resource_list]:
+				self._unindex_resource(resource_list, index, key, i, resource_list.pop(i))
+
+	def next_incomplete(self):
+		"""
+		Returns the next kind of metadata which hasn't been fully loaded, or None
+		if everything has been loaded.
+		"""
+		for kind in (u'users', u'conversations'):
+			if kind not in self.complete:
+				return kind
+		return None
+
+	def fill(self):
+		"""
+		Loads all remaining users and conversations in a lean session, a page at
+		a time.  This blocks until done, so is only for scripts which don't run
+		an event loop; RtmProtocol does this in the background instead.
+		"""
+		while True:
+			kind = self.next_incomplete()
+			if kind is None:
+				return
+			generation = self._generation
+			self._apply_page(kind, self._request_page(self.api, kind), generation)
+
+	def _unindex_resource(self, resource_list, index, key, i, resource):
+		"""
+		Removes a resource's entry from a secondary index, if it owns it.
+
+		If another resource in resource_list shares the same value, the index
+		then points to that one instead.
+		"""
+		if resource is not None and key in resource:
+			value = resource[key].upper()
+			if index.get(value) == i:
+				del index[value]
+				for k, other in resource_list.items():
+					if k != i and key in other and other[key].upper() == value:
+						index[value] = k
+						break
+
+	def _set_resource(self, resource_list, index, key, i, resource):
+		"""
+		Stores a resource in resource_list, keeping its secondary index up to
+		date.
+		"""
+		old = resource_list.get(i)
+		if old is not None and key in old and key in resource and old[key].upper() == resource[key].upper():
+			# Still indexed under the same value.
+			resource_list[i] = resource
+			return
+
+		self._unindex_resource(resource_list, index, key, i, old)
+		resource_list[i] = resource
+		if key in resource:
+			index.setdefault(resource[key].upper(), i)
+
+	def _rename_resource(self, resource_list, index, i, name):
+		"""
+		Renames a resource in resource_list, keeping its secondary index up to
+		date.  Resources which haven't been loaded are skipped.
+		"""
+		resource = resource_list.get(i)
+		if resource is None:
+			return
+		self._unindex_resource(resource_list, index, u'name', i, resource)
+		resource[u'name'] = name
+		index.setdefault(name.upper(), i)
+
+	def _change_resource(self, resource_list, i, changes):
+		"""
+		Changes fields of a resource in resource_list.
+
+		Lean sessions may not have loaded the resource yet, in which case it is
+		skipped: it will be up to date once it is loaded.
+		"""
+		resource = resource_list.get(i)
+		if resource is not None:
+			for k, v in changes.items():
+				resource[k] = v
 
 	def find_channel_by_name(self, name):
 		"""
 		Finds the channel's resource by name.
 		"""
-		return self._find_resource_by_key(self.channels, u'name', name)
+		return self._find_resource_by_key(self.channels, self._channels_by_name, name)
 
 	def find_user_by_name(self, name):
-		return self._find_resource_by_key(self.users, u'name', name)
+		return self._find_resource_by_key(self.users, self._users_by_name, name)
 
 	def find_group_by_name(self, name):
-		return self._find_resource_by_key(self.groups, u'name', name)
+		return self._find_resource_by_key(self.groups, self._groups_by_name, name)
 
 	def find_im_by_user_id(self, uid):
-		return self._find_resource_by_key(self.ims, u'user', uid)
+		return self._find_resource_by_key(self.ims, self._ims_by_user, uid)
 
 	def find_im_by_user_name(self, name, auto_create=True):
 		"""
@@ -107,118 +464,404 @@ class SessionMetadata(object):
 			else:
 				raise
 
+	def reconcile(self, data):
+		"""
+		Brings the metadata up to date after reconnecting, using the response
+		from ``rtm.connect`` (or ``rtm.start``).
+
+		Users and conversations are then loaded again, a page at a time, by the
+		next connection (or fill()), replacing those which have changed while
+		disconnected and removing those which are gone.
+		"""
+		with self.lock:
+			self.url = data['url']
+			self.me = data['self']
+			self.team.update(data['team'])
+			self._refresh()
+
+	def snapshot(self):
+		"""
+		Takes a consistent copy of the metadata, which is safe to read from any
+		thread while updates continue to be applied.
+
+		Returns a dict of ``users``, ``channels``, ``groups``, ``ims``, ``bots``
+		and ``team``, each a deep copy of the corresponding attribute.
+		"""
+		with self.lock:
+			return dict(
+				users=dict((k, deepcopy(dict(v))) for k, v in self.users.items()),
+				channels=dict((k, deepcopy(dict(v))) for k, v in self.channels.items()),
+				groups=dict((k, deepcopy(dict(v))) for k, v in self.groups.items()),
+				ims=dict((k, deepcopy(dict(v))) for k, v in self.ims.items()),
+				bots=dict((k, deepcopy(dict(v))) for k, v in self.bots.items()),
+				team=deepcopy(self.team),
+			)
+
+	def save(self):
+		"""
+		Writes a snapshot of the metadata to the cache, blocking until it is
+		done.  This may be called from any thread.
+
+		While the reactor is running, snapshots are also saved in the background
+		as the metadata changes, at most every save_interval seconds.
+		"""
+		# Updates only ever replace a resource, or set its top level fields (and
+		# team prefs), so copying those is enough to serialise the snapshot
+		# outside the lock, without holding up flush() while it is deep copied.
+		with self.lock:
+			team = dict(self.team)
+			if u'prefs' in team:
+				team[u'prefs'] = dict(team[u'prefs'])
+			snapshot = {
+				u'self': self.me,
+				u'team': team,
+				u'users': [dict(v) for v in self.users.values()],
+				u'channels': [dict(v) for v in self.channels.values()],
+				u'groups': [dict(v) for v in self.groups.values()],
+				u'ims': [dict(v) for v in self.ims.values()],
+				u'bots': [dict(v) for v in self.bots.values()],
+			}
+		snapshot[u'saved'] = time()
+		self.cache.save(snapshot)
+
+	def _maybe_save(self):
+		"""
+		Starts saving a snapshot in the background, unless one was saved in the
+		last save_interval seconds, or is being saved now.
+		"""
+		if (self.cache is None or self._saving or
+				time() - self._last_saved < self.save_interval):
+			return
+
+		self._saving = True
+		self._run_in_background(self._save_in_background)
+
+	def _save_in_background(self):
+		try:
+			self.save()
+		except:
+			self._log_error('Error saving metadata to %s' % (self.cache,))
+		finally:
+			self._last_saved = time()
+			self._saving = False
+
 	def update(self, event):
 		"""
 		All messages from the Protocol get passed through this method.  This
 		allows the client to have an up-to-date state for the client.
 		
 		However, this method doesn't actually update right away.  Instead, the
-		acutal update happens in another thread, potentially later, in order to
-		allow user code to handle the event faster.
+		update is queued, and applied in order on the reactor thread once user
+		code has handled the event.  If more than ``max_pending`` updates are
+		queued, they are all applied immediately.
 		
 		"""
 		
-		# Create our own copy of the event data, as we'll be pushing that to
-		# another data structure and we don't want it mangled by user code later
-		# on.
-		event = event.copy()
+		if event._b.get(u'type') not in self.update_handlers:
+			# Nothing to update for this sort of event.
+			return
+
+		# Create our own copy of the objects in the event now, as user code
+		# sees the event before it is applied, and we don't want it mangled.
+		# Only events that change the metadata get this far, so messages and
+		# the like are never copied.
+		self._pending.append(decode_event(_copy_objects(event._b), event._received, copy=False))
+
+		if len(self._pending) >= self.max_pending:
+			self.flush()
+		elif self._flush_call is None:
+			self._flush_call = self._schedule_flush(self.update_delay)
+
+	def _schedule_flush(self, delay):
+		"""
+		Arranges for flush() to be called after delay seconds, on the reactor
+		thread.  Returns a handle for _cancel_flush().
+		"""
+		# Twisted is only imported here, so that asyncio clients (which override
+		# this) don't need it.
+		from twisted.internet import reactor
+		return reactor.callLater(delay, self.flush)
+
+	def _cancel_flush(self, handle):
+		if handle.active():
+			handle.cancel()
 
-		# Now just defer the work to later.
-		reactor.callInThread(self._update_deferred, event)
+	def _run_in_background(self, func):
+		"""
+		Calls func in a thread, so that it doesn't block the reactor.  This may
+		be called from any thread.
+
+		If the reactor isn't running (eg: in a script using fill()), func is
+		called straight away instead, as it would otherwise never be called.
+		"""
+		from twisted.internet import reactor
+		if reactor.running:
+			reactor.callFromThread(reactor.callInThread, func)
+		else:
+			func()
+
+	def _log_error(self, msg):
+		from twisted.python import log
+		log.msg(msg)
+		log.err()
+
+	def _coalesce(self, events):
+		"""
+		Drops events which are made redundant by a later event in the same
+		batch, such as an older presence_change for the same user.
+		"""
+		seen = set()
+		o = []
+		for event in reversed(events):
+			t = event._b.get(u'type')
+			key_func = self.coalesce_keys.get(t)
+			if key_func is not None:
+				key = key_func(event)
+				if key is not None:
+					if (t, key) in seen:
+						continue
+					seen.add((t, key))
+			o.append(event)
+
+		o.reverse()
+		return o
+
+	def flush(self):
+		"""
+		Applies all queued updates, in the order they were received.
+
+		Once they've been applied, the protocol's onMetadataChanged() is called
+		with the list of events that were applied.
+		"""
+		if self._flush_call is not None:
+			self._cancel_flush(self._flush_call)
+			self._flush_call = None
+
+		if not self._pending:
+			return
+
+		events = self._pending
+		self._pending = deque()
+		if len(events) > 1:
+			events = self._coalesce(events)
+
+		with self.lock:
+			for event in events:
+				try:
+					self._update_deferred(event)
+				except:
+					self._log_error('Error updating metadata from %s' % (event,))
+
+		if self.protocol is not None:
+			try:
+				self.protocol.onMetadataChanged(events)
+			except:
+				self._log_error('Error calling onMetadataChanged().')
+
+		self._maybe_save()
 
 	def _update_deferred(self, event):
 		"""
 		This does the actual work of updating channel metadata.  This is called
-		by the update(), and runs this method in another thread.
-		"""
-		if isinstance(event, ChannelCreated):
-			i = event.channel[u'id']
-			event.channel[u'is_archived'] = event.channel[u'is_member'] = False
-
-			self.channels[i] = event.channel
-		elif isinstance(event, ChannelArchive):
-			self.channels[event.channel][u'is_archived'] = True
-		elif isinstance(event, GroupArchive):
-			self.groups[event.channel][u'is_archived'] = True
-		elif isinstance(event, ChannelDeleted):
-			# FIXME: Handle delete events properly.
-			# Channels don't really get deleted, they're more just archived.
-			self.channels[event.channel][u'is_archived'] = True
-			self.channels[event.channel][u'is_open'] = False
-		elif isinstance(event, GroupClose):
-			# When you close a group, it isn't open to you anymore, but it might
-			# still exist. Treat it like ChannelDeleted
-			self.groups[event.channel][u'is_archived'] = True
-			self.groups[event.channel][u'is_open'] = False
-		elif isinstance(event, ChannelJoined):
-			cid = event.channel[u'id']
-			self.channels[cid] = event.channel
-		elif isinstance(event, GroupJoined):
-			gid = event.channel[u'id']
-			self.groups[gid] = event.channel
-		elif isinstance(event, ChannelLeft):
-			self.channels[event.channel][u'is_member'] = False
-		elif isinstance(event, GroupLeft):
-			self.groups[event.channel][u'is_member'] = False
-		elif isinstance(event, ChannelMarked):
-			# TODO: implement datetime handler properly
-			self.channels[event.channel][u'last_read'] = event._b[u'ts']
-		elif isinstance(event, GroupMarked):
-			self.groups[event.channel][u'last_read'] = event._b[u'ts']
-		elif isinstance(event, ChannelRename):
-			self.channels[event.channel[u'id']][u'name'] = event.channel[u'name']
-		elif isinstance(event, GroupRename):
-			self.groups[event.channel[u'id']][u'name'] = event.channel[u'name']
-		elif isinstance(event, ChannelUnarchive):
-			self.channels[event.channel][u'is_archived'] = False
-		elif isinstance(event, GroupUnarchive):
-			self.groups[event.channel][u'is_archived'] = False
-		elif isinstance(event, ImClose):
-			self.ims[event.channel][u'is_open'] = False
-		elif isinstance(event, ImCreated):
-			i = event.channel[u'id']
-			event.channel[u'user'] = event.user
-
-			self.ims[i] = event.channel
-		elif isinstance(event, ImMarked):
-			# TODO: implement datetime handler properly
-			self.ims[event.channel][u'last_read'] = event._b[u'ts']
-		elif isinstance(event, ImOpen):
-			self.ims[event.channel][u'is_open'] = True
-		elif isinstance(event, PresenceChange):
-			self.users[event.user][u'presence'] = event.presence
-		elif isinstance(event, UserChange):
-			# Everything but the status is provided
-			# Copy this out of the existing object
-
-			uid = event.user[u'id']
-
-			if event.user.get(u'status') is None and u'presence' in self.users[uid]:
-				event.user[u'status'] = self.users[uid][u'presence']
-
-			self.users[uid] = event.user
-		elif isinstance(event, TeamPrefChange):
-			self.team[u'prefs'][event.name] = event.value
-		elif isinstance(event, TeamJoin):
-			uid = event.user[u'id']
-			self.users[uid] = event.user
-		elif isinstance(event, BotAdded) or isinstance(event, BotChanged):
-			bid = event.bot[u'id']
-			self.bots[bid] = event.bot
-
-
-def request_session(token, url=None):
+		by flush(), on the reactor thread, with the lock held.
+		"""
+		handler = self.update_handlers.get(event._b.get(u'type'))
+		if handler is not None:
+			handler(self, event)
+
+	@classmethod
+	def register_update_handler(cls, event_type, handler):
+		"""
+		Registers a handler to update the metadata when an event of a given type
+		(eg: ``'dnd_updated'``) is received.  This replaces any existing handler
+		for that type.
+
+		The handler is called as ``handler(metadata, event)``, with the lock held.
+
+		Handlers registered on a subclass only apply to that subclass.
+		"""
+		if 'update_handlers' not in cls.__dict__:
+			cls.update_handlers = dict(cls.update_handlers)
+		cls.update_handlers[event_type] = handler
+
+	def _on_channel_created(self, event):
+		channel = dict(event.channel)
+		channel[u'is_archived'] = channel[u'is_member'] = False
+
+		self._set_resource(self.channels, self._channels_by_name, u'name', channel[u'id'], channel)
+
+	def _on_channel_archive(self, event):
+		self._change_resource(self.channels, event.channel, {u'is_archived': True})
+
+	def _on_group_archive(self, event):
+		self._change_resource(self.groups, event.channel, {u'is_archived': True})
+
+	def _on_channel_deleted(self, event):
+		# FIXME: Handle delete events properly.
+		# Channels don't really get deleted, they're more just archived.
+		self._change_resource(self.channels, event.channel, {u'is_archived': True, u'is_open': False})
+
+	def _on_group_close(self, event):
+		# When you close a group, it isn't open to you anymore, but it might
+		# still exist. Treat it like ChannelDeleted
+		self._change_resource(self.groups, event.channel, {u'is_archived': True, u'is_open': False})
+
+	def _on_channel_joined(self, event):
+		cid = event.channel[u'id']
+		self._set_resource(self.channels, self._channels_by_name, u'name', cid, dict(event.channel))
+
+	def _on_group_joined(self, event):
+		gid = event.channel[u'id']
+		self._set_resource(self.groups, self._groups_by_name, u'name', gid, dict(event.channel))
+
+	def _on_channel_left(self, event):
+		self._change_resource(self.channels, event.channel, {u'is_member': False})
+
+	def _on_group_left(self, event):
+		self._change_resource(self.groups, event.channel, {u'is_member': False})
+
+	def _on_channel_marked(self, event):
+		# TODO: implement datetime handler properly
+		self._change_resource(self.channels, event.channel, {u'last_read': event._b[u'ts']})
+
+	def _on_group_marked(self, event):
+		self._change_resource(self.groups, event.channel, {u'last_read': event._b[u'ts']})
+
+	def _on_channel_rename(self, event):
+		self._rename_resource(self.channels, self._channels_by_name, event.channel[u'id'], event.channel[u'name'])
+
+	def _on_group_rename(self, event):
+		self._rename_resource(self.groups, self._groups_by_name, event.channel[u'id'], event.channel[u'name'])
+
+	def _on_channel_unarchive(self, event):
+		self._change_resource(self.channels, event.channel, {u'is_archived': False})
+
+	def _on_group_unarchive(self, event):
+		self._change_resource(self.groups, event.channel, {u'is_archived': False})
+
+	def _on_im_close(self, event):
+		self._change_resource(self.ims, event.channel, {u'is_open': False})
+
+	def _on_im_created(self, event):
+		im = dict(event.channel)
+		im[u'user'] = event.user
+
+		self._set_resource(self.ims, self._ims_by_user, u'user', im[u'id'], im)
+
+	def _on_im_marked(self, event):
+		# TODO: implement datetime handler properly
+		self._change_resource(self.ims, event.channel, {u'last_read': event._b[u'ts']})
+
+	def _on_im_open(self, event):
+		self._change_resource(self.ims, event.channel, {u'is_open': True})
+
+	def _on_presence_change(self, event):
+		if u'users' in event._b:
+			# Batched presence change for many users.
+			uids = event.users
+		else:
+			uids = [event.user]
+
+		for uid in uids:
+			self._change_resource(self.users, uid, {u'presence': event.presence})
+
+	def _on_user_change(self, event):
+		# Everything but the status is provided
+		# Copy this out of the existing object
+
+		user = dict(event.user)
+		uid = user[u'id']
+		old = self.users.get(uid)
+
+		if user.get(u'status') is None and old is not None and u'presence' in old:
+			user[u'status'] = old[u'presence']
+
+		self._set_resource(self.users, self._users_by_name, u'name', uid, user)
+
+	def _on_team_pref_change(self, event):
+		self.team.setdefault(u'prefs', {})[event.name] = event.value
+
+	def _on_team_join(self, event):
+		uid = event.user[u'id']
+		self._set_resource(self.users, self._users_by_name, u'name', uid, dict(event.user))
+
+	def _on_bot_changed(self, event):
+		bid = event.bot[u'id']
+		self.bots[bid] = dict(event.bot)
+
+	# Handlers for events which change the metadata, keyed by event type.
+	update_handlers = {
+		u'channel_archive': _on_channel_archive,
+		u'channel_created': _on_channel_created,
+		u'channel_deleted': _on_channel_deleted,
+		u'channel_joined': _on_channel_joined,
+		u'channel_left': _on_channel_left,
+		u'channel_marked': _on_channel_marked,
+		u'channel_rename': _on_channel_rename,
+		u'channel_unarchive': _on_channel_unarchive,
+
+		u'im_close': _on_im_close,
+		u'im_created': _on_im_created,
+		u'im_marked': _on_im_marked,
+		u'im_open': _on_im_open,
+
+		u'group_joined': _on_group_joined,
+		u'group_left': _on_group_left,
+		u'group_close': _on_group_close,
+		u'group_archive': _on_group_archive,
+		u'group_unarchive': _on_group_unarchive,
+		u'group_rename': _on_group_rename,
+		u'group_marked': _on_group_marked,
+
+		u'bot_added': _on_bot_changed,
+		u'bot_changed': _on_bot_changed,
+
+		u'presence_change': _on_presence_change,
+		u'user_change': _on_user_change,
+		u'team_pref_change': _on_team_pref_change,
+		u'team_join': _on_team_join,
+	}
+
+	# For events where only the latest of a burst matters, gets the thing that
+	# the event is about.  Older events about the same thing are dropped.
+	coalesce_keys = {
+		u'presence_change': _user_key,
+		u'user_change': _user_key,
+	}
+
+
+def request_session(token, url=None, codec=None, lean=False, cache=None, compact=False):
 	"""
 	Requests a WebSocket session for the Real-Time Messaging API.
+
+	If ``lean`` is set, the session is started with ``rtm.connect`` rather than
+	``rtm.start``, which doesn't return the team's users and conversations.
+	These are loaded later, a page at a time, and until then find_*() methods
+	raise KeyError for anything which hasn't been loaded yet.
+
+	``cache`` is a MetadataCache (or a path to one) to start from and save the
+	metadata to.  This makes the session lean, and if the cache holds a
+	snapshot it is used until the refreshed metadata has been loaded.  Only
+	entries which have changed since are replaced.  A snapshot saved less than
+	SessionMetadata.max_cache_age seconds ago is used as it is.
+
+	If ``compact`` is set, only the fields in SessionMetadata.user_fields and
+	channel_fields are kept, to save memory on large teams.
 	
 	Returns a SessionMetadata object containing the information retrieved from
 	the API call.
 	"""
 	if url is None:
-		api = SlackApi()
+		api = SlackApi(codec=codec)
 	else:
-		api = SlackApi(url)
+		api = SlackApi(url, codec=codec)
 
-	response = api.rtm.start(token=token)
-	return SessionMetadata(response, api, token)
+	if cache is not None and not isinstance(cache, MetadataCache):
+		cache = MetadataCache(cache, api.codec)
+
+	if lean or cache is not None:
+		response = api.rtm.connect(token=token)
+	else:
+		response = api.rtm.start(token=token)
+	return SessionMetadata(response, api, token, lean, cache, compact)
 
@@ -0,0 +1,166 @@
+"""
+slackrealtime/store.py - Compact storage for large amounts of session metadata.
+Copyright 2020 Michael Farrell <http://micolous.id.au>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import absolute_import
+from collections.abc import MutableMapping
+from sys import intern
+
+# Fields kept for users in a compact session.
+USER_FIELDS = (
+	u'id', u'name', u'real_name', u'deleted', u'is_bot', u'is_admin',
+	u'updated', u'tz', u'presence', u'status',
+)
+
+# Fields kept for channels, groups and IMs in a compact session.
+CHANNEL_FIELDS = (
+	u'id', u'name', u'user', u'created', u'creator', u'updated',
+	u'is_archived', u'is_member', u'is_open', u'is_private', u'is_im',
+	u'is_mpim', u'last_read',
+)
+
+# Fields whose values are interned, as they are repeated or looked up often.
+INTERNED_FIELDS = frozenset([u'id', u'name', u'user', u'creator', u'tz', u'presence'])
+
+_record_classes = {}
+
+
+class CompactRecord(MutableMapping):
+	"""
+	A metadata resource holding only some of its fields, in slots rather than
+	a dict.  It otherwise behaves like the dict it was made from.
+
+	Fields outside of the projection are dropped when the record is created,
+	but may be set later, in which case they are kept in a dict of their own.
+	"""
+	__slots__ = ('_extra',)
+	fields = ()
+	field_set = frozenset()
+
+	def __init__(self, resource):
+		self._extra = None
+		for k in self.fields:
+			if k in resource:
+				v = resource[k]
+				if k in INTERNED_FIELDS and isinstance(v, str):
+					v = intern(v)
+				object.__setattr__(self, k, v)
+
+	def __getitem__(self, k):
+		if k in self.field_set:
+			try:
+				return getattr(self, k)
+			except AttributeError:
+				raise KeyError(k)
+
+		if self._extra is None:
+			raise KeyError(k)
+		return self._extra[k]
+
+	def __setitem__(self, k, v):
+		if k in self.field_set:
+			object.__setattr__(self, k, v)
+		else:
+			if self._extra is None:
+				self._extra = {}
+			self._extra[k] = v
+
+	def __delitem__(self, k):
+		if k in self.field_set:
+			try:
+				object.__delattr__(self, k)
+			except AttributeError:
+				raise KeyError(k)
+		elif self._extra is None:
+			raise KeyError(k)
+		else:
+			del self._extra[k]
+
+	def __contains__(self, k):
+		if k in self.field_set:
+			return hasattr(self, k)
+		return self._extra is not None and k in self._extra
+
+	def __iter__(self):
+		for k in self.fields:
+			if hasattr(self, k):
+				yield k
+		if self._extra is not None:
+			for k in self._extra:
+				yield k
+
+	def __len__(self):
+		return sum(1 for k in self)
+
+	def __repr__(self):
+		return '<%s: %r>' % (self.__class__.__name__, dict(self))
+
+
+def record_class(fields):
+	"""
+	Returns a CompactRecord subclass with a slot for each of ``fields``.
+	"""
+	fields = tuple(fields)
+	try:
+		return _record_classes[fields]
+	except KeyError:
+		pass
+
+	for k in fields:
+		if hasattr(CompactRecord, k):
+			raise ValueError('Field %r clashes with a CompactRecord attribute.' % k)
+
+	cls = type('CompactRecord', (CompactRecord,), dict(
+		__slots__=fields,
+		fields=fields,
+		field_set=frozenset(fields),
+	))
+	_record_classes[fields] = cls
+	return cls
+
+
+class CompactStore(dict):
+	"""
+	A dict of metadata resources, keyed by ID, which stores each resource as
+	a CompactRecord holding only ``fields``.
+
+	``loader`` is called with an ID to fetch the full resource, for fetch(),
+	and returns a Deferred or Future which resolves to it.
+	"""
+	def __init__(self, fields, resources=None, loader=None):
+		super(CompactStore, self).__init__()
+		self.record_class = record_class(fields)
+		self.loader = loader
+		if resources is not None:
+			for i, resource in resources.items():
+				self[i] = resource
+
+	def __setitem__(self, i, resource):
+		if not isinstance(resource, self.record_class):
+			resource = self.record_class(resource)
+		super(CompactStore, self).__setitem__(intern(i), resource)
+
+	def fetch(self, i):
+		"""
+		Fetches the full resource with ID ``i``, including fields which aren't
+		stored.  This doesn't block: it returns a Deferred (or a Future, in an
+		asyncio session) which fires with the resource once it has been
+		requested from the API.
+		"""
+		if self.loader is None:
+			raise KeyError(i)
+		return self.loader(i)
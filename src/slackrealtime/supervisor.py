@@ -0,0 +1,350 @@
+"""
+slackrealtime/supervisor.py - Spreads RTM connections over worker processes.
+Copyright 2020 Michael Farrell <http://micolous.id.au>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import absolute_import
+from argparse import ArgumentParser
+from importlib import import_module
+import os
+import struct
+import sys
+from twisted.internet import reactor, stdio, task
+from twisted.internet.protocol import ProcessProtocol
+from twisted.protocols.basic import Int32StringReceiver
+from twisted.python import log
+from .api import SLACK_API_URL
+from .codec import get_codec
+from .event import decode_event
+from .manager import ConnectionManager
+
+# File descriptor that workers send events and stats to the supervisor on.
+EVENT_FD = 3
+
+# Largest frame that may be sent between processes.
+MAX_FRAME_LENGTH = 2**26
+
+
+def pack_frame(codec, obj):
+	"""
+	Encodes an object as a frame: JSON with a 32-bit big-endian length prefix.
+	"""
+	data = codec.dumps(obj)
+	return struct.pack('!I', len(data)) + data
+
+
+class FrameReceiver(Int32StringReceiver):
+	"""
+	Reads frames written by pack_frame(), and passes the decoded objects to
+	``handler``.
+	"""
+	MAX_LENGTH = MAX_FRAME_LENGTH
+
+	def __init__(self, codec, handler):
+		self.codec = codec
+		self.handler = handler
+
+	def stringReceived(self, frame):
+		try:
+			self.handler(self.codec.loads(frame))
+		except:
+			log.msg('Error handling frame from other process.')
+			log.err()
+
+	def lengthLimitExceeded(self, length):
+		log.msg('Frame of %d bytes is longer than MAX_FRAME_LENGTH.' % length)
+		if self.transport is not None:
+			self.transport.loseConnection()
+
+
+class WorkerProcess(ProcessProtocol):
+	"""
+	The supervisor's end of the connection to a worker process.
+	"""
+	def __init__(self, supervisor, index):
+		self.supervisor = supervisor
+		self.index = index
+
+		# Tokens handled by this worker, sent again if it is restarted.
+		self.tokens = []
+
+		# Connection stats for each team, as last reported by the worker.
+		self.stats = {}
+
+		self.last_heartbeat = None
+		self.restarts = 0
+		self.receiver = None
+
+		# When the worker was last started, and how many times in a row it has
+		# ended soon after starting.
+		self.started = None
+		self.failures = 0
+
+	def connectionMade(self):
+		self.last_heartbeat = reactor.seconds()
+		self.receiver = FrameReceiver(self.supervisor.codec, self._frameReceived)
+		for token in self.tokens:
+			self.sendCommand(add=token)
+
+	def sendCommand(self, **command):
+		if self.transport is not None:
+			self.transport.write(pack_frame(self.supervisor.codec, command))
+
+	def childDataReceived(self, fd, data):
+		if fd == EVENT_FD:
+			self.receiver.dataReceived(data)
+
+	def _frameReceived(self, frame):
+		if u'event' in frame:
+			event = decode_event(frame[u'event'], frame[u'received'], copy=False)
+			self.supervisor.onSlackEvent(frame[u'team'], event)
+		elif u'stats' in frame:
+			self.last_heartbeat = reactor.seconds()
+			self.stats = frame[u'stats']
+
+	def processEnded(self, reason):
+		self.transport = None
+		self.supervisor._workerEnded(self, reason)
+
+
+class Supervisor(object):
+	"""
+	Spreads RTM connections for many tokens over a pool of worker processes,
+	so that decoding and metadata updates can use more than one CPU core.
+
+	Each worker runs its own reactor and ConnectionManager.  Events are either
+	passed to ``sink`` in the worker, or sent back to this process and passed
+	to onSlackEvent()::
+
+		class MySupervisor(Supervisor):
+			def onSlackEvent(self, team_id, event):
+				...
+
+		supervisor = MySupervisor()
+		supervisor.add_all(tokens)
+		supervisor.start()
+		reactor.run()
+
+	``sink`` is the name of a function to import in each worker, in the form
+	``package.module:function``.  It is called as ``function(team_id, event)``.
+	This avoids sending events between processes at all.
+
+	``lean``, ``cache_dir`` and ``compact`` are passed on to each worker's
+	ConnectionManager.
+
+	Workers report their stats every ``heartbeat_interval`` seconds.  A worker
+	which exits, or doesn't report in for ``heartbeat_timeout`` seconds, is
+	restarted and given its tokens again.  It is restarted after
+	``restart_delay`` seconds, doubling each time it ends again within
+	``stable_time`` seconds of starting, up to ``max_restart_delay`` seconds.
+	This keeps a worker which can't start (eg: because of a revoked token)
+	from restarting in a tight loop.
+	"""
+	def __init__(self, workers=None, api_url=SLACK_API_URL, codec=None, max_concurrent=10, sink=None, heartbeat_interval=5., heartbeat_timeout=30., restart_delay=1., lean=False, cache_dir=None, compact=False, max_restart_delay=300., stable_time=60.):
+		if workers is None:
+			workers = os.cpu_count() or 1
+
+		self.api_url = api_url
+		self.codec = get_codec(codec)
+		self.max_concurrent = max_concurrent
+		self.sink = sink
+		self.heartbeat_interval = heartbeat_interval
+		self.heartbeat_timeout = heartbeat_timeout
+		self.restart_delay = restart_delay
+		self.max_restart_delay = max_restart_delay
+		self.stable_time = stable_time
+		self.lean = lean
+		self.cache_dir = cache_dir
+		self.compact = compact
+
+		self.workers = [WorkerProcess(self, i) for i in range(workers)]
+		self.running = False
+		self._monitor = task.LoopingCall(self._checkWorkers)
+
+	@property
+	def stats(self):
+		"""
+		Connection stats for each team, keyed by team ID, as last reported by the
+		workers.
+		"""
+		o = {}
+		for worker in self.workers:
+			o.update(worker.stats)
+		return o
+
+	def add(self, token):
+		"""
+		Assigns a token to the worker with the fewest tokens, and connects to it
+		if the supervisor has been started.
+		"""
+		worker = min(self.workers, key=lambda w: len(w.tokens))
+		worker.tokens.append(token)
+		worker.sendCommand(add=token)
+
+	def add_all(self, tokens):
+		for token in tokens:
+			self.add(token)
+
+	def start(self):
+		"""
+		Starts all of the worker processes.
+		"""
+		self.running = True
+		for worker in self.workers:
+			self._spawn(worker)
+		self._monitor.start(self.heartbeat_interval, now=False)
+
+	def stop(self):
+		"""
+		Stops all of the worker processes.
+		"""
+		self.running = False
+		if self._monitor.running:
+			self._monitor.stop()
+		for worker in self.workers:
+			if worker.transport is not None:
+				worker.transport.signalProcess('TERM')
+
+	def _spawn(self, worker):
+		args = [
+			sys.executable, '-m', 'slackrealtime.supervisor',
+			'--api-url', self.api_url,
+			'--codec', self.codec.name,
+			'--max-concurrent', str(self.max_concurrent),
+			'--heartbeat-interval', str(self.heartbeat_interval),
+		]
+		if self.sink is not None:
+			args += ['--sink', self.sink]
+		if self.lean:
+			args.append('--lean')
+		if self.cache_dir is not None:
+			args += ['--cache-dir', self.cache_dir]
+		if self.compact:
+			args.append('--compact')
+
+		# Make sure that the worker can import the same modules as we can.
+		env = dict(os.environ)
+		env['PYTHONPATH'] = os.pathsep.join(p for p in sys.path if p)
+
+		worker.started = reactor.seconds()
+		reactor.spawnProcess(worker, sys.executable, args, env=env,
+			childFDs={0: 'w', 1: 1, 2: 2, EVENT_FD: 'r'})
+
+	def _checkWorkers(self):
+		now = reactor.seconds()
+		for worker in self.workers:
+			if (worker.transport is not None and worker.last_heartbeat is not None and
+					now - worker.last_heartbeat > self.heartbeat_timeout):
+				log.msg('Worker %d has stopped responding, killing it.' % worker.index)
+				worker.last_heartbeat = None
+				worker.transport.signalProcess('KILL')
+
+	def _workerEnded(self, worker, reason):
+		worker.stats = {}
+		if not self.running:
+			return
+
+		if worker.started is not None and reactor.seconds() - worker.started >= self.stable_time:
+			worker.failures = 0
+		delay = min(self.restart_delay * 2 ** worker.failures, self.max_restart_delay)
+		worker.failures += 1
+
+		log.msg('Worker %d ended (%s), restarting in %g seconds.' % (worker.index, reason.value, delay))
+		worker.restarts += 1
+		reactor.callLater(delay, self._respawn, worker)
+
+	def _respawn(self, worker):
+		if self.running and worker.transport is None:
+			self._spawn(worker)
+
+	def onSlackEvent(self, team_id, event):
+		log.msg('Default Supervisor.onSlackEvent() handler called.')
+
+
+class WorkerManager(ConnectionManager):
+	"""
+	ConnectionManager running in a worker process, which passes events on to
+	either a sink function or the supervisor.
+	"""
+	def __init__(self, channel, sink=None, **kwargs):
+		super(WorkerManager, self).__init__(**kwargs)
+		self.channel = channel
+		self.sink = sink
+
+	def onSlackEvent(self, team_id, event):
+		if self.sink is not None:
+			self.sink(team_id, event)
+		else:
+			self.channel.transport.write(pack_frame(self.codec, {
+				u'team': team_id,
+				u'received': event._received,
+				u'event': event._b,
+			}))
+
+
+class WorkerChannel(FrameReceiver):
+	"""
+	A worker's end of the connection to the supervisor, which stops the worker
+	if the supervisor goes away.
+	"""
+	def connectionLost(self, reason):
+		if reactor.running:
+			reactor.stop()
+
+
+def _load_sink(name):
+	module, function = name.split(':', 1)
+	return getattr(import_module(module), function)
+
+
+def main():
+	"""
+	Entry point for worker processes started by Supervisor.
+	"""
+	parser = ArgumentParser()
+	parser.add_argument('--api-url', default=SLACK_API_URL)
+	parser.add_argument('--codec', default=None)
+	parser.add_argument('--max-concurrent', type=int, default=10)
+	parser.add_argument('--heartbeat-interval', type=float, default=5.)
+	parser.add_argument('--sink', default=None)
+	parser.add_argument('--lean', action='store_true')
+	parser.add_argument('--cache-dir', default=None)
+	parser.add_argument('--compact', action='store_true')
+	options = parser.parse_args()
+
+	log.startLogging(sys.stderr)
+	codec = get_codec(options.codec)
+	sink = None if options.sink is None else _load_sink(options.sink)
+
+	def command(frame):
+		if u'add' in frame:
+			manager.add(frame[u'add'])
+
+	channel = WorkerChannel(codec, command)
+	manager = WorkerManager(channel, sink, api_url=options.api_url,
+		codec=codec, max_concurrent=options.max_concurrent, lean=options.lean,
+		cache_dir=options.cache_dir, compact=options.compact)
+
+	stdio.StandardIO(channel, stdin=0, stdout=EVENT_FD)
+
+	heartbeat = task.LoopingCall(lambda: channel.transport.write(
+		pack_frame(codec, {u'stats': manager.stats})))
+	heartbeat.start(options.heartbeat_interval)
+	reactor.run()
+
+
+if __name__ == '__main__':
+	main()
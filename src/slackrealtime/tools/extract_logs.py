@@ -17,17 +17,285 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from __future__ import absolute_import
-from argparse import ArgumentParser, FileType
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 from isodate import parse_datetime
 import json
+import os
 import re
 from pytz import utc
-from ..api import SlackApi
+from shutil import copyfileobj
+from threading import Lock
+from time import monotonic, sleep
+from ..api import SlackApi, totimestamp
+from ..codec import get_codec
+from ..sendqueue import TokenBucket
 
 
 USERNAME_RE = re.compile(r'\<@(U[A-Z0-9]+)\>')
 
 
+class RateLimiter(object):
+	"""
+	Limits calls shared between threads to ``rate`` per minute.
+	"""
+	def __init__(self, rate, burst=1):
+		self.lock = Lock()
+		self.bucket = TokenBucket(rate / 60., burst, monotonic())
+
+	def wait(self):
+		"""
+		Blocks until another call is allowed.
+		"""
+		while True:
+			with self.lock:
+				now = monotonic()
+				delay = self.bucket.delay(now)
+				if not delay:
+					self.bucket.take(now)
+					return
+			sleep(delay)
+
+
+def get_username_map(api, token):
+	"""
+	Maps the ID of every user on the team to their name.
+	"""
+	username_map = {}
+	cursor = None
+	while True:
+		users = api.users.list(token=token, cursor=cursor)
+		for user in users['members']:
+			username_map[user['id']] = user['name']
+
+		cursor = users.get('response_metadata', {}).get('next_cursor')
+		if not cursor:
+			return username_map
+
+
+def find_channel(api, token, family, name, username_map):
+	"""
+	Finds the ID of a channel, private group or DM.
+
+	``name`` may be a channel ID, a channel name, or ``@username`` for a DM.
+	"""
+	if re.match(r'^[CGD][A-Z0-9]+$', name):
+		return name
+
+	if family == 'groups':
+		channels = api.groups.list(token=token)
+		for channel in channels['groups']:
+			if channel['name'] == name:
+				return channel['id']
+		return None
+
+	user = None
+	if name.startswith('@'):
+		for uid, username in username_map.items():
+			if username == name[1:]:
+				user = uid
+				break
+		else:
+			return None
+
+	cursor = None
+	while True:
+		channels = api.conversations.list(token=token, cursor=cursor,
+			types='public_channel,private_channel,mpim,im')
+		for channel in channels['channels']:
+			if user is not None and channel.get('user') == user:
+				return channel['id']
+			if user is None and channel.get('name') == name:
+				return channel['id']
+
+		cursor = channels.get('response_metadata', {}).get('next_cursor')
+		if not cursor:
+			return None
+
+
+def clean_message(msg, username_map):
+	"""
+	Adds the names of users referenced by a message.
+	"""
+	if 'user' in msg:
+		msg['user_name'] = username_map.get(msg['user'], msg['user'])
+	if 'reactions' in msg:
+		for reaction in msg['reactions']:
+			reaction['users_name'] = [username_map.get(x, x) for x in reaction['users']]
+	if msg['type'] == 'message' and '<@' in msg.get('text', ''):
+		# Translate user IDs
+		msg['text'] = USERNAME_RE.sub(lambda m: ('<@%s|%s>' % (m.group(1), username_map.get(m.group(1), m.group(1)))), msg['text'])
+	return msg
+
+
+def load_checkpoint(path, output, family, channel_id, oldest, latest):
+	"""
+	Reads a checkpoint left by an earlier run for the same export: the same
+	API, channel and time range.
+
+	Returns None if there isn't one, or if ``output`` no longer holds
+	everything the checkpoint says was written to it.
+	"""
+	try:
+		with open(path, 'r') as f:
+			checkpoint = json.load(f)
+	except (IOError, ValueError):
+		return None
+
+	if (checkpoint.get('api') != family or checkpoint.get('channel') != channel_id or
+			checkpoint.get('oldest') != oldest or checkpoint.get('end') != latest):
+		return None
+
+	try:
+		if os.path.getsize(output) < checkpoint['offset']:
+			return None
+	except OSError:
+		return None
+	return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+	"""
+	Replaces the checkpoint file atomically.
+	"""
+	tmp = path + '.tmp'
+	with open(tmp, 'w') as f:
+		json.dump(checkpoint, f)
+		f.flush()
+		os.fsync(f.fileno())
+	os.replace(tmp, path)
+
+
+def extract_logs(api, token, family, channel_id, oldest, latest, output, checkpoint_path, chunk_size=1000, username_map=None, limiter=None):
+	"""
+	Writes the history of a channel between ``oldest`` and ``latest`` (UNIX
+	timestamps) to ``output`` as JSON Lines, newest first.
+
+	Each page is written out as it arrives, and then ``checkpoint_path`` is
+	updated, so that an interrupted export picks up where it left off.
+
+	If ``limiter`` is set, its wait() method is called before each request.
+
+	Returns the number of messages written.
+	"""
+	if username_map is None:
+		username_map = get_username_map(api, token)
+
+	history = getattr(api, family).history
+	count_param = 'count' if family == 'groups' else 'limit'
+
+	checkpoint = load_checkpoint(checkpoint_path, output, family, channel_id, oldest, latest)
+	if checkpoint is None:
+		# ``latest`` moves back as pages are written; ``end`` stays put.
+		checkpoint = dict(api=family, channel=channel_id, oldest=oldest, end=latest, latest=latest, offset=0, count=0)
+	elif checkpoint.get('done'):
+		return checkpoint['count']
+
+	with open(output, 'ab') as f:
+		# Throw away anything written after the last checkpoint.
+		f.truncate(checkpoint['offset'])
+		f.seek(checkpoint['offset'])
+
+		while True:
+			params = {'token': token, 'channel': channel_id, 'latest': checkpoint['latest'], 'oldest': oldest, count_param: chunk_size}
+			if limiter is not None:
+				limiter.wait()
+			chunk = history(**params)
+
+			for msg in chunk['messages']:
+				if float(msg['ts']) < checkpoint['latest']:
+					checkpoint['latest'] = float(msg['ts'])
+				f.write(api.codec.dumps(clean_message(msg, username_map)) + b'\n')
+
+			checkpoint['count'] += len(chunk['messages'])
+			checkpoint['done'] = not chunk['has_more'] or not chunk['messages']
+
+			f.flush()
+			os.fsync(f.fileno())
+			checkpoint['offset'] = f.tell()
+			save_checkpoint(checkpoint_path, checkpoint)
+
+			if checkpoint['done']:
+				return checkpoint['count']
+
+			# ...and continue!
+
+
+def join_parts(parts, output, jsonl=False):
+	"""
+	Joins JSON Lines files written by extract_logs() into ``output``, either as
+	JSON Lines, or (by default) as a JSON array.
+	"""
+	with open(output, 'wb') as f:
+		if jsonl:
+			for part in parts:
+				with open(part, 'rb') as p:
+					copyfileobj(p, f)
+			return
+
+		f.write(b'[')
+		first = True
+		for part in parts:
+			with open(part, 'rb') as p:
+				for line in p:
+					if not first:
+						f.write(b', ')
+					f.write(line.rstrip(b'\n'))
+					first = False
+		f.write(b']')
+
+
+def extract_logs_array(api, token, family, channel_id, oldest, latest, output, checkpoint_path, chunk_size=1000, username_map=None, limiter=None):
+	"""
+	Writes the history of a channel to ``output`` as a JSON array, as
+	extract_logs() does for JSON Lines.
+
+	The messages are written to a part file next to ``output`` first, so that
+	an interrupted export can still be resumed, and only joined into
+	``output`` once they have all been fetched.
+	"""
+	part = output + '.part'
+	count = extract_logs(api, token, family, channel_id, oldest, latest, part,
+		checkpoint_path, chunk_size, username_map, limiter)
+	join_parts([part], output)
+	os.unlink(part)
+	os.unlink(checkpoint_path)
+	return count
+
+
+def extract_logs_sliced(api, token, family, channel_id, oldest, latest, output, slices, executor, chunk_size=1000, username_map=None, limiter=None, jsonl=False):
+	"""
+	Splits the time between ``oldest`` and ``latest`` into ``slices``, and
+	submits an extract_logs() job for each one to ``executor``.  Each slice is
+	written to its own part file next to ``output``, with its own checkpoint.
+
+	Returns a function which waits for the slices, then joins them into
+	``output`` (newest first, as a JSON array, or JSON Lines if ``jsonl`` is
+	set) and returns the number of messages written.
+	"""
+	step = (latest - oldest) / slices
+	parts = []
+	for i in range(slices):
+		# Newest slice first, so the parts can simply be joined together.
+		# Neighbouring slices share a boundary, which Slack leaves out of both,
+		# so the lower one ends a microsecond (the precision of a ts) above it.
+		part_latest = latest if i == 0 else round(latest - step * i, 6) + 1e-6
+		part_oldest = oldest if i == slices - 1 else round(latest - step * (i + 1), 6)
+		part = '%s.part%03d' % (output, i)
+		parts.append((part, executor.submit(extract_logs, api, token, family, channel_id,
+			part_oldest, part_latest, part, part + '.checkpoint', chunk_size, username_map, limiter)))
+
+	def join():
+		count = sum(future.result() for part, future in parts)
+		join_parts([part for part, future in parts], output, jsonl)
+		for part, future in parts:
+			os.unlink(part)
+			os.unlink(part + '.checkpoint')
+		return count
+
+	return join
+
+
 def main():
 	parser = ArgumentParser()
 
@@ -38,8 +306,13 @@ def main():
 
 	parser.add_argument(
 		'-c', '--channel',
-		required=True,
-		help='Group to take logs from')
+		required=True, action='append',
+		help='Channel to take logs from: a name, an ID, or @username for a DM.  May be given more than once.')
+
+	parser.add_argument(
+		'-a', '--api',
+		choices=['conversations', 'groups'], default='groups',
+		help='API to take logs from: groups.history for private groups, or conversations.history for any channel [default: %(default)s]')
 
 	parser.add_argument(
 		'-s', '--start',
@@ -58,63 +331,81 @@ def main():
 		
 	parser.add_argument(
 		'-o', '--output',
-		type=FileType('wb'),
 		required=True,
-		help='Where to write the JSON file to')
+		help='Where to write the JSON file to.  With more than one channel, {channel} is replaced by the channel name.')
+
+	parser.add_argument(
+		'--jsonl',
+		action='store_true',
+		help='Write JSON Lines (one message per line) rather than a JSON array')
+
+	parser.add_argument(
+		'-S', '--slices',
+		type=int, default=1,
+		help='Number of time slices to split each channel\'s history into, to fetch them in parallel [default: %(default)s]')
+
+	parser.add_argument(
+		'-j', '--jobs',
+		type=int, default=4,
+		help='Number of slices to fetch at once [default: %(default)s]')
+
+	parser.add_argument(
+		'-r', '--rate',
+		type=float, default=50.,
+		help='Maximum history requests per minute, shared by all jobs [default: %(default)s, Slack\'s tier 3 limit]')
+
+	parser.add_argument(
+		'-k', '--checkpoint',
+		help='Where to keep track of progress, so an interrupted export can be resumed [default: OUTPUT.checkpoint].  Only used without --slices.')
+
+	parser.add_argument(
+		'--codec',
+		help='JSON library to use [default: fastest available]')
 
 	options = parser.parse_args()
 
-	api = SlackApi()
-	
-	users = api.users.list(token=options.token)
-	username_map = {}
-	for user in users['members']:
-		username_map[user['id']] = user['name']
-	
-	channels = api.groups.list(token=options.token)
-	channel_id = None
-	for channel in channels['groups']:
-		if channel['name'] == options.channel:
-			channel_id = channel['id']
-			break
-	
-	if channel_id is None:
-		raise Exception('channel not found')
-	
-	start_time = utc.localize(parse_datetime(options.start))
-	end_time = utc.localize(parse_datetime(options.end))
+	if len(options.channel) > 1 and '{channel}' not in options.output:
+		parser.error('--output must contain {channel} when exporting more than one channel')
+
+	api = SlackApi(codec=get_codec(options.codec), pool_size=options.jobs)
+	limiter = RateLimiter(options.rate)
+
+	# Shared by every channel.
+	username_map = get_username_map(api, options.token)
+
+	channels = []
+	for name in options.channel:
+		channel_id = find_channel(api, options.token, options.api, name, username_map)
+		if channel_id is None:
+			raise Exception('channel not found: %s' % name)
+		channels.append((name, channel_id, options.output.replace('{channel}', name.lstrip('@'))))
 	
-	history = []
-	latest = end_time
-	while True:
-		chunk = api.groups.history(token=options.token, channel=channel_id, latest=latest, oldest=start_time, count=options.chunk_size)
-				
-		latest = float(chunk['latest'])
-		for msg in chunk['messages']:
-			ts = float(msg['ts'])
-			if ts < latest:
-				latest = ts
-
-			# Clean up usernames
-			if 'user' in msg:
-				msg['user_name'] = username_map[msg['user']]
-			if 'reactions' in msg:
-				for reaction in msg['reactions']:
-					reaction['users_name'] = [username_map[x] for x in reaction['users']]
-			if msg['type'] == 'message' and '<@' in msg['text']:
-				# Translate user IDs
-				msg['text'] = USERNAME_RE.sub(lambda m: ('<@%s|%s>' % (m.group(1), username_map[m.group(1)])), msg['text'])
-
-		history += chunk['messages']
-
-		if not chunk['has_more']:
-			break
-
-		# ...and continue!
-
-	json.dump(history, options.output)
-	print('done grabbing, got %d messages' % len(history))
+	start_time = totimestamp(utc.localize(parse_datetime(options.start)))
+	end_time = totimestamp(utc.localize(parse_datetime(options.end)))
+
+	if options.slices == 1 and len(channels) == 1:
+		name, channel_id, output = channels[0]
+		checkpoint_path = options.checkpoint or output + '.checkpoint'
+		if options.jsonl:
+			count = extract_logs(api, options.token, options.api, channel_id,
+				start_time, end_time, output, checkpoint_path,
+				options.chunk_size, username_map, limiter)
+			# Finished, so there's nothing left to resume.
+			os.unlink(checkpoint_path)
+		else:
+			count = extract_logs_array(api, options.token, options.api, channel_id,
+				start_time, end_time, output, checkpoint_path,
+				options.chunk_size, username_map, limiter)
+		print('done grabbing, got %d messages' % count)
+		return
+
+	with ThreadPoolExecutor(options.jobs) as executor:
+		joins = [(name, extract_logs_sliced(api, options.token, options.api, channel_id,
+			start_time, end_time, output, options.slices, executor,
+			options.chunk_size, username_map, limiter, options.jsonl)) for name, channel_id, output in channels]
+
+		for name, join in joins:
+			print('done grabbing %s, got %d messages' % (name, join()))
 
 if __name__ == '__main__':
 	main()
-
@@ -18,35 +18,179 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import absolute_import
 from argparse import ArgumentParser, FileType
-from datetime import datetime
+import codecs
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time, timedelta
+import heapq
+import io
+from itertools import chain, islice
 import json
-import re
+import os
 from pytz import timezone, utc
+from tempfile import TemporaryFile
+from ..codec import get_codec
+from ..mrkdwn import to_markdown
 
-
-USERNAME_RE = re.compile(r'\<@(U[A-Z0-9]+)\|([a-zA-Z0-9]+)\>')
-BOLD_RE = re.compile(r'(\s)\*([^*\n]+?)\*')
-ITALIC_RE = re.compile(r'(\s)_([^_\n]+?)_') 
-PRETTY_HYPERLINK_RE = re.compile(r'\<(http[^>|\n]+?)(\|([^>\n]+?))?\>')
+EPOCH = utc.localize(datetime(1970, 1, 1))
 
 
 def slack_to_markdown(i):
-	# Transform bold to real bold
-	o = BOLD_RE.sub(lambda m: ('%s**%s**' % (m.group(1), m.group(2))), i)
-	o = ITALIC_RE.sub(lambda m: ('%s*%s*' % (m.group(1), m.group(2))), o)
-	o = USERNAME_RE.sub(lambda m: ('**@%s**' % (m.group(2),)), o)
-	o = PRETTY_HYPERLINK_RE.sub(lambda m: ' %s ' % (('[%s](%s)' % (m.group(3), m.group(1))) if m.group(2) else m.group(1)), o)
-	
-	return o
-
-
-def format_logs(input_files, output_file, tz='UTC'):
-	tz = timezone(tz)
-	start_time = utc.localize(datetime.utcnow()).astimezone(tz)
-
+	return to_markdown(i)
+
+
+def iter_json_lines(f, codec):
+	"""
+	Reads messages from a JSON Lines file, one at a time.
+	"""
+	for line in f:
+		if line.strip():
+			yield codec.loads(line)
+
+
+def iter_json_lines_reversed(f, codec, block_size=65536):
+	"""
+	Reads messages from a JSON Lines file, one at a time, starting from the
+	end of the file.
+	"""
+	f.seek(0, 2)
+	pos = f.tell()
+	tail = b''
+	while pos > 0:
+		n = min(block_size, pos)
+		pos -= n
+		f.seek(pos)
+		lines = (f.read(n) + tail).split(b'\n')
+		# The first line may continue in the previous block.
+		tail = lines.pop(0)
+		for line in reversed(lines):
+			if line.strip():
+				yield codec.loads(line)
+
+	if tail.strip():
+		yield codec.loads(tail)
+
+
+def iter_json_array(f, block_size=65536):
+	"""
+	Reads messages from a file containing a JSON array, one at a time, without
+	reading the whole array into memory.
+	"""
+	decoder = json.JSONDecoder()
+	text_decoder = codecs.getincrementaldecoder('utf-8')()
+	buf = ''
+	pos = 0
+	eof = False
+	started = False
+
+	while True:
+		# Skip to the start of the next element.
+		while pos < len(buf) and buf[pos] in ' \t\r\n,[':
+			if buf[pos] == '[':
+				if started:
+					break
+				started = True
+			pos += 1
+
+		if pos < len(buf) and buf[pos] == ']':
+			return
+
+		if pos < len(buf):
+			try:
+				element, end = decoder.raw_decode(buf, pos)
+			except ValueError:
+				# Probably cut off at the end of the buffer.
+				if eof:
+					raise
+			else:
+				yield element
+				pos = end
+				continue
+		elif eof:
+			return
+
+		block = f.read(block_size)
+		eof = not block
+		buf = buf[pos:] + text_decoder.decode(block, eof)
+		pos = 0
+
+
+def peekable(f):
+	"""
+	Wraps a binary file in a buffered reader, unless it already is one, so
+	that is_json_array can look ahead in pipes and stdin.
+	"""
+	if hasattr(f, 'peek'):
+		return f
+	return io.BufferedReader(f)
+
+
+def is_json_array(f):
+	"""
+	Checks whether a file contains a JSON array, rather than JSON Lines.
+
+	``f`` must be returned by peekable().  Leading whitespace is consumed, but
+	nothing else.
+	"""
+	while True:
+		start = f.peek(1)[:1]
+		if not start.isspace():
+			return start == b'['
+		f.read(1)
+
+
+def iter_messages(f, codec):
+	"""
+	Reads messages from an export in chronological order, one at a time.
+
+	The file may be JSON Lines (as written by extract_logs) or a JSON array,
+	and may be sorted oldest or newest first.  Newest first JSON Lines files
+	are read backwards; other newest first files (including pipes) are first
+	copied to a temporary JSON Lines file.
+	"""
+	f = peekable(f)
+	array = is_json_array(f)
+	if array:
+		messages = iter_json_array(f)
+	else:
+		messages = iter_json_lines(f, codec)
+
+	# Work out which way the file is sorted from its first few messages.
+	head = list(islice(messages, 2))
+	while len(head) > 1 and float(head[0]['ts']) == float(head[-1]['ts']):
+		more = list(islice(messages, 1))
+		if not more:
+			break
+		head += more
+
+	if len(head) < 2 or float(head[0]['ts']) <= float(head[-1]['ts']):
+		messages = chain(head, messages)
+	elif array or not f.seekable():
+		tmp = TemporaryFile()
+		for m in chain(head, messages):
+			tmp.write(codec.dumps(m) + b'\n')
+		messages = iter_json_lines_reversed(tmp, codec)
+	else:
+		messages = iter_json_lines_reversed(f, codec)
+
+	for m in messages:
+		# Do this first, because we want a float later.
+		m['ts'] = float(m['ts'])
+		yield m
+
+
+def read_logs(input_files, codec=None):
+	"""
+	Reads all messages from the input files into memory, and sorts them.
+	"""
+	codec = get_codec(codec)
 	logs = []
 	for input_file in input_files:
-		logs += json.load(input_file)
+		input_file = peekable(input_file)
+		if is_json_array(input_file):
+			logs += json.load(input_file)
+		else:
+			logs += iter_json_lines(input_file, codec)
 		input_file.close()
 
 	# Do this first, because we want a float later.
@@ -55,6 +199,155 @@ def format_logs(input_files, output_file, tz='UTC'):
 
 	# Sort the logs chronologically
 	logs.sort(key=lambda x: x['ts'])
+	return logs
+
+
+def merge_logs(input_files, codec=None):
+	"""
+	Merges the messages from many exports in chronological order, reading
+	one message at a time from each.
+	"""
+	codec = get_codec(codec)
+	return heapq.merge(*[iter_messages(f, codec) for f in input_files], key=lambda x: x['ts'])
+
+
+def day_chunks(logs, tz):
+	"""
+	Splits messages, which must be in order, into the days they were sent on
+	in ``tz``.
+
+	Yields (date, messages) for each day.  Messages are reduced to tuples of
+	(ts, type, user_name, text), which is all that render_day() needs.
+	"""
+	day = None
+	end = None
+	chunk = []
+	for m in logs:
+		ts = m['ts']
+		if end is None or ts >= end:
+			d = datetime.fromtimestamp(ts, tz).date()
+			if d != day:
+				if chunk:
+					yield day, chunk
+				day = d
+				chunk = []
+			end = day_end(day, tz)
+		# Bot messages have no user_name, and messages with only attachments or
+		# files have no text.
+		username = m.get('user_name') or m.get('username') or m.get('bot_id')
+		chunk.append((ts, m['type'], username, m.get('text') or ''))
+
+	if chunk:
+		yield day, chunk
+
+
+def day_end(day, tz):
+	"""
+	Returns the UNIX time that ``day`` ends at in ``tz``.
+
+	Where midnight is ambiguous or skipped by a DST change, this errs early,
+	so that day_chunks() checks the date again rather than running over.
+	"""
+	midnight = datetime.combine(day + timedelta(days=1), time())
+	return min(
+		(tz.localize(midnight, is_dst=is_dst) - EPOCH).total_seconds()
+		for is_dst in (False, True))
+
+
+def render_day(day, messages, tz):
+	"""
+	Renders one day of messages from day_chunks() as Markdown.
+	"""
+	tz = timezone(tz)
+	out = ['### %s\n\n' % day.isoformat()]
+	for ts, kind, username, text in messages:
+		if kind == 'message':
+			out.append('**%(ts)s**: **@%(username)s**: %(text)s\n\n' % dict(
+				ts=datetime.fromtimestamp(ts, tz).time().replace(microsecond=0).isoformat(),
+				username=username,
+				text=slack_to_markdown(text)))
+
+			# TODO: handle reactions
+		else:
+			print('Unhandled type %s' % kind)
+
+	return ''.join(out)
+
+
+def render_days(days, tz):
+	return [render_day(day, messages, tz) for day, messages in days]
+
+
+def render_chunks(chunks, tz, jobs=1, batch_size=5000):
+	"""
+	Renders the days from day_chunks(), yielding (date, markdown) in order.
+
+	If ``jobs`` is more than 1, days are rendered in that many processes.
+	Consecutive days are sent to them in batches of about ``batch_size``
+	messages, and only a few batches are held in memory at once.
+	"""
+	if jobs <= 1:
+		for day, messages in chunks:
+			yield day, render_day(day, messages, tz)
+		return
+
+	def batches():
+		batch = []
+		size = 0
+		for chunk in chunks:
+			batch.append(chunk)
+			size += len(chunk[1])
+			if size >= batch_size:
+				yield batch
+				batch = []
+				size = 0
+		if batch:
+			yield batch
+
+	pending = deque()
+	with ProcessPoolExecutor(jobs) as pool:
+		for batch in batches():
+			pending.append(([day for day, messages in batch], pool.submit(render_days, batch, tz)))
+			del batch
+			if len(pending) > jobs * 2:
+				days, future = pending.popleft()
+				for day_md in zip(days, future.result()):
+					yield day_md
+
+		while pending:
+			days, future = pending.popleft()
+			for day_md in zip(days, future.result()):
+				yield day_md
+
+
+def _read_days(input_files, tz, stream, since):
+	if stream:
+		logs = merge_logs(input_files)
+	else:
+		logs = read_logs(input_files)
+
+	chunks = day_chunks(logs, tz)
+	if since is not None:
+		chunks = ((day, messages) for day, messages in chunks if day >= since)
+	return chunks
+
+
+def format_logs(input_files, output_file, tz='UTC', stream=False, jobs=1, since=None):
+	"""
+	Writes the messages in ``input_files`` to ``output_file`` as Markdown.
+
+	By default, every message is read into memory and sorted.  If ``stream``
+	is set, each input file must already be in order (either way), and they
+	are merged as they are read, so only one message from each is held in
+	memory at a time.
+
+	If ``jobs`` is more than 1, days are rendered in that many processes.
+	Days before the date ``since`` are left out.
+	"""
+	tz = timezone(tz)
+	start_time = utc.localize(datetime.utcnow()).astimezone(tz)
+
+	chunks = _read_days(input_files, tz, stream, since)
 
 	# Now start converting bits.
 	output_file.write('''# slackrealtime format_logs
@@ -75,45 +368,86 @@ All times shown are `%(tz)s`.
 		input_files='\n* '.join([f.name for f in input_files]),
 		tz=tz.zone))
 
-	last_day = None
-
 	# Now write out all the messages.
-	for m in logs:
-		ts = utc.localize(datetime.utcfromtimestamp(m['ts'])).astimezone(tz)
-
-		# Write out the date header if it differs
-		if ts.date() != last_day:
-			last_day = ts.date()
-			output_file.write('### %s\n\n' % last_day.isoformat())
-		
-		if m['type'] == 'message':
-			output_file.write('**%(ts)s**: **@%(username)s**: %(text)s\n\n' % dict(
-				ts=ts.time().replace(microsecond=0).isoformat(),
-				username=m['user_name'],
-				text=slack_to_markdown(m['text'])))
-				
-			# TODO: handle reactions
-		else:
-			print('Unhandled type %s' % m['type'])
-			
+	for day, md in render_chunks(chunks, tz.zone, jobs):
+		output_file.write(md)
+
 	output_file.flush()
 	output_file.close()
+	for input_file in input_files:
+		input_file.close()
+
+
+def format_logs_by_day(input_files, output_dir, tz='UTC', stream=False, jobs=1, since=None):
+	"""
+	Writes the messages in ``input_files`` to a Markdown file for each day in
+	``output_dir``, named like ``2016-01-31.md``.
+
+	Files are only written if their contents change, so a large archive can
+	be brought up to date by rendering only the days ``since`` a date.
+
+	Returns the number of files written.
+	"""
+	tz = timezone(tz)
+	chunks = _read_days(input_files, tz, stream, since)
+
+	if not os.path.isdir(output_dir):
+		os.makedirs(output_dir)
+
+	written = 0
+	for day, md in render_chunks(chunks, tz.zone, jobs):
+		path = os.path.join(output_dir, day.isoformat() + '.md')
+		try:
+			with io.open(path, encoding='utf-8') as f:
+				if f.read() == md:
+					continue
+		except IOError:
+			pass
+
+		with io.open(path, 'w', encoding='utf-8') as f:
+			f.write(md)
+		written += 1
+
+	for input_file in input_files:
+		input_file.close()
+	return written
+
+
+def parse_date(s):
+	return datetime.strptime(s, '%Y-%m-%d').date()
 
 
 def main():
 	parser = ArgumentParser()
 	
 	parser.add_argument('input_files', nargs='+',
-		type=FileType('rb'), help='Input JSON files to mark down')
+		type=FileType('rb'), help='Input JSON or JSON Lines files to mark down')
+
+	output = parser.add_mutually_exclusive_group(required=True)
+	output.add_argument('-o', '--output',
+		type=FileType('w', encoding='utf-8'), help='Output Markdown file')
 
-	parser.add_argument('-o', '--output', required=True,
-		type=FileType('wb'), help='Output Markdown file')
+	output.add_argument('-d', '--per-day', metavar='DIR',
+		help='Write a Markdown file for each day to DIR.  Only files whose contents change are written.')
 
 	parser.add_argument('-t', '--tz', default='UTC',
 		help='Timezone to display times in [default: %(default)s]')
 
+	parser.add_argument('-s', '--stream', action='store_true',
+		help='Merge the input files as they are read, rather than reading them all into memory.  Each file must already be sorted by time.')
+
+	parser.add_argument('-j', '--jobs', type=int, default=1,
+		help='Number of processes to render days in [default: %(default)s]')
+
+	parser.add_argument('--since', type=parse_date, metavar='YYYY-MM-DD',
+		help='Only render messages from this day onwards (in --tz)')
+
 	options = parser.parse_args()
-	format_logs(options.input_files, options.output, options.tz)
+	if options.per_day:
+		written = format_logs_by_day(options.input_files, options.per_day, options.tz, options.stream, options.jobs, options.since)
+		print('Wrote %d file(s).' % written)
+	else:
+		format_logs(options.input_files, options.output, options.tz, options.stream, options.jobs, options.since)
 
 
 if __name__ == '__main__':
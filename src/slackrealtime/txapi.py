@@ -0,0 +1,118 @@
+"""
+slackrealtime/txapi.py - Non-blocking implementation of the Slack API for Twisted.
+Copyright 2020 Michael Farrell <http://micolous.id.au>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from __future__ import absolute_import
+from io import BytesIO
+from twisted.internet import reactor, task
+from twisted.internet.defer import succeed
+from twisted.web.client import Agent, FileBodyProducer, HTTPConnectionPool, readBody
+from twisted.web.http_headers import Headers
+from urllib.parse import urlencode, urljoin
+from .api import SLACK_API_URL, SlackApi, SlackMethod, SlackMethodGroup, SlackRateLimited
+from .codec import get_codec
+
+
+class TxSlackMethod(SlackMethod):
+	"""
+	A Slack API method which is called without blocking the reactor.  Calls
+	return a Deferred which fires with the response, or fails with a
+	``SlackError``.
+	"""
+	def __call__(self, **kwargs):
+		body = urlencode(self._encode_params(kwargs)).encode('ascii')
+		return self._request(body, 0)
+
+	def _request(self, body, retries):
+		d = self.session.request(
+			b'POST',
+			urljoin(self.url, self.method).encode('utf-8'),
+			Headers({b'Content-Type': [b'application/x-www-form-urlencoded']}),
+			FileBodyProducer(BytesIO(body)))
+
+		if self.timeout is not None:
+			d.addTimeout(self.timeout, reactor)
+
+		d.addCallback(self._readResponse)
+		d.addErrback(self._retry, body, retries)
+		return d
+
+	def _readResponse(self, response):
+		retry_after = response.headers.getRawHeaders(b'Retry-After', [None])[0]
+		d = readBody(response)
+		d.addCallback(self._decode_response, retry_after)
+		return d
+
+	def _retry(self, failure, body, retries):
+		failure.trap(SlackRateLimited)
+		if retries >= self.max_retries:
+			return failure
+		return task.deferLater(reactor, failure.value.retry_after, self._request, body, retries + 1)
+
+	def __str__(self):
+		return '<TxSlackMethod: %s at %s>' % (self.method, self.url)
+
+
+class TxSlackMethodGroup(SlackMethodGroup):
+	method_class = TxSlackMethod
+
+	def __str__(self):
+		return '<TxSlackMethodGroup: %s at %s>' % (self.group, self.url)
+
+
+class TxSlackApi(SlackApi):
+	"""
+	TxSlackApi is a version of ``SlackApi`` which uses Twisted's HTTP client, so
+	that it can be used from the reactor thread without blocking it::
+
+		slack = TxSlackApi()
+		d = slack.chat.postMessage(token=token, channel=channel, text=text)
+		d.addCallback(on_posted)
+
+	Every method call returns a Deferred.  Connections to the API server are
+	kept alive in a pool of up to ``pool_size`` connections per host, which may
+	be shared with other clients by passing in an existing ``agent``.
+
+	``SlackApi`` remains available for scripts which don't run a reactor.
+	"""
+	group_class = TxSlackMethodGroup
+
+	def __init__(self, url=SLACK_API_URL, codec=None, agent=None, pool_size=10, timeout=None):
+		if not url.endswith('/'):
+			url += '/'
+		self.url = url
+		self.codec = get_codec(codec)
+		self.timeout = timeout
+
+		if agent is None:
+			self.pool = HTTPConnectionPool(reactor, persistent=True)
+			self.pool.maxPersistentPerHost = pool_size
+			agent = Agent(reactor, pool=self.pool)
+		else:
+			# Someone else owns the pool.
+			self.pool = None
+		self.session = agent
+
+	def close(self):
+		"""
+		Closes any connections held open to the API server.
+
+		Returns a Deferred which fires once they are closed.
+		"""
+		if self.pool is None:
+			return succeed(None)
+		return self.pool.closeCachedConnections()
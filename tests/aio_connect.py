@@ -0,0 +1,115 @@
+"""
+End-to-end test of slackrealtime.aio.connect(), run by test_aio.py in its own
+process.
+"""
+
+import asyncio
+from aiohttp import web
+from autobahn.asyncio.websocket import WebSocketServerFactory, WebSocketServerProtocol
+from slackrealtime import aio
+from test_aio import serve
+
+received = []
+
+
+class Server(WebSocketServerProtocol):
+	def onOpen(self):
+		self.sendMessage(b'{"type": "hello"}')
+		self.sendMessage(b'{"type": "channel_rename", "channel": {"id": "C1", "name": "renamed"}}')
+		self.sendMessage(b'{"type": "message", "channel": "C1", "user": "U1", "text": "hi", "ts": "1.0"}')
+
+	def onMessage(self, payload, binary):
+		received.append(payload)
+
+
+class Client(aio.AioRtmProtocol):
+	def onSlackEvent(self, event):
+		if event._b.get(u'type') == u'message':
+			self.replied = self.sendChatMessage(u'reply', user=u'bob', ack=False)
+
+
+async def main():
+	loop = asyncio.get_running_loop()
+	factory = WebSocketServerFactory()
+	factory.protocol = Server
+	server = await loop.create_server(factory, '127.0.0.1', 0)
+	ws_url = 'ws://127.0.0.1:%d/' % server.sockets[0].getsockname()[1]
+
+	async def handler(request):
+		method = request.match_info['method']
+		if method == 'rtm.start':
+			return web.json_response({'ok': True, 'url': ws_url, 'self': {'id': 'U0'}, 'team': {'id': 'T1'},
+				'users': [{'id': 'U1', 'name': 'bob'}], 'channels': [{'id': 'C1', 'name': 'general'}],
+				'groups': [], 'ims': [], 'bots': []})
+		return web.json_response({'ok': True, 'channel': {'id': 'D1'}})
+
+	runner, url = await serve(handler)
+	transport, protocol = await aio.connect('t', protocol=Client, api_url=url, codec='json')
+	try:
+		for i in range(50):
+			await asyncio.sleep(.02)
+			if received:
+				break
+		assert await protocol.meta.find_im_by_user_name('bob') == u'D1'
+		return protocol.meta.channels[u'C1'][u'name'], await protocol.replied
+	finally:
+		transport.close()
+		await protocol.meta.api.close()
+		await runner.cleanup()
+		server.close()
+
+
+
+async def lean():
+	loop = asyncio.get_running_loop()
+	factory = WebSocketServerFactory()
+	factory.protocol = Server
+	server = await loop.create_server(factory, '127.0.0.1', 0)
+	ws_url = 'ws://127.0.0.1:%d/' % server.sockets[0].getsockname()[1]
+
+	async def handler(request):
+		method = request.match_info['method']
+		if method == 'rtm.connect':
+			return web.json_response({'ok': True, 'url': ws_url, 'self': {'id': 'U0'}, 'team': {'id': 'T1'}})
+		elif method == 'users.list':
+			return web.json_response({'ok': True, 'members': [{'id': 'U1', 'name': 'bob'}]})
+		elif method == 'users.info':
+			return web.json_response({'ok': True, 'user': {'id': 'U1', 'name': 'bob', 'profile': {'title': 'x'}}})
+		return web.json_response({'ok': True, 'channels': [{'id': 'C1', 'name': 'general'}]})
+
+	runner, url = await serve(handler)
+	try:
+		# Loading the metadata directly.
+		meta = await aio.request_session('t', url, 'json', lean=True)
+		await meta.fill()
+		assert meta.find_user_by_name('bob')[0] == u'U1'
+		await meta.api.close()
+
+		# Fetching a full resource from a compact session.
+		meta = await aio.request_session('t', url, 'json', lean=True, compact=True)
+		await meta.fill()
+		assert u'profile' not in meta.users[u'U1']
+		user = await meta.users.fetch(u'U1')
+		assert user[u'profile'] == {u'title': u'x'}
+		await meta.api.close()
+
+		# Loading it in the background.
+		transport, protocol = await aio.connect('t', api_url=url, codec='json', lean=True)
+		for i in range(50):
+			await asyncio.sleep(.02)
+			if protocol.meta.next_incomplete() is None:
+				break
+		assert protocol.meta.find_channel_by_name('general')[0] == u'C1'
+		transport.close()
+		await protocol.meta.api.close()
+	finally:
+		await runner.cleanup()
+		server.close()
+
+
+name, msg_id = asyncio.run(main())
+assert name == u'renamed'
+assert isinstance(msg_id, int)
+assert b'"channel": "D1"' in received[0] or b'"channel":"D1"' in received[0]
+asyncio.run(lean())
+print('ok')
@@ -0,0 +1,189 @@
+"""
+Fakes shared by the tests, which let the protocol and session run without a
+network connection or an event loop.
+"""
+
+import json
+from twisted.internet import defer
+from slackrealtime.codec import JsonCodec
+from slackrealtime.rtm import BaseRtmProtocol
+from slackrealtime.session import SessionMetadata
+
+
+class ManualSessionMetadata(SessionMetadata):
+	"""
+	SessionMetadata which only applies updates when flush() is called.
+	"""
+	def _schedule_flush(self, delay):
+		return object()
+
+	def _cancel_flush(self, handle):
+		pass
+
+	def _run_in_background(self, func):
+		func()
+
+	def _log_error(self, msg):
+		raise
+
+
+class FakeApi(object):
+	"""
+	Stands in for SlackApi.  ``responses`` maps method names (eg:
+	``'users.list'``) to a function which is called with the parameters and
+	returns the response, or raises an error.  Calls are kept in ``calls``.
+
+	If ``lazy`` is set, calls instead return a function which makes the call,
+	standing in for a Deferred.  If ``deferred`` is set, they return a
+	Deferred.
+	"""
+	url = 'http://api.invalid/'
+
+	timeout = None
+
+	def __init__(self, responses=None, lazy=False, deferred=False):
+		self.codec = JsonCodec()
+		self.responses = {} if responses is None else responses
+		self.calls = []
+		self.lazy = lazy
+		self.deferred = deferred
+
+	def make_lazy(self):
+		api = FakeApi(self.responses, True)
+		api.calls = self.calls
+		return api
+
+	def __getattr__(self, group):
+		return FakeMethodGroup(self, group)
+
+
+class FakeMethodGroup(object):
+	def __init__(self, api, group):
+		self.api = api
+		self.group = group
+
+	def __getattr__(self, method):
+		name = self.group + '.' + method
+
+		def call(**kwargs):
+			self.api.calls.append((name, kwargs))
+			return self.api.responses[name](**kwargs)
+
+		if self.api.lazy:
+			return lambda **kwargs: lambda: call(**kwargs)
+		if self.api.deferred:
+			return lambda **kwargs: defer.maybeDeferred(call, **kwargs)
+		return call
+
+
+def make_session(cls=ManualSessionMetadata, api=None, lean=False, **data):
+	base = dict(
+		url='wss://example.invalid/',
+		self={u'id': u'U0', u'name': u'me'},
+		team={u'id': u'T1', u'name': u'team'},
+		users=[], channels=[], groups=[], ims=[], bots=[],
+	)
+	base.update(data)
+	# Missing from rtm.connect responses.
+	base = dict((k, v) for k, v in base.items() if v is not None)
+	return cls(base, api or FakeApi(), 'xoxb-test', lean)
+
+
+class FakeCall(object):
+	def __init__(self, clock, when, func, args):
+		self.clock = clock
+		self.when = when
+		self.func = func
+		self.args = args
+		self.cancelled = False
+
+	def cancel(self):
+		self.cancelled = True
+
+	def active(self):
+		return not self.cancelled and self in self.clock.calls
+
+
+class Clock(object):
+	"""
+	Stands in for the reactor's clock.
+	"""
+	def __init__(self):
+		self.now = 1000.
+		self.calls = []
+
+	def callLater(self, delay, func, *args):
+		call = FakeCall(self, self.now + delay, func, args)
+		self.calls.append(call)
+		return call
+
+	def advance(self, seconds):
+		end = self.now + seconds
+		while True:
+			due = [c for c in self.calls if not c.cancelled and c.when <= end]
+			if not due:
+				break
+			call = min(due, key=lambda c: c.when)
+			self.calls.remove(call)
+			self.now = max(self.now, call.when)
+			call.func(*call.args)
+		self.now = end
+		self.calls = [c for c in self.calls if not c.cancelled]
+
+
+class Waiter(object):
+	def __init__(self):
+		self.result = self.error = None
+
+
+class FakeRtmProtocol(BaseRtmProtocol):
+	"""
+	BaseRtmProtocol driven by a Clock, which records what it sends.
+	"""
+	def __init__(self, clock=None):
+		self.clock = clock or Clock()
+		self.sent = []
+		self.events = []
+		self.dropped = False
+
+	def _makeApi(self, meta):
+		return meta.api.make_lazy()
+
+	def _then(self, d, callback, errback=None):
+		try:
+			result = d()
+		except Exception as e:
+			if errback is None:
+				raise
+			return errback(e)
+		return callback(result)
+
+	def _now(self):
+		return self.clock.now
+
+	def _callLater(self, delay, func, *args):
+		return self.clock.callLater(delay, func, *args)
+
+	def _makeWaiter(self):
+		return Waiter()
+
+	def _resolve(self, waiter, result):
+		waiter.result = result
+
+	def _reject(self, waiter, error):
+		waiter.error = error
+
+	def _logError(self, msg):
+		raise
+
+	def sendMessage(self, data):
+		self.sent.append(json.loads(data))
+
+	def dropConnection(self, abort=False):
+		self.dropped = True
+
+	def onSlackEvent(self, event):
+		self.events.append(event)
+
+	def receive(self, **frame):
+		self.onMessage(json.dumps(frame).encode('utf-8'), False)
@@ -0,0 +1,75 @@
+from slackrealtime.api import SlackError
+from slackrealtime.rtm import AckTimeout
+
+from test_rtm import connect
+
+
+def test_ack_resolves_waiter():
+	rtm = connect()
+	waiter = rtm.sendCommand(type=u'message', channel=u'C1', text=u'hi', ack=True)
+	msg_id = rtm.sent[-1][u'id']
+	assert msg_id in rtm.pending_acks
+
+	rtm.clock.advance(.25)
+	rtm.receive(ok=True, reply_to=msg_id, ts=u'1.0', text=u'hi')
+	assert waiter.result._b[u'ts'] == u'1.0'
+	assert waiter.error is None
+	assert rtm.ack_latency == .25
+	assert rtm.pending_acks == {}
+	# The timeout was cancelled.
+	assert not [c for c in rtm.clock.calls if c.func == rtm._ackTimedOut and not c.cancelled]
+
+
+def test_error_rejects_waiter():
+	rtm = connect()
+	waiter = rtm.sendCommand(type=u'message', channel=u'C1', text=u'hi', ack=True)
+	rtm.receive(ok=False, reply_to=rtm.sent[-1][u'id'], error={u'code': 2, u'msg': u'message text is missing'})
+	assert isinstance(waiter.error, SlackError)
+	assert waiter.error.args == (u'message text is missing',)
+
+
+def test_ack_timeout():
+	rtm = connect()
+	waiter = rtm.sendCommand(type=u'message', channel=u'C1', text=u'hi', ack=True)
+	rtm.clock.advance(rtm.ack_timeout)
+	assert isinstance(waiter.error, AckTimeout)
+	assert rtm.pending_acks == {}
+
+	# A late ack is ignored.
+	rtm.receive(ok=True, reply_to=rtm.sent[-1][u'id'])
+	assert waiter.result is None
+
+
+def test_commands_without_waiters_are_tracked():
+	rtm = connect()
+	msg_id = rtm.sendCommand(type=u'message', channel=u'C1', text=u'hi')
+	assert isinstance(msg_id, int)
+	rtm.clock.advance(.5)
+	rtm.receive(ok=True, reply_to=msg_id)
+	assert rtm.ack_latency == .5
+	assert rtm.pending_acks == {}
+
+
+def test_oldest_pending_ack_is_evicted():
+	rtm = connect()
+	rtm.max_pending_acks = 2
+	first = rtm.sendCommand(type=u'typing', channel=u'C1', ack=True)
+	rtm.sendCommand(type=u'typing', channel=u'C2', ack=True)
+	rtm.sendCommand(type=u'typing', channel=u'C3', ack=True)
+	assert len(rtm.pending_acks) == 2
+	assert isinstance(first.error, AckTimeout)
+
+
+def test_close_fails_pending_acks():
+	rtm = connect()
+	sent = rtm.sendCommand(type=u'message', channel=u'C1', text=u'a', ack=True)
+	# Held back by the channel's rate limit.
+	queued = rtm.sendCommand(type=u'message', channel=u'C1', text=u'b', ack=True)
+	assert len(rtm.sent) == 1
+
+	rtm.onClose(False, None, None)
+	assert isinstance(sent.error, SlackError)
+	assert isinstance(queued.error, SlackError)
+	assert rtm.pending_acks == {}
+	assert len(rtm.command_queue) == 0
+	assert not [c for c in rtm.clock.calls if not c.cancelled]
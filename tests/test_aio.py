@@ -0,0 +1,117 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+from aiohttp import web
+import slackrealtime
+from slackrealtime.aioapi import AioSlackApi
+from slackrealtime.api import SlackError, SlackRateLimited
+
+
+def serve(handler):
+	"""
+	Runs an API server for the duration of a test, which answers every call
+	with ``handler(request)``.
+	"""
+	async def start():
+		app = web.Application()
+		app.router.add_post('/api/{method}', handler)
+		runner = web.AppRunner(app)
+		await runner.setup()
+		site = web.TCPSite(runner, '127.0.0.1', 0)
+		await site.start()
+		port = runner.addresses[0][1]
+		return runner, 'http://127.0.0.1:%d/api/' % port
+	return start()
+
+
+def run(coro):
+	return asyncio.run(coro)
+
+
+def test_call():
+	async def handler(request):
+		form = await request.post()
+		return web.json_response({'ok': True, 'method': request.match_info['method'], 'channel': form['channel']})
+
+	async def main():
+		runner, url = await serve(handler)
+		api = AioSlackApi(url, codec='json')
+		try:
+			return await api.chat.postMessage(token='t', channel='C1', text='hi')
+		finally:
+			await api.close()
+			await runner.cleanup()
+
+	assert run(main()) == {'method': 'chat.postMessage', 'channel': 'C1'}
+
+
+def test_error():
+	async def handler(request):
+		return web.json_response({'ok': False, 'error': 'channel_not_found'})
+
+	async def main():
+		runner, url = await serve(handler)
+		api = AioSlackApi(url, codec='json')
+		try:
+			await api.chat.postMessage(token='t', channel='C1')
+		finally:
+			await api.close()
+			await runner.cleanup()
+
+	with pytest.raises(SlackError):
+		run(main())
+
+
+def test_rate_limited_calls_are_retried():
+	calls = []
+
+	async def handler(request):
+		calls.append(request)
+		if len(calls) < 3:
+			return web.json_response({'ok': False, 'error': 'ratelimited'}, status=429, headers={'Retry-After': '0'})
+		return web.json_response({'ok': True})
+
+	async def main(max_retries):
+		runner, url = await serve(handler)
+		api = AioSlackApi(url, codec='json')
+		method = api.users.list
+		method.max_retries = max_retries
+		try:
+			return await method(token='t')
+		finally:
+			await api.close()
+			await runner.cleanup()
+
+	assert run(main(3)) == {}
+	assert len(calls) == 3
+
+	del calls[:]
+	with pytest.raises(SlackRateLimited):
+		run(main(1))
+	assert len(calls) == 2
+
+
+def run_in_subprocess(script):
+	"""
+	Runs a script from the tests directory in a new interpreter.  autobahn only
+	supports one networking library per process, and other tests use Twisted.
+	"""
+	src = os.path.dirname(os.path.dirname(slackrealtime.__file__))
+	return subprocess.check_output([sys.executable, os.path.join(os.path.dirname(__file__), script)],
+		env=dict(os.environ, PYTHONPATH=src), stderr=subprocess.STDOUT)
+
+
+def test_aio_does_not_import_twisted():
+	code = 'import sys, slackrealtime.aio; print(any(m.startswith("twisted") for m in sys.modules))'
+	src = os.path.dirname(os.path.dirname(slackrealtime.__file__))
+	out = subprocess.check_output([sys.executable, '-c', code], env=dict(os.environ, PYTHONPATH=src))
+	assert out.strip() == b'False'
+
+
+def test_connect():
+	assert run_in_subprocess('aio_connect.py').strip().endswith(b'ok')
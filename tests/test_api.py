@@ -0,0 +1,115 @@
+import asyncio
+import json
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+from slackrealtime import api as api_module
+from slackrealtime.api import SlackApi, SlackError, SlackRateLimited
+
+
+class FakeResponse(object):
+	def __init__(self, body, headers=None):
+		self.content = json.dumps(body).encode('utf-8')
+		self.headers = headers or {}
+
+
+class FakeSession(object):
+	"""
+	Stands in for a requests.Session, answering posts from ``responses`` in
+	turn.
+	"""
+	def __init__(self, *responses):
+		self.responses = list(responses)
+		self.posts = []
+
+	def post(self, url, data=None, timeout=None):
+		self.posts.append((url, data))
+		return self.responses.pop(0)
+
+
+RATE_LIMITED = FakeResponse({u'ok': False, u'error': u'ratelimited'}, {'Retry-After': '2'})
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+	sleeps = []
+	monkeypatch.setattr(api_module, 'sleep', sleeps.append)
+	return sleeps
+
+
+def test_call():
+	session = FakeSession(FakeResponse({u'ok': True, u'user': {u'id': u'U1'}}))
+	response = SlackApi('http://api.invalid', session=session).users.info(token='t', user='U1', cursor=None)
+	assert response == {u'user': {u'id': u'U1'}}
+	assert session.posts == [('http://api.invalid/users.info', {'token': 't', 'user': 'U1'})]
+
+
+def test_error():
+	session = FakeSession(FakeResponse({u'ok': False, u'error': u'user_not_found'}))
+	with pytest.raises(SlackError) as e:
+		SlackApi(session=session).users.info(token='t', user='U1')
+	assert e.value.args == (u'user_not_found',)
+
+
+def test_retries_rate_limited_calls(sleeps):
+	session = FakeSession(RATE_LIMITED, FakeResponse({u'ok': True}))
+	assert SlackApi(session=session).users.info(token='t') == {}
+	assert sleeps == [2.]
+
+
+def test_gives_up_after_max_retries(sleeps):
+	session = FakeSession(*[RATE_LIMITED] * 4)
+	with pytest.raises(SlackRateLimited) as e:
+		SlackApi(session=session).users.info(token='t')
+	assert e.value.retry_after == 2.
+	assert len(sleeps) == 3
+
+
+def test_does_not_sleep_in_event_loop(sleeps):
+	session = FakeSession(RATE_LIMITED, FakeResponse({u'ok': True}))
+
+	async def call():
+		return SlackApi(session=session).users.info(token='t')
+
+	with pytest.raises(SlackRateLimited):
+		asyncio.run(call())
+	assert sleeps == []
+
+
+def test_pool_and_keep_alive():
+	api = SlackApi(pool_size=4)
+	for prefix in ('https://', 'http://'):
+		adapter = api.session.get_adapter(prefix + 'slack.com/')
+		assert isinstance(adapter, HTTPAdapter)
+		assert adapter._pool_connections == 4
+		assert adapter._pool_maxsize == 4
+	assert api.session.headers['Connection'] == 'keep-alive'
+
+	api = SlackApi(keep_alive=False)
+	assert api.session.headers['Connection'] == 'close'
+
+
+def test_timeout_and_shared_session(monkeypatch):
+	posts = []
+
+	def post(self, url, data=None, timeout=None):
+		posts.append((url, data, timeout))
+		return FakeResponse({u'ok': True})
+
+	monkeypatch.setattr(requests.Session, 'post', post)
+	session = requests.Session()
+	api = SlackApi('http://api.invalid/', session=session, timeout=7.)
+	assert api.session is session
+	api.users.info(token='t')
+	assert posts == [('http://api.invalid/users.info', {'token': 't'}, 7.)]
+
+
+def test_close():
+	closed = []
+
+	class ClosingSession(FakeSession):
+		def close(self):
+			closed.append(True)
+
+	SlackApi(session=ClosingSession()).close()
+	assert closed == [True]
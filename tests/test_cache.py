@@ -0,0 +1,109 @@
+from time import time
+from helpers import FakeApi, ManualSessionMetadata
+from slackrealtime.cache import MetadataCache
+from slackrealtime.event import decode_event
+from slackrealtime.session import SessionMetadata
+
+from test_lean import CHANNELS, USERS, paged
+
+CONNECT = dict(
+	url='wss://example.invalid/',
+	self={u'id': u'U0', u'name': u'me'},
+	team={u'id': u'T1', u'name': u'team'},
+)
+
+
+def cached_session(cache, cls=ManualSessionMetadata):
+	api = FakeApi({
+		'users.list': paged(USERS, u'members'),
+		'conversations.list': paged(CHANNELS, u'channels'),
+	})
+	return cls(dict(CONNECT), api, 'xoxb-test', cache=cache)
+
+
+def test_round_trip(tmp_path):
+	cache = MetadataCache(str(tmp_path / 'T1.cache'))
+	meta = cached_session(cache)
+	meta.fill()
+
+	snapshot = cache.load()
+	assert snapshot[u'team'][u'id'] == u'T1'
+	assert len(snapshot[u'users']) == len(USERS)
+	assert snapshot[u'saved'] <= time()
+
+
+def test_snapshot_is_deep_copy(tmp_path):
+	meta = cached_session(MetadataCache(str(tmp_path / 'T1.cache')))
+	meta.team[u'prefs'] = {u'display_real_names': False}
+	meta.fill()
+
+	snapshot = meta.snapshot()
+	meta.team[u'prefs'][u'display_real_names'] = True
+	meta.users[u'U1'][u'profile'] = {}
+	assert snapshot[u'team'][u'prefs'] == {u'display_real_names': False}
+	assert u'profile' not in snapshot[u'users'][u'U1']
+
+
+def test_save_is_not_changed_by_later_updates(tmp_path):
+	class SlowCache(MetadataCache):
+		updating = False
+
+		def save(self, snapshot):
+			if not self.updating:
+				return MetadataCache.save(self, snapshot)
+
+			# Updates applied while the snapshot is being written.
+			self.updating = False
+			meta.update(decode_event({u'type': u'presence_change', u'user': u'U1', u'presence': u'away'}))
+			meta.update(decode_event({u'type': u'team_pref_change', u'name': u'display_real_names', u'value': True}))
+			meta.flush()
+			MetadataCache.save(self, snapshot)
+
+	cache = SlowCache(str(tmp_path / 'T1.cache'))
+	meta = cached_session(cache)
+	meta.team[u'prefs'] = {u'display_real_names': False}
+	meta.fill()
+	cache.updating = True
+	meta.save()
+
+	assert meta.users[u'U1'][u'presence'] == u'away'
+	snapshot = MetadataCache(cache.path).load()
+	user = [u for u in snapshot[u'users'] if u[u'id'] == u'U1'][0]
+	assert u'presence' not in user
+	assert snapshot[u'team'][u'prefs'] == {u'display_real_names': False}
+
+
+def test_saves_without_reactor(tmp_path):
+	# Not running under the reactor, so the snapshot is saved straight away
+	# once the metadata has been loaded.
+	cache = MetadataCache(str(tmp_path / 'T1.cache'))
+	meta = cached_session(cache, SessionMetadata)
+	meta.fill()
+	assert not meta._saving
+	assert cache.load() is not None
+
+
+def test_fresh_snapshot_is_used_as_is(tmp_path):
+	cache = MetadataCache(str(tmp_path / 'T1.cache'))
+	cached_session(cache).fill()
+
+	meta = cached_session(cache)
+	assert meta.next_incomplete() is None
+	assert meta.find_user_by_name('user4')[0] == u'U4'
+	assert meta.api.calls == []
+
+
+def test_stale_snapshot_is_refreshed(tmp_path):
+	cache = MetadataCache(str(tmp_path / 'T1.cache'))
+	cached_session(cache).fill()
+
+	snapshot = cache.load()
+	snapshot[u'saved'] -= ManualSessionMetadata.max_cache_age
+	cache.save(snapshot)
+
+	meta = cached_session(cache)
+	# Usable straight away, but loaded again.
+	assert meta.find_user_by_name('user4')[0] == u'U4'
+	assert meta.next_incomplete() == u'users'
+	meta.fill()
+	assert meta.next_incomplete() is None
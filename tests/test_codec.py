@@ -0,0 +1,30 @@
+import pytest
+from slackrealtime.codec import CODECS, JsonCodec, get_codec
+
+FRAME = {u'type': u'message', u'text': u'café <http://example.com/a/b>', u'ts': u'1500000000.000100', u'n': [1, 2.5, None, True]}
+
+
+@pytest.mark.parametrize('codec_class', CODECS)
+def test_round_trip(codec_class):
+	codec = codec_class()
+	data = codec.dumps(FRAME)
+	assert isinstance(data, bytes)
+	assert codec.loads(data) == FRAME
+	assert codec.loads(data.decode('utf-8')) == FRAME
+
+
+@pytest.mark.parametrize('codec_class', CODECS)
+def test_interoperates_with_json(codec_class):
+	assert codec_class().loads(JsonCodec().dumps(FRAME)) == FRAME
+	assert JsonCodec().loads(codec_class().dumps(FRAME)) == FRAME
+
+
+def test_get_codec():
+	assert isinstance(get_codec(), CODECS[0])
+	assert get_codec('json').name == 'json'
+
+	codec = JsonCodec()
+	assert get_codec(codec) is codec
+
+	with pytest.raises(KeyError):
+		get_codec('nonexistent')
@@ -0,0 +1,144 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from helpers import FakeApi
+from slackrealtime.tools.extract_logs import extract_logs, extract_logs_array, extract_logs_sliced
+
+# Messages one second apart, from ts 101 to 200.
+MESSAGES = [{u'type': u'message', u'ts': u'%d.000000' % ts, u'user': u'U1', u'text': u'hi'} for ts in range(200, 100, -1)]
+
+
+def history(messages, fail_after=None):
+	"""
+	Answers *.history calls like Slack does: newest first, with ``oldest``
+	and ``latest`` excluded unless ``inclusive`` is set.
+	"""
+	calls = []
+
+	def call(token, channel, latest, oldest, limit=None, count=None, inclusive=None):
+		if fail_after is not None and len(calls) >= fail_after:
+			raise IOError('interrupted')
+		calls.append((latest, oldest))
+		if inclusive:
+			found = [m for m in messages if oldest <= float(m[u'ts']) <= latest]
+		else:
+			found = [m for m in messages if oldest < float(m[u'ts']) < latest]
+		n = limit or count
+		return {u'messages': [dict(m) for m in found[:n]], u'has_more': len(found) > n}
+	call.calls = calls
+	return call
+
+
+def fake_api(**responses):
+	return FakeApi(dict({'users.list': lambda token, cursor=None: {u'members': [{u'id': u'U1', u'name': u'alice'}]}}, **responses))
+
+
+def read_lines(path):
+	with open(path) as f:
+		return [json.loads(line) for line in f]
+
+
+def test_extract_logs(tmp_path):
+	api = fake_api(**{'groups.history': history(MESSAGES)})
+	output = str(tmp_path / 'out.jsonl')
+	assert extract_logs(api, 't', 'groups', u'G1', 150., 180.5, output, output + '.checkpoint', chunk_size=7) == 30
+
+	messages = read_lines(output)
+	assert [m[u'ts'] for m in messages] == [u'%d.000000' % ts for ts in range(180, 150, -1)]
+	assert messages[0][u'user_name'] == u'alice'
+
+
+def test_resumes_after_interruption(tmp_path):
+	output = str(tmp_path / 'out.jsonl')
+	api = fake_api(**{'groups.history': history(MESSAGES, fail_after=2)})
+	with pytest.raises(IOError):
+		extract_logs(api, 't', 'groups', u'G1', 100., 201., output, output + '.checkpoint', chunk_size=10)
+	assert len(read_lines(output)) == 20
+
+	call = history(MESSAGES)
+	api = fake_api(**{'groups.history': call})
+	assert extract_logs(api, 't', 'groups', u'G1', 100., 201., output, output + '.checkpoint', chunk_size=10) == 100
+	# Carried on from the last page written.
+	assert call.calls[0][0] == 181.
+	assert [m[u'ts'] for m in read_lines(output)] == [m[u'ts'] for m in MESSAGES]
+
+
+@pytest.mark.parametrize('family, channel, oldest, latest', [
+	('conversations', u'G1', 100., 201.),
+	('groups', u'G2', 100., 201.),
+	('groups', u'G1', 150., 201.),
+	('groups', u'G1', 100., 190.),
+])
+def test_checkpoint_for_other_export_is_ignored(tmp_path, family, channel, oldest, latest):
+	output = str(tmp_path / 'out.jsonl')
+	api = fake_api(**{'groups.history': history(MESSAGES, fail_after=1)})
+	with pytest.raises(IOError):
+		extract_logs(api, 't', 'groups', u'G1', 100., 201., output, output + '.checkpoint', chunk_size=10)
+
+	call = history(MESSAGES)
+	api = fake_api(**{family + '.history': call})
+	extract_logs(api, 't', family, channel, oldest, latest, output, output + '.checkpoint', chunk_size=10)
+	# Started from the beginning.
+	assert call.calls[0] == (latest, oldest)
+
+
+def test_array_output(tmp_path):
+	api = fake_api(**{'groups.history': history(MESSAGES)})
+	output = str(tmp_path / 'out.json')
+	assert extract_logs_array(api, 't', 'groups', u'G1', 100., 201., output, output + '.checkpoint', chunk_size=30) == 100
+	with open(output) as f:
+		assert [m[u'ts'] for m in json.load(f)] == [m[u'ts'] for m in MESSAGES]
+	assert sorted(p.name for p in tmp_path.iterdir()) == ['out.json']
+
+
+@pytest.mark.parametrize('jsonl', [False, True])
+def test_sliced(tmp_path, jsonl):
+	api = fake_api(**{'groups.history': history(MESSAGES)})
+	output = str(tmp_path / 'out')
+	with ThreadPoolExecutor(2) as executor:
+		join = extract_logs_sliced(api, 't', 'groups', u'G1', 100., 201., output, 3, executor, chunk_size=7, jsonl=jsonl)
+		assert join() == 100
+
+	if jsonl:
+		messages = read_lines(output)
+	else:
+		with open(output) as f:
+			messages = json.load(f)
+	assert [m[u'ts'] for m in messages] == [m[u'ts'] for m in MESSAGES]
+	assert sorted(p.name for p in tmp_path.iterdir()) == ['out']
+
+
+def test_sliced_includes_messages_on_boundaries(tmp_path):
+	api = fake_api(**{'groups.history': history(MESSAGES)})
+	output = str(tmp_path / 'out')
+	with ThreadPoolExecutor(2) as executor:
+		# Boundaries at 175, 150 and 125, where there are messages.
+		join = extract_logs_sliced(api, 't', 'groups', u'G1', 100., 200., output, 4, executor, chunk_size=7, jsonl=True)
+		assert join() == 99
+	assert [m[u'ts'] for m in read_lines(output)] == [m[u'ts'] for m in MESSAGES[1:]]
+
+
+def test_finished_checkpoint_without_output_is_ignored(tmp_path):
+	output = str(tmp_path / 'out.jsonl')
+	api = fake_api(**{'groups.history': history(MESSAGES)})
+	extract_logs(api, 't', 'groups', u'G1', 100., 201., output, output + '.checkpoint', chunk_size=30)
+	os.unlink(output)
+
+	assert extract_logs(api, 't', 'groups', u'G1', 100., 201., output, output + '.checkpoint', chunk_size=30) == 100
+	assert [m[u'ts'] for m in read_lines(output)] == [m[u'ts'] for m in MESSAGES]
+
+
+def test_checkpoint_past_end_of_output_is_ignored(tmp_path):
+	output = str(tmp_path / 'out.jsonl')
+	api = fake_api(**{'groups.history': history(MESSAGES, fail_after=2)})
+	with pytest.raises(IOError):
+		extract_logs(api, 't', 'groups', u'G1', 100., 201., output, output + '.checkpoint', chunk_size=10)
+	with open(output, 'r+b') as f:
+		f.truncate(100)
+
+	api = fake_api(**{'groups.history': history(MESSAGES)})
+	assert extract_logs(api, 't', 'groups', u'G1', 100., 201., output, output + '.checkpoint', chunk_size=10) == 100
+	with open(output, 'rb') as f:
+		assert b'\0' not in f.read()
+	assert [m[u'ts'] for m in read_lines(output)] == [m[u'ts'] for m in MESSAGES]
@@ -0,0 +1,111 @@
+import io
+import json
+import os
+from datetime import date, datetime
+from pytz import timezone, utc
+from slackrealtime.tools.format_logs import (day_chunks, format_logs_by_day, merge_logs, read_logs,
+	render_chunks)
+
+DAY = 86400.
+# 2016-01-31 00:00 UTC.
+START = 1454198400.
+
+
+def message(ts, text=u'hi'):
+	return {u'type': u'message', u'ts': u'%.6f' % ts, u'user_name': u'alice', u'text': text}
+
+
+def write(path, messages, array):
+	with open(path, 'wb') as f:
+		if array:
+			f.write(json.dumps(messages).encode('utf-8'))
+		else:
+			for m in messages:
+				f.write(json.dumps(m).encode('utf-8') + b'\n')
+	return path
+
+
+def exports(tmp_path):
+	a = [message(START + i * 3600) for i in range(0, 60, 2)]
+	b = [message(START + i * 3600) for i in range(1, 60, 2)]
+	# Newest first JSON Lines and JSON array, as extract_logs writes them, and
+	# an oldest first file.
+	return [
+		write(str(tmp_path / 'a.jsonl'), a[::-1][:15], False),
+		write(str(tmp_path / 'a.json'), a[::-1][15:], True),
+		write(str(tmp_path / 'b.jsonl'), b, False),
+	], a + b
+
+
+def test_merge_matches_read(tmp_path):
+	paths, messages = exports(tmp_path)
+	merged = list(merge_logs([open(p, 'rb') for p in paths]))
+	assert [m['ts'] for m in merged] == sorted(float(m[u'ts']) for m in messages)
+	assert merged == read_logs([open(p, 'rb') for p in paths])
+
+
+def test_read_from_pipes(tmp_path):
+	paths, messages = exports(tmp_path)
+
+	def pipes():
+		for p in paths:
+			r, w = os.pipe()
+			with open(p, 'rb') as f:
+				os.write(w, f.read())
+			os.close(w)
+			# Unbuffered, so neither seekable nor peekable.
+			yield os.fdopen(r, 'rb', buffering=0)
+
+	expected = sorted(float(m[u'ts']) for m in messages)
+	assert [m['ts'] for m in merge_logs(list(pipes()))] == expected
+	assert [m['ts'] for m in read_logs(list(pipes()))] == expected
+
+
+def test_day_chunks_across_dst():
+	tz = timezone('Australia/Sydney')
+	# Daylight saving ends at 3am on 2016-04-03.
+	midnight = tz.localize(datetime(2016, 4, 2))
+	start = (midnight - utc.localize(datetime(1970, 1, 1))).total_seconds()
+	logs = [dict(message(start + i * 3600), ts=start + i * 3600) for i in range(0, 72, 6)]
+
+	days = [(day, len(messages)) for day, messages in day_chunks(logs, tz)]
+	# The 3rd of April has 25 hours, so 23:00 that day is 48 hours after
+	# midnight on the 2nd.
+	assert days == [(date(2016, 4, 2), 4), (date(2016, 4, 3), 5), (date(2016, 4, 4), 3)]
+
+
+def test_render_in_processes_matches(tmp_path):
+	paths, messages = exports(tmp_path)
+	chunks = list(day_chunks(merge_logs([open(p, 'rb') for p in paths]), utc))
+	serial = list(render_chunks(iter(chunks), 'UTC'))
+	parallel = list(render_chunks(iter(chunks), 'UTC', jobs=2, batch_size=10))
+	assert parallel == serial
+	assert [day for day, md in serial] == [date(2016, 1, 31), date(2016, 2, 1), date(2016, 2, 2)]
+
+
+def test_by_day_only_writes_changes(tmp_path):
+	paths, messages = exports(tmp_path)
+	out = tmp_path / 'days'
+	assert format_logs_by_day([open(p, 'rb') for p in paths], str(out), stream=True) == 3
+	assert sorted(p.name for p in out.iterdir()) == ['2016-01-31.md', '2016-02-01.md', '2016-02-02.md']
+
+	assert format_logs_by_day([open(p, 'rb') for p in paths], str(out), stream=True) == 0
+
+	# A new message on the last day.
+	write(paths[2], [message(START + 2 * DAY + 23 * 3600, u'late')], False)
+	assert format_logs_by_day([open(p, 'rb') for p in paths], str(out), stream=True, since=date(2016, 2, 2)) == 1
+	with io.open(str(out / '2016-02-02.md'), encoding='utf-8') as f:
+		assert u'late' in f.read()
+
+
+def test_messages_without_text(tmp_path):
+	path = write(str(tmp_path / 'a.jsonl'), [
+		{u'type': u'message', u'ts': u'%.6f' % START, u'user_name': u'alice', u'attachments': [{}]},
+		{u'type': u'message', u'subtype': u'bot_message', u'ts': u'%.6f' % (START + 1), u'username': u'ci', u'text': u'*done*'},
+		{u'type': u'message', u'subtype': u'bot_message', u'ts': u'%.6f' % (START + 2), u'bot_id': u'B1', u'text': None},
+	], False)
+	chunks = day_chunks(merge_logs([open(path, 'rb')]), utc)
+	(day, md), = render_chunks(chunks, 'UTC', jobs=2)
+	assert u'**@alice**: \n' in md
+	assert u'**@ci**: **done**' in md
+	assert u'**@B1**: \n' in md
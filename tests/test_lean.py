@@ -0,0 +1,167 @@
+import pytest
+from helpers import FakeApi, FakeRtmProtocol, make_session
+from slackrealtime.api import SlackError
+from slackrealtime.event import decode_event
+
+USERS = [{u'id': u'U%d' % i, u'name': u'user%d' % i} for i in range(5)]
+CHANNELS = [{u'id': u'C%d' % i, u'name': u'channel%d' % i} for i in range(3)]
+
+
+def paged(items, key):
+	"""
+	Answers a *.list call two items at a time.
+	"""
+	def call(cursor=None, limit=None, **kwargs):
+		start = int(cursor or 0)
+		o = {key: [dict(i) for i in items[start:start + 2]]}
+		if start + 2 < len(items):
+			o[u'response_metadata'] = {u'next_cursor': str(start + 2)}
+		return o
+	return call
+
+
+def lean_session(**responses):
+	api = FakeApi(dict({
+		'users.list': paged(USERS, u'members'),
+		'conversations.list': paged(CHANNELS, u'channels'),
+	}, **responses))
+	return make_session(api=api, lean=True, users=None, channels=None, groups=None, ims=None, bots=None)
+
+
+def test_lookup_miss_does_not_block():
+	meta = lean_session()
+	with pytest.raises(KeyError):
+		meta.find_user_by_name('user4')
+	with pytest.raises(KeyError):
+		meta.find_channel_by_name('channel1')
+	assert meta.api.calls == []
+
+
+def test_fill():
+	meta = lean_session()
+	meta.fill()
+	assert meta.next_incomplete() is None
+	assert meta.find_user_by_name('user4')[0] == u'U4'
+	assert meta.find_channel_by_name('channel2')[0] == u'C2'
+
+
+def test_protocol_fills_in_background():
+	rtm = FakeRtmProtocol()
+	rtm._seedMetadata(lean_session())
+	rtm.onConnect(None)
+	assert not rtm.meta.filling
+	assert rtm.meta.find_user_by_name('user4')[0] == u'U4'
+	assert len(rtm.meta.api.calls) == 5
+
+
+def test_protocol_retries_fill_after_error():
+	failures = []
+
+	def flaky(**kwargs):
+		if not failures:
+			failures.append(True)
+			raise SlackError('internal_error')
+		return paged(USERS, u'members')(**kwargs)
+
+	class QuietRtmProtocol(FakeRtmProtocol):
+		def _logError(self, msg):
+			pass
+
+	rtm = QuietRtmProtocol()
+	rtm._seedMetadata(lean_session(**{'users.list': flaky}))
+	rtm.onConnect(None)
+	assert rtm.meta.filling
+	assert u'users' not in rtm.meta.complete
+
+	rtm.clock.advance(rtm.fill_retry_delay)
+	assert not rtm.meta.filling
+	assert rtm.meta.next_incomplete() is None
+
+
+def test_updates_for_unloaded_resources():
+	meta = lean_session()
+	for body in [
+		{u'type': u'presence_change', u'user': u'U1', u'presence': u'away'},
+		{u'type': u'presence_change', u'users': [u'U1', u'U2'], u'presence': u'away'},
+		{u'type': u'channel_archive', u'channel': u'C1'},
+		{u'type': u'channel_rename', u'channel': {u'id': u'C1', u'name': u'renamed'}},
+		{u'type': u'channel_marked', u'channel': u'C1', u'ts': u'1.0'},
+		{u'type': u'im_open', u'channel': u'D1'},
+		{u'type': u'user_change', u'user': {u'id': u'U3', u'name': u'changed'}},
+	]:
+		meta.update(decode_event(body))
+	# ManualSessionMetadata raises any error from an update handler.
+	meta.flush()
+
+	assert u'U1' not in meta.users
+	assert u'C1' not in meta.channels
+	assert meta.find_user_by_name('changed')[0] == u'U3'
+
+	# Pages loaded later don't replace the newer copy from the event.
+	meta.fill()
+	assert meta.users[u'U3'][u'name'] == u'changed'
+	assert meta.users[u'U1'][u'name'] == u'user1'
+
+
+def test_reconcile_after_reconnecting():
+	meta = lean_session()
+	meta.fill()
+
+	# While disconnected, a user was renamed and another removed, a channel
+	# became private, and a new channel was made.
+	users = [dict(u) for u in USERS[:4]]
+	users[1][u'name'] = u'renamed'
+	channels = [dict(c) for c in CHANNELS] + [{u'id': u'C9', u'name': u'new'}]
+	channels[2][u'is_private'] = True
+	meta.api.responses['users.list'] = paged(users, u'members')
+	meta.api.responses['conversations.list'] = paged(channels, u'channels')
+
+	meta.reconcile(dict(url='wss://example.invalid/2', self={u'id': u'U0'}, team={u'id': u'T1'}))
+	assert meta.url == 'wss://example.invalid/2'
+	assert meta.next_incomplete() == u'users'
+
+	# The next connection loads the metadata again.
+	rtm = FakeRtmProtocol()
+	rtm._seedMetadata(meta)
+	rtm.onConnect(None)
+	assert meta.next_incomplete() is None
+
+	assert meta.find_user_by_name('renamed')[0] == u'U1'
+	assert u'U4' not in meta.users
+	with pytest.raises(KeyError):
+		meta.find_user_by_name('user1')
+	with pytest.raises(KeyError):
+		meta.find_user_by_name('user4')
+
+	assert u'C2' not in meta.channels
+	assert meta.find_group_by_name('channel2')[0] == u'C2'
+	with pytest.raises(KeyError):
+		meta.find_channel_by_name('channel2')
+	assert meta.find_channel_by_name('new')[0] == u'C9'
+
+
+def test_reconcile_keeps_newer_updates():
+	meta = lean_session()
+	meta.fill()
+	meta.reconcile(dict(url='wss://example.invalid/2', self={u'id': u'U0'}, team={u'id': u'T1'}))
+
+	# Events while the metadata is being loaded again are newer than the
+	# pages, and new resources they add are kept.
+	meta.update(decode_event({u'type': u'user_change', u'user': {u'id': u'U1', u'name': u'changed', u'updated': 5}}))
+	meta.update(decode_event({u'type': u'channel_created', u'channel': {u'id': u'C9', u'name': u'new'}}))
+	meta.flush()
+	meta.fill()
+
+	assert meta.users[u'U1'][u'name'] == u'changed'
+	assert meta.find_channel_by_name('new')[0] == u'C9'
+
+
+def test_pages_from_before_reconcile_are_dropped():
+	meta = lean_session()
+	generation = meta._generation
+	page = meta._request_page(meta.api, u'users')
+	meta.reconcile(dict(url='wss://example.invalid/2', self={u'id': u'U0'}, team={u'id': u'T1'}))
+
+	meta._apply_page(u'users', page, generation)
+	assert meta.users == {}
+	assert meta._cursors == {}
@@ -0,0 +1,35 @@
+from helpers import make_session
+from slackrealtime import manager as manager_module
+from slackrealtime.factory import ReconnectingWebSocketClientFactory
+from slackrealtime.manager import ConnectionManager
+
+
+class FakeConnector(object):
+	def __init__(self):
+		self.disconnected = False
+
+	def disconnect(self):
+		self.disconnected = True
+
+	def stopConnecting(self):
+		pass
+
+
+def test_manager_reconnects_by_default(monkeypatch):
+	connectors = []
+	monkeypatch.setattr(manager_module, 'connectWS', lambda factory: connectors.append(FakeConnector()) or connectors[-1])
+
+	manager = ConnectionManager()
+	meta = make_session()
+	team_id = manager._connect(meta, 'xoxb-test')
+	wsfactory = manager._factories[team_id]
+	assert isinstance(wsfactory, ReconnectingWebSocketClientFactory)
+	assert wsfactory.meta is meta
+	assert meta.txapi is manager.txapi
+
+	# Having reconnected since, the new connection is closed.
+	wsfactory.connector = FakeConnector()
+	manager.remove(team_id)
+	assert not wsfactory.continueTrying
+	assert wsfactory.connector.disconnected
+	assert team_id not in manager.teams
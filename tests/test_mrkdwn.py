@@ -0,0 +1,72 @@
+import pytest
+from slackrealtime.mrkdwn import Translator, to_html, to_markdown
+from slackrealtime.tools.format_logs import slack_to_markdown
+
+
+@pytest.mark.parametrize('text, markdown', [
+	(u'plain text', u'plain text'),
+	(u'*bold* _italic_ ~strike~', u'**bold** *italic* ~~strike~~'),
+	(u'*bold _and italic_*', u'**bold *and italic***'),
+	(u'snake_case_name and 2*3*4', u'snake_case_name and 2*3*4'),
+	(u'<@U1|alice> in <#C1|general>', u'**@alice** in **#general**'),
+	(u'<!here> <!subteam^S1|@team>', u'**@here** **@team**'),
+	(u'<!date^1392734382^{date}|Feb 18, 2014>', u'Feb 18, 2014'),
+	(u'<https://example.com/?a=1&amp;b=2|a &amp; b>', u'[a &amp; b](https://example.com/?a=1&amp;b=2)'),
+	(u'<https://example.com/>', u'[https://example.com/](https://example.com/)'),
+	(u'<mailto:a@example.com|mail me>', u'[mail me](mailto:a@example.com)'),
+	(u'`x &lt; y` and ```\nif a &amp;&amp; b:\n```', u'`x < y` and \n```\nif a && b:\n```'),
+	(u'&gt; quoted *text*\nreply', u'> quoted **text**\nreply'),
+	(u'&lt;script&gt; &amp; "quotes"', u'&lt;script&gt; &amp; "quotes"'),
+	(u'line one\nline two', u'line one\nline two'),
+	(u':+1: :simple_smile:', u':+1: :simple_smile:'),
+])
+def test_markdown(text, markdown):
+	assert to_markdown(text) == markdown
+
+
+def test_markdown_keeps_escaping():
+	assert '<' not in to_markdown(u'&lt;img src=x onerror=alert(1)&gt;')
+
+
+@pytest.mark.parametrize('text, html', [
+	(u'*bold* _italic_', u'<strong>bold</strong> <em>italic</em>'),
+	(u'&lt;b&gt; "hi" &amp;', u'&lt;b&gt; &quot;hi&quot; &amp;'),
+	(u'one\ntwo', u'one<br>\ntwo'),
+	(u'<https://example.com/?a="b"|link>', u'<a href="https://example.com/?a=&quot;b&quot;">link</a>'),
+	(u'`a &lt; b`', u'<code>a &lt; b</code>'),
+	(u'<@U1|alice>', u'<span class="user" data-id="U1">@alice</span>'),
+])
+def test_html(text, html):
+	assert to_html(text) == html
+
+
+@pytest.mark.parametrize('text', [
+	u'<javascript:alert(1)|click me>',
+	u'<JavaScript:alert(1)>',
+	u'<data:text/html;base64,PHNjcmlwdD4=|click me>',
+	u'<vbscript:msgbox|click me>',
+])
+def test_unsafe_links_are_text(text):
+	assert '<a' not in to_html(text)
+	assert '](' not in to_markdown(text)
+
+
+def test_names_from_maps_are_escaped():
+	assert to_html(u'<@U1>', users={u'U1': u'<b>'}) == u'<span class="user" data-id="U1">@&lt;b&gt;</span>'
+	assert to_markdown(u'<#C1>', channels={u'C1': u'a&b'}) == u'**#a&amp;b**'
+	assert to_markdown(u'<@U2>') == u'**@U2**'
+
+
+def test_no_text():
+	assert to_markdown(None) == u''
+	assert to_markdown(u'') == u''
+	assert to_html(None) == u''
+
+
+def test_default_text_is_unchanged():
+	assert Translator().text(u'a &amp; b') == u'a &amp; b'
+
+
+def test_format_logs():
+	assert slack_to_markdown(u'hi <@U1|alice>\n*see* <https://example.com/|this>') == \
+		u'hi **@alice**\n**see** [this](https://example.com/)'
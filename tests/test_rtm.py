@@ -0,0 +1,54 @@
+from helpers import FakeRtmProtocol, make_session
+from slackrealtime.rtm import peek_event_type
+
+
+def connect(protocol=None, **data):
+	protocol = protocol or FakeRtmProtocol()
+	protocol._seedMetadata(make_session(**data))
+	protocol.onConnect(None)
+	return protocol
+
+
+def test_peek_event_type():
+	assert peek_event_type(b'{"type": "message", "text": "hi"}') == u'message'
+	assert peek_event_type(u'{"type":"user_typing"}') == u'user_typing'
+	assert peek_event_type(b'{"text": "hi", "type": "message"}') is None
+	assert peek_event_type(b'{"reply_to": 1, "ok": true}') is None
+
+
+def test_subscriptions_drop_unwanted_events():
+	rtm = connect(channels=[{u'id': u'C1', u'name': u'general'}])
+	rtm.subscribe(u'message')
+
+	rtm.receive(type=u'user_typing', channel=u'C1', user=u'U1')
+	rtm.receive(type=u'message', channel=u'C1', user=u'U1', text=u'hi')
+	# Needed by the metadata, but not passed on.
+	rtm.receive(type=u'channel_rename', channel={u'id': u'C1', u'name': u'renamed'})
+	rtm.meta.flush()
+
+	assert [e._b[u'type'] for e in rtm.events] == [u'message']
+	assert rtm.meta.channels[u'C1'][u'name'] == u'renamed'
+
+
+def test_no_subscriptions_delivers_everything():
+	rtm = connect()
+	rtm.receive(type=u'user_typing', channel=u'C1', user=u'U1')
+	rtm.receive(type=u'hello')
+	assert [e._b[u'type'] for e in rtm.events] == [u'user_typing', u'hello']
+
+
+def test_missed_pongs_drop_connection():
+	rtm = connect()
+	# Nothing heard for ping_interval, so it pings.
+	rtm.clock.advance(rtm.ping_interval)
+	assert rtm.sent[-1][u'type'] == u'ping'
+
+	# The pong keeps it alive.
+	rtm.receive(type=u'pong', reply_to=rtm.sent[-1][u'id'])
+	rtm.clock.advance(rtm.pong_timeout)
+	assert not rtm.dropped
+	assert rtm.missed_pongs == 0
+
+	# Then max_missed_pongs pings go unanswered.
+	rtm.clock.advance(rtm.ping_interval + rtm.pong_timeout * rtm.max_missed_pongs)
+	assert rtm.dropped
@@ -0,0 +1,75 @@
+from slackrealtime.sendqueue import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, SendQueue, TokenBucket
+
+
+def drain(queue, now):
+	o = []
+	while True:
+		command, delay = queue.pop(now)
+		if command is None:
+			return o, delay
+		o.append(command)
+
+
+def test_token_bucket():
+	bucket = TokenBucket(2., 2, 0.)
+	assert bucket.delay(0.) == 0.
+	bucket.take(0.)
+	bucket.take(0.)
+	assert bucket.delay(0.) == .5
+	assert bucket.delay(.25) == .25
+	assert bucket.delay(.5) == 0.
+	assert not bucket.full(.5)
+	assert bucket.full(1.)
+
+
+def test_priority_lanes():
+	queue = SendQueue(0., channel_rate=100., channel_burst=100)
+	queue.put(PRIORITY_LOW, u'C1', 'low')
+	queue.put(PRIORITY_NORMAL, u'C1', 'normal')
+	queue.put(PRIORITY_HIGH, None, 'ping')
+	assert len(queue) == 3
+	assert drain(queue, 0.) == (['ping', 'normal', 'low'], None)
+	assert len(queue) == 0
+
+
+def test_channels_take_turns():
+	queue = SendQueue(0., channel_rate=100., channel_burst=100)
+	for i in range(3):
+		queue.put(PRIORITY_NORMAL, u'C1', 'a%d' % i)
+	queue.put(PRIORITY_NORMAL, u'C2', 'b0')
+	assert drain(queue, 0.)[0] == ['a0', 'b0', 'a1', 'a2']
+
+
+def test_channel_rate():
+	queue = SendQueue(0.)
+	queue.put(PRIORITY_NORMAL, u'C1', 'a0')
+	queue.put(PRIORITY_NORMAL, u'C1', 'a1')
+	queue.put(PRIORITY_NORMAL, u'C2', 'b0')
+
+	# One a second for each channel.
+	assert drain(queue, 0.) == (['a0', 'b0'], 1.)
+	assert drain(queue, .5) == ([], .5)
+	assert drain(queue, 1.) == (['a1'], None)
+
+
+def test_overall_rate():
+	queue = SendQueue(0., rate=2., burst=2)
+	for i in range(3):
+		queue.put(PRIORITY_HIGH, None, i)
+	assert drain(queue, 0.) == ([0, 1], .5)
+	assert drain(queue, .5) == ([2], None)
+
+
+def test_expire_and_clear():
+	queue = SendQueue(0.)
+	queue.put(PRIORITY_NORMAL, u'C1', 'a0')
+	queue.put(PRIORITY_NORMAL, u'C2', 'b0')
+	queue.put(PRIORITY_NORMAL, u'C2', 'b1')
+	drain(queue, 0.)
+	queue.expire(5.)
+	# C2 still has a command queued.
+	assert list(queue.channel_buckets) == [u'C2']
+
+	queue.clear()
+	assert len(queue) == 0
+	assert queue.pop(5.) == (None, None)
@@ -0,0 +1,102 @@
+from helpers import ManualSessionMetadata, make_session
+from slackrealtime.event import decode_event
+from slackrealtime.session import SessionMetadata
+
+
+def apply(meta, **body):
+	meta.update(decode_event(body))
+	meta.flush()
+
+
+def test_find_channel_by_name_is_case_insensitive():
+	meta = make_session(channels=[{u'id': u'C1', u'name': u'General'}])
+	assert meta.find_channel_by_name('general')[0] == u'C1'
+
+
+def test_rename_reindexes_duplicate_name():
+	meta = make_session(channels=[
+		{u'id': u'C2', u'name': u'DUP'},
+		{u'id': u'C3', u'name': u'DUP'},
+	])
+	assert meta.find_channel_by_name('dup')[0] == u'C2'
+
+	apply(meta, type=u'channel_rename', channel={u'id': u'C2', u'name': u'other'})
+	assert meta.find_channel_by_name('dup')[0] == u'C3'
+	assert meta.find_channel_by_name('other')[0] == u'C2'
+
+
+def test_user_change_reindexes_duplicate_name():
+	meta = make_session(users=[
+		{u'id': u'U1', u'name': u'bob'},
+		{u'id': u'U2', u'name': u'Bob'},
+	])
+	apply(meta, type=u'user_change', user={u'id': u'U1', u'name': u'robert'})
+	assert meta.find_user_by_name('bob')[0] == u'U2'
+	assert meta.find_user_by_name('robert')[0] == u'U1'
+
+
+def test_update_is_not_affected_by_user_code():
+	meta = make_session()
+	event = decode_event({u'type': u'channel_created', u'channel': {u'id': u'C1', u'name': u'new'}})
+	meta.update(event)
+
+	# onSlackEvent() runs before the update is applied.
+	event.channel[u'name'] = u'mangled'
+	meta.flush()
+	assert meta.channels[u'C1'][u'name'] == u'new'
+	assert meta.find_channel_by_name('new')[0] == u'C1'
+
+
+def test_register_update_handler():
+	class DndSessionMetadata(ManualSessionMetadata):
+		pass
+
+	def on_dnd_updated(meta, event):
+		meta.users[event.user][u'dnd'] = event.dnd_status
+
+	DndSessionMetadata.register_update_handler(u'dnd_updated', on_dnd_updated)
+	assert u'dnd_updated' not in SessionMetadata.update_handlers
+
+	meta = make_session(DndSessionMetadata, users=[{u'id': u'U1', u'name': u'bob'}])
+	apply(meta, type=u'dnd_updated', user=u'U1', dnd_status={u'dnd_enabled': True})
+	assert meta.users[u'U1'][u'dnd'] == {u'dnd_enabled': True}
+
+
+def test_unhandled_events_are_not_queued():
+	meta = make_session()
+	meta.update(decode_event({u'type': u'message', u'text': u'hi'}))
+	assert not meta._pending
+
+
+def test_updates_apply_in_order_once_queue_is_full():
+	meta = make_session(channels=[{u'id': u'C1', u'name': u'a'}])
+	meta.max_pending = 3
+	meta.update(decode_event({u'type': u'channel_rename', u'channel': {u'id': u'C1', u'name': u'b'}}))
+	meta.update(decode_event({u'type': u'channel_archive', u'channel': u'C1'}))
+	assert meta.channels[u'C1'][u'name'] == u'a'
+
+	meta.update(decode_event({u'type': u'channel_rename', u'channel': {u'id': u'C1', u'name': u'c'}}))
+	assert not meta._pending
+	assert meta.channels[u'C1'][u'name'] == u'c'
+	assert meta.channels[u'C1'][u'is_archived']
+
+
+def test_bursts_of_presence_changes_are_coalesced():
+	applied = []
+
+	class RecordingSessionMetadata(ManualSessionMetadata):
+		def _update_deferred(self, event):
+			applied.append(event._b)
+			super(RecordingSessionMetadata, self)._update_deferred(event)
+
+	meta = make_session(RecordingSessionMetadata, users=[
+		{u'id': u'U1', u'name': u'a'},
+		{u'id': u'U2', u'name': u'b'},
+	])
+	meta.update(decode_event({u'type': u'presence_change', u'user': u'U1', u'presence': u'away'}))
+	meta.update(decode_event({u'type': u'presence_change', u'user': u'U2', u'presence': u'away'}))
+	meta.update(decode_event({u'type': u'presence_change', u'user': u'U1', u'presence': u'active'}))
+	meta.flush()
+
+	assert [(e[u'user'], e[u'presence']) for e in applied] == [(u'U2', u'away'), (u'U1', u'active')]
+	assert meta.users[u'U1'][u'presence'] == u'active'
@@ -0,0 +1,86 @@
+import pytest
+from helpers import FakeApi, ManualSessionMetadata
+from slackrealtime.store import CompactRecord, CompactStore, record_class
+
+
+def test_record_keeps_projected_fields():
+	store = CompactStore((u'id', u'name'), {
+		u'U1': {u'id': u'U1', u'name': u'alice', u'profile': {u'title': u'x'}},
+	})
+	record = store[u'U1']
+	assert isinstance(record, CompactRecord)
+	assert dict(record) == {u'id': u'U1', u'name': u'alice'}
+	assert u'profile' not in record
+	assert record.get(u'profile') is None
+
+
+def test_record_extra_fields():
+	record = record_class((u'id', u'name'))({u'id': u'U1'})
+	assert u'name' not in record
+	with pytest.raises(KeyError):
+		record[u'name']
+
+	record[u'name'] = u'alice'
+	record[u'presence'] = u'away'
+	assert dict(record) == {u'id': u'U1', u'name': u'alice', u'presence': u'away'}
+	assert len(record) == 3
+
+	del record[u'presence']
+	del record[u'name']
+	assert dict(record) == {u'id': u'U1'}
+	with pytest.raises(KeyError):
+		del record[u'presence']
+
+
+def test_record_class_is_shared():
+	assert record_class([u'id', u'name']) is record_class((u'id', u'name'))
+
+
+def test_record_class_clash():
+	with pytest.raises(ValueError):
+		record_class((u'id', u'keys'))
+
+
+def test_fetch_without_loader():
+	with pytest.raises(KeyError):
+		CompactStore((u'id',)).fetch(u'U1')
+
+
+def fetch_session():
+	# The blocking client has no responses, so using it fails.
+	meta = ManualSessionMetadata(dict(
+		url='wss://example.invalid/',
+		self={u'id': u'U0', u'name': u'me'},
+		team={u'id': u'T1', u'name': u'team'},
+		users=[{u'id': u'U1', u'name': u'alice'}],
+		channels=[{u'id': u'C1', u'name': u'general'}],
+	), FakeApi(), 'xoxb-test', compact=True)
+	meta.txapi = FakeApi({
+		'users.info': lambda token, user: {u'ok': True, u'user': {u'id': user, u'profile': {}}},
+		'conversations.info': lambda token, channel: {u'ok': True, u'channel': {u'id': channel, u'topic': {}}},
+	}, deferred=True)
+	return meta, meta.txapi
+
+
+def test_fetch_does_not_block():
+	meta, api = fetch_session()
+	assert isinstance(meta.users[u'U1'], CompactRecord)
+
+	results = []
+	meta.users.fetch(u'U1').addCallback(results.append)
+	meta.channels.fetch(u'C1').addCallback(results.append)
+	assert results == [
+		{u'id': u'U1', u'profile': {}},
+		{u'id': u'C1', u'topic': {}},
+	]
+	assert [name for name, params in api.calls] == ['users.info', 'conversations.info']
+
+
+def test_fetch_error():
+	meta, api = fetch_session()
+	api.responses['users.info'] = lambda token, user: {}[user]
+
+	errors = []
+	meta.users.fetch(u'U1').addErrback(errors.append)
+	assert len(errors) == 1
+	errors[0].trap(KeyError)
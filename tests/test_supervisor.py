@@ -0,0 +1,56 @@
+from helpers import Clock
+from slackrealtime import supervisor
+from slackrealtime.codec import JsonCodec
+from twisted.python.failure import Failure
+
+
+class FakeReactor(Clock):
+	def __init__(self):
+		super(FakeReactor, self).__init__()
+		self.spawned = []
+
+	def seconds(self):
+		return self.now
+
+	def spawnProcess(self, worker, *args, **kwargs):
+		self.spawned.append(worker)
+		worker.transport = object()
+
+
+def crash(sup, worker):
+	worker.transport = None
+	sup._workerEnded(worker, Failure(Exception('crashed')))
+
+
+def test_restarts_back_off(monkeypatch):
+	reactor = FakeReactor()
+	monkeypatch.setattr(supervisor, 'reactor', reactor)
+	sup = supervisor.Supervisor(workers=1, restart_delay=1., max_restart_delay=8., stable_time=60.)
+	sup.running = True
+	worker = sup.workers[0]
+	sup._spawn(worker)
+
+	delays = []
+	for i in range(6):
+		crash(sup, worker)
+		call = reactor.calls[-1]
+		delays.append(call.when - reactor.now)
+		reactor.advance(call.when - reactor.now)
+	assert delays == [1., 2., 4., 8., 8., 8.]
+	assert worker.restarts == 6
+
+	# Once it stays up for a while, the delay starts again from the beginning.
+	reactor.advance(60.)
+	crash(sup, worker)
+	assert reactor.calls[-1].when - reactor.now == 1.
+
+
+def test_frames():
+	codec = JsonCodec()
+	frames = []
+	receiver = supervisor.FrameReceiver(codec, frames.append)
+	data = supervisor.pack_frame(codec, {u'a': 1}) + supervisor.pack_frame(codec, {u'b': [2]})
+	# Frames may arrive split at any point.
+	for i in range(0, len(data), 3):
+		receiver.dataReceived(data[i:i + 3])
+	assert frames == [{u'a': 1}, {u'b': [2]}]
@@ -0,0 +1,121 @@
+from urllib.parse import parse_qs
+import pytest
+from twisted.internet import defer, task
+from twisted.python.failure import Failure
+from twisted.web.client import ResponseDone
+from twisted.web.http_headers import Headers
+from slackrealtime import txapi
+from slackrealtime.api import SlackError, SlackRateLimited
+from slackrealtime.txapi import TxSlackApi
+
+
+class FakeResponse(object):
+	def __init__(self, body, headers=None):
+		self.code = 200
+		self.phrase = b'OK'
+		self.length = len(body)
+		self.body = body
+		self.headers = Headers(headers or {})
+
+	def deliverBody(self, protocol):
+		protocol.dataReceived(self.body)
+		protocol.connectionLost(Failure(ResponseDone()))
+
+
+class FakeAgent(object):
+	"""
+	Stands in for twisted.web.client.Agent, answering requests from
+	``responses`` in turn.
+	"""
+	def __init__(self, *responses):
+		self.responses = list(responses)
+		self.requests = []
+
+	def request(self, method, uri, headers=None, bodyProducer=None):
+		self.requests.append((method, uri, headers, parse_qs(bodyProducer._inputFile.getvalue().decode('ascii'))))
+		return defer.succeed(self.responses.pop(0))
+
+
+RATE_LIMITED = FakeResponse(b'{"ok": false, "error": "ratelimited"}', {b'Retry-After': [b'3']})
+
+
+@pytest.fixture
+def clock(monkeypatch):
+	clock = task.Clock()
+	monkeypatch.setattr(txapi, 'reactor', clock)
+	return clock
+
+
+def call(d):
+	results = []
+	d.addBoth(results.append)
+	return results
+
+
+def test_call(clock):
+	agent = FakeAgent(FakeResponse(b'{"ok": true, "channel": {"id": "D1"}}'))
+	api = TxSlackApi('http://api.invalid', agent=agent)
+	results = call(api.im.open(token='t', user='U1', return_im=None, blocks=[{'type': 'divider'}]))
+	assert results == [{u'channel': {u'id': u'D1'}}]
+
+	method, uri, headers, params = agent.requests[0]
+	assert (method, uri) == (b'POST', b'http://api.invalid/im.open')
+	assert headers.getRawHeaders(b'Content-Type') == [b'application/x-www-form-urlencoded']
+	# None is left out, and lists are sent as JSON.
+	assert params == {'token': ['t'], 'user': ['U1'], 'blocks': ['[{"type":"divider"}]']}
+
+
+def test_error(clock):
+	agent = FakeAgent(FakeResponse(b'{"ok": false, "error": "user_not_found"}'))
+	results = call(TxSlackApi(agent=agent).im.open(token='t', user='U1'))
+	assert results[0].check(SlackError)
+	assert results[0].value.args == (u'user_not_found',)
+
+
+def test_retries_rate_limited_calls(clock):
+	agent = FakeAgent(RATE_LIMITED, FakeResponse(b'{"ok": true}'))
+	results = call(TxSlackApi(agent=agent).users.list(token='t'))
+	assert results == []
+	assert len(agent.requests) == 1
+
+	# Waits as long as Retry-After asks, then sends the same request again.
+	clock.advance(2.9)
+	assert len(agent.requests) == 1
+	clock.advance(.1)
+	assert results == [{}]
+	assert agent.requests[1] == agent.requests[0]
+
+
+def test_retry_after_defaults(clock):
+	agent = FakeAgent(FakeResponse(b'{"ok": false, "error": "ratelimited"}'), FakeResponse(b'{"ok": true}'))
+	results = call(TxSlackApi(agent=agent).users.list(token='t'))
+	clock.advance(txapi.TxSlackMethod.default_retry_after)
+	assert results == [{}]
+
+
+def test_gives_up_after_max_retries(clock):
+	agent = FakeAgent(*[RATE_LIMITED] * 4)
+	results = call(TxSlackApi(agent=agent).users.list(token='t'))
+	clock.pump([3.] * 3)
+	assert len(agent.requests) == 4
+	assert results[0].check(SlackRateLimited)
+	assert results[0].value.retry_after == 3.
+
+
+def test_close():
+	# Someone else owns the agent's pool.
+	assert call(TxSlackApi(agent=FakeAgent()).close()) == [None]
+
+	api = TxSlackApi(pool_size=3)
+	assert api.pool.maxPersistentPerHost == 3
+	assert len(call(api.close())) == 1
+
+
+def test_timeout(clock):
+	class SilentAgent(FakeAgent):
+		def request(self, method, uri, headers=None, bodyProducer=None):
+			return defer.Deferred()
+
+	results = call(TxSlackApi(agent=SilentAgent(), timeout=5.).users.list(token='t'))
+	clock.advance(5.)
+	assert results[0].check(defer.TimeoutError)